@@ -0,0 +1,17 @@
+from .daqbackend import daq_backend, niBackend, simBackend
+from .latency import latencyRecorder
+from .peaks import find_peaks_batch, closest_to_zero
+from .baseline import arPLSBaseline
+from .pid import pidBank
+from .params import lockParams
+from .ringbuffer import rollingStats
+from .decimate import minmax_decimate
+from .mailbox import latestMailbox, sharedMailbox
+from .hdflogger import hdfLogger
+from .recorder import flightRecorder, lockMonitor
+from .engine import lockEngine
+from .sequence import setpointSequencer, ramp, send_sequence
+from .telemetry import telemetryRing, telemetry_dtype, telemetry_ch_num
+from .loop import lockLoop, loopThread, loopProcess, run_loop_process
+from .settings import load_settings, read_settings, setting_section, cavity_section, laser_section
+from .tcpserver import tcpServer
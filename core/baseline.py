@@ -0,0 +1,102 @@
+import numpy as np
+from scipy.linalg import solveh_banded
+from scipy.special import expit
+
+
+# Asymmetrically reweighted penalized least squares (arPLS) baseline removal, fast enough to run in every cycle.
+# See https://doi.org/10.1039/C4AN01061B and https://stackoverflow.com/a/67509948 for the algorithm.
+# The pentadiagonal smoothness matrix is built once per trace length and solved with a banded Cholesky solver,
+# and weights of every channel are carried over from the last cycle, so only a few iterations are needed per cycle.
+# All channels are stacked into one block-banded system without coupling between them, so each iteration is a single solve.
+# The solve takes about 0.1 us per sample, to cap it per cycle, only some channels can be solved in every cycle, in turn,
+# the others subtract the baseline last solved for them, which is fine as long as baselines drift slowly.
+class arPLSBaseline:
+    def __init__(self, lam=1e5, ratio=1e-2, max_iter=2):
+        self.lam = lam # smoothness parameter
+        self.ratio = ratio # stop criterion
+        self.max_iter = max(int(max_iter), 1) # max number of iterations per channel per cycle, at least one
+        self.length = None
+        self.weights = None
+        self.num_iter = None
+        self.baseline = None
+        self.cold = True
+        self.next_ch = 0 # first channel to solve in next cycle, when not all of them are solved
+
+    # lam*D.T*D in upper banded form (see scipy.linalg.solveh_banded), D is the second order difference matrix,
+    # one block per channel, the off-diagonal terms at the start of every block are zero, so channels don't couple,
+    # kept in Fortran order, which LAPACK takes without a copy
+    def build(self, length, ch_num):
+        H = np.zeros((3, length), dtype=np.float64)
+        H[0, 2:] = 1
+        H[1, 1:] = -4
+        H[1, 1] = H[1, -1] = -2
+        H[2, :] = 6
+        H[2, 0] = H[2, -1] = 1
+        H[2, 1] = H[2, -2] = 5
+        self.H = np.asfortranarray(np.tile(self.lam*H, (1, ch_num)))
+        self.length = length
+        self.ab = np.empty_like(self.H)
+
+        self.weights = np.ones((ch_num, length), dtype=np.float64)
+        self.num_iter = np.zeros(ch_num, dtype=np.int64)
+        self.baseline = np.zeros((ch_num, length), dtype=np.float64) # latest baseline of every channel
+        self.cold = True # no channel has a baseline yet, all are solved in next cycle
+        self.next_ch = 0
+
+    # remove baseline of every channel (row) of data in place
+    # ch_per_cycle channels are solved, starting after the ones solved last time, 0 (or more than there are) solves all of them
+    def remove(self, data, lam=None, max_iter=None, ch_per_cycle=0):
+        if max_iter is not None:
+            # at least one solve, residuals are only computed there
+            self.max_iter = max(int(max_iter), 1)
+        if (lam is not None) and (lam != self.lam):
+            self.lam = lam
+            self.length = None
+        if (data.shape[1] != self.length) or (len(data) != len(self.weights)):
+            self.build(data.shape[1], len(data))
+
+        ch_num = len(data)
+        if self.cold or (ch_per_cycle <= 0) or (ch_per_cycle >= ch_num):
+            idx = np.arange(ch_num)
+            self.cold = False
+        else:
+            idx = (self.next_ch + np.arange(ch_per_cycle)) % ch_num
+            self.next_ch = (self.next_ch + ch_per_cycle) % ch_num
+        self.num_iter[:] = 0 # channels not solved in this cycle do 0 iterations
+
+        w = self.weights
+        # idx are channels still iterating
+        for count in range(self.max_iter):
+            # solve (W+H)z = Wy of all channels still iterating at once, blocks of H are identical, so the first ones are taken
+            y = data[idx]
+            wi = w[idx]
+            ab = self.ab[:, :y.size]
+            ab[:] = self.H[:, :y.size]
+            ab[2] += wi.ravel()
+            z = solveh_banded(ab, (wi*y).ravel(), overwrite_ab=True, check_finite=False)
+            z = z.reshape(y.shape)
+            self.baseline[idx] = z
+            d = y - z
+            self.num_iter[idx] = count + 1
+
+            # mean and std of negative residuals of every channel
+            dn = np.minimum(d, 0)
+            neg_num = np.count_nonzero(dn, axis=1)
+            m = np.sum(dn, axis=1)/np.maximum(neg_num, 1)
+            s = np.sqrt(np.maximum(np.sum(dn*dn, axis=1)/np.maximum(neg_num, 1) - m*m, 0))
+            keep = (neg_num >= 2) & (s > 0)
+            idx = idx[keep]
+            if len(idx) == 0:
+                break
+
+            m = m[keep, np.newaxis]
+            s = s[keep, np.newaxis]
+            w_new = expit(-2*(d[keep] - (2*s - m))/s)
+            crit = np.linalg.norm(w_new - wi[keep], axis=1)/np.linalg.norm(wi[keep], axis=1)
+            w[idx] = w_new
+            idx = idx[crit >= self.ratio]
+            if len(idx) == 0:
+                break
+
+        data -= self.baseline
+        return data
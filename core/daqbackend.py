@@ -0,0 +1,468 @@
+import time
+import logging
+import numpy as np
+from collections import deque
+
+# nidaqmx is only needed when real hardware is used
+try:
+    import nidaqmx
+    import nidaqmx.stream_readers
+    import nidaqmx.stream_writers
+except ImportError:
+    nidaqmx = None
+
+
+# return a DAQ backend by its name, "nidaqmx" talks to a real NI DAQ, "simulated" synthesizes cavity transmission traces
+def daq_backend(name):
+    if name == "nidaqmx":
+        return niBackend()
+    elif name == "simulated":
+        return simBackend()
+    else:
+        logging.warning(f"DAQ backend {name} not supported, use nidaqmx instead.")
+        return niBackend()
+
+# backend that creates real nidaqmx tasks, see README for how these tasks are synchronized
+class niBackend:
+    name = "nidaqmx"
+
+    def __init__(self):
+        if nidaqmx is None:
+            raise ImportError("nidaqmx is not installed, use the simulated DAQ backend instead.")
+        self.DaqError = nidaqmx.errors.DaqError
+
+    # real DAQ doesn't need to know laser wavenumbers
+    def set_wavenumbers(self, wavenumbers):
+        pass
+
+    def device_names(self):
+        return nidaqmx.system._collections.device_collection.DeviceCollection().device_names
+
+    def ai_channel_names(self, dev):
+        return nidaqmx.system._collections.physical_channel_collection.AIPhysicalChannelCollection(dev).channel_names
+
+    def ao_channel_names(self, dev):
+        return nidaqmx.system._collections.physical_channel_collection.AOPhysicalChannelCollection(dev).channel_names
+
+    def co_channel_names(self, dev):
+        return nidaqmx.system._collections.physical_channel_collection.COPhysicalChannelCollection(dev).channel_names
+
+    def pfi_lines(self, dev):
+        return [j for j in nidaqmx.system.device.Device(dev).terminals if "PFI" in j]
+
+    # ai task that handles analog read for all ai channels
+    def ai_task(self, name, channels, samp_rate, samp_num, clock_source):
+        task = nidaqmx.Task(name)
+        for ch in channels:
+            task.ai_channels.add_ai_voltage_chan(ch, min_val=-0.5, max_val=1.2, units=nidaqmx.constants.VoltageUnits.VOLTS)
+        # use the configured counter as clock and make acquisition type to be CONTINUOUS
+        task.timing.cfg_samp_clk_timing(
+                                        rate = samp_rate,
+                                        source = clock_source,
+                                        active_edge = nidaqmx.constants.Edge.RISING,
+                                        sample_mode = nidaqmx.constants.AcquisitionType.CONTINUOUS,
+                                        samps_per_chan = samp_num
+                                    )
+        return task
+
+    # reads all ai channels into a preallocated 2D float64 array, without building python lists
+    def ai_reader(self, task):
+        return nidaqmx.stream_readers.AnalogMultiChannelReader(task.in_stream)
+
+    # cavity ao task, synchronized with ai task
+    # hardware-timed laser ao channels on the same device are added to this task (laser_channels), since a device may have
+    # only one ao timing engine (e.g. M series), data are then written one row per channel, cavity first
+    # with regenerate=True, the scan written once is generated over and over from the device buffer
+    def cavity_ao_task(self, name, channel, samp_rate, samp_num, clock_source, laser_channels=(), regenerate=False):
+        task = nidaqmx.Task(name)
+        cavity_ao_ch = task.ao_channels.add_ao_voltage_chan(channel, min_val=-2.0, max_val=6.0, units=nidaqmx.constants.VoltageUnits.VOLTS)
+        # to avoid error200018
+        # https://forums.ni.com/t5/Multifunction-DAQ/poor-analog-output-performance-error-200018/td-p/1525156?profile.language=en
+        cavity_ao_ch.ao_data_xfer_mech = nidaqmx.constants.DataTransferActiveTransferMode.DMA
+        cavity_ao_ch.ao_data_xfer_req_cond = nidaqmx.constants.OutputDataTransferCondition.ON_BOARD_MEMORY_LESS_THAN_FULL
+        for ch in laser_channels:
+            task.ao_channels.add_ao_voltage_chan(ch, min_val=-2.0, max_val=2.0, units=nidaqmx.constants.VoltageUnits.VOLTS)
+        # use the configured counter as clock and make acquisition type to be CONTINUOUS
+        task.timing.cfg_samp_clk_timing(
+                                        rate = samp_rate,
+                                        source = clock_source,
+                                        active_edge = nidaqmx.constants.Edge.RISING,
+                                        sample_mode = nidaqmx.constants.AcquisitionType.CONTINUOUS,
+                                        samps_per_chan = samp_num
+                                    )
+        if regenerate:
+            task.out_stream.regen_mode = nidaqmx.constants.RegenerationMode.ALLOW_REGENERATION
+            # regenerate from the on board FIFO if the scan fits in, then it isn't transferred over the bus at all
+            if samp_num <= task.out_stream.output_onbrd_buf_size:
+                cavity_ao_ch.ao_use_only_on_brd_mem = True
+            return task
+        # disable sample regeneration
+        task.out_stream.regen_mode = nidaqmx.constants.RegenerationMode.DONT_ALLOW_REGENERATION
+        return task
+
+    # writes a preallocated 1D float64 array to the cavity ao channel, or a 2D one if laser channels are in the task too
+    def cavity_writer(self, task):
+        if len(task.ao_channels) > 1:
+            return nidaqmx.stream_writers.AnalogMultiChannelWriter(task.out_stream)
+        return nidaqmx.stream_writers.AnalogSingleChannelWriter(task.out_stream)
+
+    # laser ao task, running in "on demand" mode
+    def laser_ao_task(self, name, channels):
+        task = nidaqmx.Task(name)
+        for ch in channels:
+            task.ao_channels.add_ao_voltage_chan(ch, min_val=-2.0, max_val=2.0, units=nidaqmx.constants.VoltageUnits.VOLTS)
+        # no sample clock timing or trigger is specified, this task is running in "on demand" mode.
+        return task
+
+    # ao task of the channel that shifts a regenerated cavity scan by the feedback voltage, running in "on demand" mode
+    def cavity_offset_task(self, name, channel):
+        task = nidaqmx.Task(name)
+        task.ao_channels.add_ao_voltage_chan(channel, min_val=-2.0, max_val=6.0, units=nidaqmx.constants.VoltageUnits.VOLTS)
+        return task
+
+    # writes one float to the cavity offset ao channel
+    def cavity_offset_writer(self, task):
+        return nidaqmx.stream_writers.AnalogSingleChannelWriter(task.out_stream)
+
+    # laser ao task clocked by the counter like the cavity ao task, for laser channels on another device than the cavity ao channel,
+    # feedback voltages are written as one scan long waveform per channel, and take effect at the start of next scan
+    def timed_laser_ao_task(self, name, channels, samp_rate, samp_num, clock_source):
+        task = nidaqmx.Task(name)
+        for ch in channels:
+            task.ao_channels.add_ao_voltage_chan(ch, min_val=-2.0, max_val=2.0, units=nidaqmx.constants.VoltageUnits.VOLTS)
+        task.timing.cfg_samp_clk_timing(
+                                        rate = samp_rate,
+                                        source = clock_source,
+                                        active_edge = nidaqmx.constants.Edge.RISING,
+                                        sample_mode = nidaqmx.constants.AcquisitionType.CONTINUOUS,
+                                        samps_per_chan = samp_num
+                                    )
+        task.out_stream.regen_mode = nidaqmx.constants.RegenerationMode.DONT_ALLOW_REGENERATION
+        return task
+
+    # writes one sample per laser ao channel from a preallocated 1D float64 array (on demand task),
+    # or a 2D array of one row per channel (timed_laser_ao_task)
+    def laser_writer(self, task):
+        return nidaqmx.stream_writers.AnalogMultiChannelWriter(task.out_stream)
+
+    # counter task, used as the clock for ai task and cavity ao task
+    # a free running counter generates pulses continuously from when it starts, and needs no trigger
+    def counter_task(self, name, counter, samp_rate, samp_num, trigger_source, free_running=False):
+        task = nidaqmx.Task(name)
+        task.co_channels.add_co_pulse_chan_freq(
+                                                counter=counter,
+                                                units=nidaqmx.constants.FrequencyUnits.HZ,
+                                                freq=samp_rate,
+                                                duty_cycle=0.5)
+        if free_running:
+            task.timing.cfg_implicit_timing(sample_mode=nidaqmx.constants.AcquisitionType.CONTINUOUS)
+            return task
+        task.timing.cfg_implicit_timing(sample_mode=nidaqmx.constants.AcquisitionType.FINITE, samps_per_chan=samp_num)
+        # it will be triggered by the do channel in do task
+        task.triggers.start_trigger.cfg_dig_edge_start_trig(trigger_source=trigger_source, trigger_edge=nidaqmx.constants.Edge.RISING)
+        # make this task retriggerable
+        task.triggers.start_trigger.retriggerable = True
+        return task
+
+    # do task, used to trigger the counter, running in "on demand" mode
+    def do_task(self, name, channel):
+        task = nidaqmx.Task(name)
+        task.do_channels.add_do_chan(channel)
+        return task
+
+    # counter task that counts rising edges of an external trigger on a PFI line, read on demand, used to advance setpoint sequences
+    def edge_counter_task(self, name, counter, terminal):
+        task = nidaqmx.Task(name)
+        channel = task.ci_channels.add_ci_count_edges_chan(counter, edge=nidaqmx.constants.Edge.RISING, initial_count=0,
+                                                          count_direction=nidaqmx.constants.CountDirection.COUNT_UP)
+        channel.ci_count_edges_term = terminal
+        return task
+
+    # abort a task, see https://zone.ni.com/reference/en-XX/help/370466AH-01/mxcncpts/taskstatemodel/
+    def abort(self, task):
+        task.control(nidaqmx.constants.TaskMode.TASK_ABORT)
+
+class simDaqError(Exception):
+    pass
+
+# backend that mimics the DAQ tasks in software, so the feedback loop can run without a DAQ card
+class simBackend:
+    name = "simulated"
+
+    def __init__(self, realtime=True, seed=None):
+        self.DaqError = simDaqError
+        # if True, ai read blocks until a scan would finish on real hardware
+        self.realtime = realtime
+        self.seed = seed
+        self.wavenumbers = [15798.0]
+
+    # the first wavenumber is the frequency reference (HeNe), the rest are lasers
+    def set_wavenumbers(self, wavenumbers):
+        self.wavenumbers = list(wavenumbers)
+
+    # pretend there are four DAQ cards, so channel names in saved settings are still valid
+    def device_names(self):
+        return [f"Dev{i}" for i in range(1, 5)]
+
+    def ai_channel_names(self, dev):
+        return [f"{dev}/ai{i}" for i in range(32)]
+
+    def ao_channel_names(self, dev):
+        return [f"{dev}/ao{i}" for i in range(4)]
+
+    def co_channel_names(self, dev):
+        return [f"{dev}/ctr{i}" for i in range(2)]
+
+    def pfi_lines(self, dev):
+        return [f"/{dev}/PFI{i}" for i in range(16)]
+
+    # tasks of one lock share a simulated device, it's created along with the ai task
+    def ai_task(self, name, channels, samp_rate, samp_num, clock_source):
+        self.device = simDevice(self.wavenumbers[:len(channels)], samp_rate, samp_num, self.realtime, self.seed)
+        return simAITask(self.device)
+
+    def ai_reader(self, task):
+        return simAIReader(self.device)
+
+    def cavity_ao_task(self, name, channel, samp_rate, samp_num, clock_source, laser_channels=(), regenerate=False):
+        return simCavityAOTask(self.device, len(laser_channels) > 0, regenerate)
+
+    def cavity_writer(self, task):
+        return task
+
+    def cavity_offset_task(self, name, channel):
+        return simCavityOffsetAOTask(self.device)
+
+    def cavity_offset_writer(self, task):
+        return task
+
+    def laser_ao_task(self, name, channels):
+        return simLaserAOTask(self.device)
+
+    def timed_laser_ao_task(self, name, channels, samp_rate, samp_num, clock_source):
+        return simTimedLaserAOTask(self.device)
+
+    def laser_writer(self, task):
+        return task
+
+    def counter_task(self, name, counter, samp_rate, samp_num, trigger_source, free_running=False):
+        return simCounterTask(self.device, free_running)
+
+    def do_task(self, name, channel):
+        return simDOTask(self.device)
+
+    def edge_counter_task(self, name, counter, terminal):
+        return simEdgeCounterTask(self.device)
+
+    def abort(self, task):
+        pass
+
+# a software stand-in of a DAQ card, scanning a cavity with a HeNe laser and several other lasers coupled into it
+class simDevice:
+    def __init__(self, wavenumbers, samp_rate, samp_num, realtime, seed,
+                 hene_fsr=2.0, hene_resonance=2.9, laser_gain=0.5, finesse=100.0, noise=2e-3, baseline=0.02, drift=0.01, drift_period=30.0,
+                 trigger_period=0.1, overflow_time=1.0):
+        self.samp_rate = samp_rate
+        self.samp_num = samp_num
+        self.realtime = realtime
+        self.rng = np.random.default_rng(seed)
+        self.laser_num = len(wavenumbers) - 1
+        self.noise = noise
+        self.baseline = baseline
+        self.drift = drift
+        self.drift_period = drift_period
+        self.trigger_period = trigger_period # period of the simulated external trigger, in s
+        self.overflow_time = overflow_time # a free running counter fills the ai buffer if reads fall behind by this long, in s
+        self.free_running = False
+        self.next_start = 0.0
+        self.t0 = time.perf_counter()
+
+        # cavity piezo voltage per free spectral range scales with wavelength
+        wavenumbers = np.array(wavenumbers, dtype=np.float64)
+        self.fsr = (hene_fsr*wavenumbers[0]/wavenumbers)[:, np.newaxis]
+        # cavity piezo voltage where each laser is on resonance, when the laser piezo voltage is zero
+        self.resonance = (hene_resonance + 0.37*np.arange(len(wavenumbers)))[:, np.newaxis]
+        # laser piezo voltage shifts its resonance in units of cavity piezo voltage, the HeNe laser is not controlled
+        self.gain = np.full((len(wavenumbers), 1), laser_gain)
+        self.gain[0] = 0
+        self.height = np.full((len(wavenumbers), 1), 0.3)
+        self.height[0] = 0.5
+        self.airy_coeff = (2*finesse/np.pi)**2
+
+        self.cavity_waveform = np.zeros(samp_num, dtype=np.float64)
+        self.cavity_queue = deque()
+        # voltage of the cavity offset ao channel, summed with the cavity ao channel
+        self.cavity_offset = 0.0
+        self.laser_output = np.zeros(self.laser_num, dtype=np.float64)
+        # laser voltages written to hardware-timed laser ao channels, applied when a scan starts
+        self.laser_queue = deque()
+        # scans that have been triggered but not read yet, (end time, cavity waveform, laser output)
+        self.pending = deque()
+
+    # the counter is triggered (at time t, or now), a scan starts with the current ao data
+    def trigger(self, t=None):
+        if self.cavity_queue:
+            self.cavity_waveform = self.cavity_queue.popleft()
+        if self.laser_queue:
+            self.laser_output[:] = self.laser_queue.popleft()
+        if t is None:
+            t = time.perf_counter()
+        cavity_waveform = self.cavity_waveform + self.cavity_offset if self.cavity_offset else self.cavity_waveform
+        self.pending.append((t + self.samp_num/self.samp_rate, cavity_waveform, self.laser_output.copy()))
+
+    # the counter starts running continuously, scans (of samp_num samples, i.e. one cycle) follow each other without triggers
+    def free_run(self):
+        self.free_running = True
+        self.free_run_start = self.next_start = time.perf_counter()
+
+    # a streamed (non-regenerated) ao task that has written data of "written" scans so far underflows
+    # if a free running counter has started a scan that has no data yet, it then fails at every write, as nidaqmx does
+    def check_underflow(self, written):
+        if self.free_running and written < int((time.perf_counter() - self.free_run_start)*self.samp_rate/self.samp_num) + 1:
+            raise simDaqError("Simulated DAQ: ao buffer underflow, writes fell behind the free running counter.")
+
+    def acquire(self, timeout, out=None):
+        if self.free_running:
+            # next scan started when the last one ended, whether or not it has been read
+            if time.perf_counter() - self.next_start > self.overflow_time:
+                raise simDaqError("Simulated DAQ: ai buffer overflow, reads fell behind the free running counter.")
+            self.trigger(self.next_start)
+            self.next_start += self.samp_num/self.samp_rate
+        if not self.pending:
+            if self.realtime:
+                time.sleep(timeout)
+            raise simDaqError("Simulated DAQ: ai read timed out, no scan was triggered.")
+        t_end, cavity_waveform, laser_output = self.pending.popleft()
+        if self.realtime:
+            dt = t_end - time.perf_counter()
+            if dt > 0:
+                time.sleep(dt)
+        return self.synthesize(cavity_waveform, laser_output, t_end, out)
+
+    # photodiode voltages of all channels in one scan, Airy function of cavity piezo voltage for each laser
+    def synthesize(self, cavity_waveform, laser_output, t, out=None):
+        drift = self.drift*np.sin(2*np.pi*(t-self.t0)/self.drift_period)
+        shift = np.zeros((self.laser_num+1, 1), dtype=np.float64)
+        shift[1:, 0] = laser_output
+        phase = np.pi*(cavity_waveform[np.newaxis, :] + drift + self.gain*shift - self.resonance)/self.fsr
+        data = np.divide(self.height, 1 + self.airy_coeff*np.sin(phase)**2, out=out)
+        data += self.baseline + self.noise*self.rng.standard_normal(data.shape)
+        return data
+
+class simTask:
+    def __init__(self, device):
+        self.device = device
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    def control(self, action):
+        pass
+
+class simCounterTask(simTask):
+    def __init__(self, device, free_running=False):
+        super().__init__(device)
+        self.free_running = free_running
+
+    # a retriggerable counter waits for the do task, a free running one starts scanning right away
+    def start(self):
+        if self.free_running:
+            self.device.free_run()
+
+class simAITask(simTask):
+    # return nested lists as nidaqmx does
+    def read(self, number_of_samples_per_channel, timeout=10.0):
+        data = self.device.acquire(timeout)
+        if len(data) == 1:
+            return data[0].tolist()
+        return data.tolist()
+
+# mimics nidaqmx.stream_readers.AnalogMultiChannelReader
+class simAIReader:
+    def __init__(self, device):
+        self.device = device
+
+    def read_many_sample(self, data, number_of_samples_per_channel=-1, timeout=10.0):
+        self.device.acquire(timeout, out=data)
+        return data.shape[1]
+
+# simulated ao tasks also act as their stream writers
+class simCavityAOTask(simTask):
+    def __init__(self, device, with_lasers=False, regenerate=False):
+        super().__init__(device)
+        self.with_lasers = with_lasers
+        self.regenerate = regenerate
+        self.written = 0 # number of waveforms written, i.e. scans that have ao data
+
+    # without regeneration, each written waveform is used by one scan, with regeneration, it's used by all scans from the next one on
+    # with laser channels in this task, data has one row per channel, lasers take the first sample of their rows when the scan starts
+    def write(self, data, auto_start=False):
+        data = np.array(data, dtype=np.float64)
+        if self.regenerate:
+            self.device.cavity_queue.clear()
+            self.device.cavity_waveform = data
+            return len(data)
+        self.device.check_underflow(self.written)
+        self.written += 1
+        if self.with_lasers:
+            self.device.cavity_queue.append(data[0])
+            self.device.laser_queue.append(data[1:, 0])
+            return data.shape[1]
+        self.device.cavity_queue.append(data)
+        return len(data)
+
+    def write_many_sample(self, data, timeout=10.0):
+        return self.write(data)
+
+class simCavityOffsetAOTask(simTask):
+    # "on demand" mode, the new voltage shifts the cavity scan from next scan on
+    def write(self, data, auto_start=False):
+        self.device.cavity_offset = float(data)
+        return 1
+
+    def write_one_sample(self, data, timeout=10):
+        return self.write(data)
+
+class simLaserAOTask(simTask):
+    # "on demand" mode, new voltages are applied immediately
+    def write(self, data, auto_start=False):
+        self.device.laser_output[:] = data
+        return 1
+
+    def write_one_sample(self, data, timeout=10):
+        return self.write(data)
+
+# hardware-timed laser ao channels, one row per channel, the first sample of every row is applied when next scan starts
+class simTimedLaserAOTask(simTask):
+    def __init__(self, device):
+        super().__init__(device)
+        self.written = 0
+
+    def write(self, data, auto_start=False):
+        self.device.check_underflow(self.written)
+        self.written += 1
+        data = np.array(data, dtype=np.float64)
+        self.device.laser_queue.append(data[:, 0])
+        return data.shape[1]
+
+    def write_many_sample(self, data, timeout=10.0):
+        return self.write(data)
+
+class simDOTask(simTask):
+    # a rising edge triggers the counter
+    def write(self, data, auto_start=False):
+        for prev, curr in zip(data[:-1], data[1:]):
+            if curr and not prev:
+                self.device.trigger()
+        return len(data)
+
+class simEdgeCounterTask(simTask):
+    # an external trigger with a rising edge every trigger_period seconds, counted from when the task starts
+    def start(self):
+        self.t_start = time.perf_counter()
+
+    def read(self, number_of_samples_per_channel=1, timeout=10.0):
+        return int((time.perf_counter() - self.t_start)/self.device.trigger_period)
@@ -0,0 +1,30 @@
+import numpy as np
+
+
+# Min/max decimation of traces for plotting, so narrow peaks survive down-sampling.
+# data is split into bins along the last axis, and the min and max of every bin are kept in their original order.
+# Returns sample indices of shape (..., 2*bins), use them on both x and y, e.g. np.take_along_axis(data, idx, axis=-1).
+# If data is already short enough, all indices are returned.
+def minmax_decimate(data, bins):
+    data = np.asarray(data)
+    length = data.shape[-1]
+    bins = max(int(bins), 1)
+    if length <= 2*bins:
+        return np.broadcast_to(np.arange(length), data.shape)
+
+    bin_size = -(-length // bins) # ceil division
+    full = length // bin_size
+    rows = data[..., :full*bin_size].reshape(data.shape[:-1] + (full, bin_size))
+    offset = np.arange(full)*bin_size
+    i_min = np.argmin(rows, axis=-1) + offset
+    i_max = np.argmax(rows, axis=-1) + offset
+
+    # samples left over in a last partial bin
+    if full*bin_size < length:
+        tail = data[..., full*bin_size:]
+        i_min = np.concatenate((i_min, np.argmin(tail, axis=-1)[..., None] + full*bin_size), axis=-1)
+        i_max = np.concatenate((i_max, np.argmax(tail, axis=-1)[..., None] + full*bin_size), axis=-1)
+
+    # keep min and max in time order, so the curve is drawn back and forth correctly
+    idx = np.stack((np.minimum(i_min, i_max), np.maximum(i_min, i_max)), axis=-1)
+    return idx.reshape(idx.shape[:-2] + (-1,))
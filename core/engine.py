@@ -0,0 +1,114 @@
+import numpy as np
+
+from .peaks import find_peaks_batch, closest_to_zero
+from .baseline import arPLSBaseline
+from .pid import pidBank
+
+
+# Processing of one feedback loop cycle, from raw traces to feedback voltages: chop, baseline removal, peak finding and PID.
+# It doesn't know where traces come from, so the same code runs in the live loop (lockLoop) and in offline replay (replay.py).
+# params is the initial parameter snapshot (lockParams), see set_params() to change it.
+# latency is a latencyRecorder (or anything that has a mark(stage) method), stages "convert", "baseline", "peaks" and "pid" are marked.
+class lockEngine:
+    def __init__(self, laser_num, params, latency, cavity_last_feedback=0.0, laser_last_feedback=None):
+        self.laser_num = laser_num
+        self.latency = latency
+        self.params = None
+        # laser setpoints (MHz) used in this cycle, from the parameter snapshot, unless the loop overrides them (e.g. by a setpoint sequence)
+        self.laser_setpoint = np.zeros(laser_num, dtype=np.float64)
+
+        # PID controllers, feedback voltage from last run can be used as the initial feedback voltage, to avoid laser freq jump
+        self.cavity_pid = pidBank(1, [cavity_last_feedback])
+        self.laser_pid = pidBank(laser_num, laser_last_feedback)
+        self.set_params(params)
+        # arPLS baseline removal keeps its weights between cycles
+        self.baseline = arPLSBaseline()
+
+        self.cavity_output = self.cavity_pid.hold()[0]
+        self.laser_output = self.laser_pid.hold() # always the same array, updated in place
+        self.cavity_peak_found = False
+        self.laser_peak_found = np.zeros(laser_num, dtype=np.bool_) # initially all False
+        self.cavity_first_peak = np.nan # in ms
+        self.cavity_pk_sep = np.nan # in ms
+
+        # errors, outputs and peak found flags of cavity and all lasers in one cycle, see status()
+        self.channel_err = np.zeros(laser_num+1, dtype=np.float64)
+        self.channel_output = np.zeros(laser_num+1, dtype=np.float64)
+        self.channel_found = np.zeros(laser_num+1, dtype=np.bool_)
+
+    # use a new parameter snapshot (lockParams), PID gains are only reloaded when it changes
+    def set_params(self, params):
+        if params is not self.params:
+            self.cavity_pid.set_gains(*params.cavity_gains)
+            self.laser_pid.set_gains(*params.laser_gains)
+            self.laser_setpoint[:] = params.laser_setpoint
+            self.params = params
+
+    # process traces of one cycle, one row per channel (cavity first), baseline is removed in place
+    # returns the chopped traces, a view into pd_buffer
+    def process(self, pd_buffer):
+        params = self.params
+        latency = self.latency
+
+        # chop array, because the beginning part of the data array usually have undesired peaks
+        pd_data = pd_buffer[:, params.start_length:]
+        latency.mark("convert")
+
+        # remove baseline
+        if params.baseline_remove:
+            if params.baseline_method == "arPLS":
+                # weights are carried over from last cycle, iterations and channels solved per cycle are capped to keep loop rate
+                self.baseline.remove(pd_data, lam=params.arpls_lam, max_iter=params.arpls_max_iter, ch_per_cycle=params.arpls_channels)
+            else:
+                pd_data -= np.mean(pd_data, axis=1, keepdims=True)
+        latency.mark("baseline")
+
+        # find cavity and laser peaks using "peak height/width" criteria, all channels at once
+        peaks, peak_num = find_peaks_batch(pd_data, params.peak_height, params.peak_width)
+        # peaks of channel i are peaks[peak_idx[i]:peak_idx[i+1]]
+        peak_idx = np.concatenate(([0], np.cumsum(peak_num)))
+        cavity_peaks = peaks[peak_idx[0]:peak_idx[1]]
+        latency.mark("peaks")
+
+        # normally this frequency lock method requires two cavity scanning peaks
+        if len(cavity_peaks) == 2:
+            self.cavity_peak_found = True
+            # convert the position of the first peak into unit ms
+            self.cavity_first_peak = cavity_peaks[0]*params.sample_to_ms
+            # convert the separation of peaks into unit ms
+            self.cavity_pk_sep = (cavity_peaks[1] - cavity_peaks[0])*params.sample_to_ms
+            # calculate cavity error signal in unit MHz
+            cavity_err = (params.cavity_setpoint - self.cavity_first_peak)/self.cavity_pk_sep*params.cavity_fsr
+            self.cavity_output = self.cavity_pid.update(np.array([cavity_err]), True)[0]
+
+            # calculate laser frequency error signal of every laser peak
+            laser_peak_num = peak_num[1:]
+            laser_ch = np.repeat(np.arange(self.laser_num), laser_peak_num)
+            laser_err = self.laser_setpoint[laser_ch] - (peaks[peak_idx[1]:]*params.sample_to_ms-self.cavity_first_peak)/self.cavity_pk_sep*params.laser_freq_scale[laser_ch]
+            # use the peak that's closest to the setpoint
+            laser_err = closest_to_zero(laser_err, laser_peak_num)
+            self.laser_peak_found[:] = laser_peak_num > 0
+            self.laser_pid.update(laser_err, self.laser_peak_found)
+
+        else:
+            self.cavity_peak_found = False
+            # otherwise use feedback voltage from last cycle
+            self.cavity_first_peak = cavity_peaks[0]*params.sample_to_ms if len(cavity_peaks)>0 else np.nan # in ms
+            self.cavity_pk_sep = np.nan
+            self.cavity_output = self.cavity_pid.hold()[0]
+            self.laser_peak_found[:] = False
+            self.laser_pid.hold()
+        latency.mark("pid")
+
+        return pd_data
+
+    # latest errors (MHz), outputs (V) and peak found flags of cavity and all lasers, cavity first
+    # arrays are reused in every cycle
+    def status(self):
+        self.channel_err[0] = self.cavity_pid.last_err[1, 0]
+        self.channel_err[1:] = self.laser_pid.last_err[1]
+        self.channel_output[0] = self.cavity_output
+        self.channel_output[1:] = self.laser_output
+        self.channel_found[0] = self.cavity_peak_found
+        self.channel_found[1:] = self.laser_peak_found
+        return self.channel_err, self.channel_output, self.channel_found
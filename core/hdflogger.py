@@ -0,0 +1,120 @@
+import time
+import queue
+import logging
+import threading
+import numpy as np
+import h5py
+
+
+# A background thread that appends rows into monthly hdf files, one dataset per day,
+# e.g. rows logged on Jan 24 2024 go to dataset "Jan24" in file <prefix>_2024Jan.hdf.
+# Rows come in through a bounded queue, so the thread that logs them never waits for disk I/O,
+# rows are dropped (and counted) if the queue is full. The file is kept open and rows are written in batches.
+# fields are (name, type) of logged values, a "time" field is always added in front of them.
+class hdfLogger(threading.Thread):
+    def __init__(self, prefix, fields, queue_size=100000, batch_size=1000, flush_time=1.0):
+        super().__init__(name="hdf logger", daemon=True)
+        self.prefix = prefix
+        self.dtype = np.dtype([('time', h5py.string_dtype(encoding='utf-8'))] + list(fields))
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size # max number of rows written at once
+        self.flush_time = flush_time # max time (in s) a row stays in memory before written into the file
+        self.dropped = 0
+        self.written = 0
+
+        self.active = False
+        self.file = None
+        self.file_name = None
+        self.dsets = {} # dataset of each day in the current file
+
+    # queue a row, the first element is the unix time it's taken at, followed by values of all other fields
+    def log(self, t, *values):
+        try:
+            self.queue.put_nowait((t,) + values)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        self.active = True
+        super().start()
+
+    # write all queued rows and close the file
+    def stop(self):
+        self.active = False
+        if self.ident is not None:
+            self.join()
+        if self.dropped:
+            logging.warning(f"hdf logger dropped {self.dropped} rows because of a full queue.")
+
+    def run(self):
+        batch = []
+        last_flush = time.monotonic()
+        while self.active or not self.queue.empty():
+            try:
+                batch.append(self.queue.get(timeout=0.1))
+            except queue.Empty:
+                pass
+
+            if batch and ((len(batch) >= self.batch_size) or (time.monotonic() - last_flush > self.flush_time) or not self.active):
+                try:
+                    self.write(batch)
+                except Exception as err:
+                    logging.error(f"hdf logger failed to write {len(batch)} rows: {err}")
+                batch = []
+                last_flush = time.monotonic()
+
+        self.close()
+
+    # write rows, split by the file and dataset they belong to
+    def write(self, batch):
+        start = 0
+        while start < len(batch):
+            t = time.localtime(batch[start][0])
+            file_name = self.prefix + "_" + time.strftime("%Y%b", t) + ".hdf"
+            key = time.strftime("%b%d", t)
+            # rows are in time order, so rows of the same day are next to each other
+            stop = start + 1
+            while (stop < len(batch)) and (time.strftime("%b%d", time.localtime(batch[stop][0])) == key):
+                stop += 1
+
+            dset = self.dataset(file_name, key)
+            rows = np.empty(stop-start, dtype=self.dtype)
+            for i, row in enumerate(batch[start:stop]):
+                rows[i] = (time.strftime("%H:%M:%S", time.localtime(row[0])) + ".{:03d}".format(int(row[0] % 1 * 1000)),) + row[1:]
+            dset.resize(dset.shape[0]+len(rows), axis=0)
+            dset[-len(rows):] = rows
+            self.written += len(rows)
+            start = stop
+
+        self.file.flush()
+
+    # dataset of a day, open a new file at the beginning of a month
+    def dataset(self, file_name, key):
+        if file_name != self.file_name:
+            self.close()
+            self.file = h5py.File(file_name, "a")
+            self.file_name = file_name
+        if key in self.dsets:
+            return self.dsets[key]
+
+        # if the number of lasers changes, data can't be written to the old dset, because of its different format
+        # search for a dset that has the right format, otherwise create a new one
+        # dset is named after time.strftime("%b%d") or time.strftime("%b%d") + f"_{counter}" (e.g. Jan24 or Jan24_2)
+        name = key
+        counter = 2
+        while (name in self.file.keys()) and (self.file[name].dtype.names != self.dtype.names):
+            name = key + f"_{counter}"
+            counter += 1
+        if name in self.file.keys():
+            dset = self.file[name]
+        else:
+            dset = self.file.create_dataset(name, shape=(0,), dtype=self.dtype, maxshape=(None,), chunks=(self.batch_size,), compression="gzip", compression_opts=4)
+        self.dsets[key] = dset
+        return dset
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.file = None
+        self.file_name = None
+        self.dsets = {}
@@ -0,0 +1,94 @@
+import time
+import logging
+import threading
+import numpy as np
+
+
+# time spent in each stage of the feedback loop, kept in rolling histograms
+class latencyRecorder:
+    stages = ("trigger", "read", "convert", "baseline", "peaks", "pid", "ao write", "other", "cycle")
+
+    def __init__(self, length=10000, bins_per_decade=40):
+        self.length = length
+        self.index = {stage: i for i, stage in enumerate(self.stages)}
+        self.stage_num = len(self.stages)
+
+        # log-spaced histogram bin edges from 1 us to 1 s (in ms), values outside fall into the first/last bin
+        self.edges = np.logspace(-3, 3, 6*bins_per_decade+1)
+        self.centers = np.sqrt(self.edges[:-1]*self.edges[1:])
+        self.counts = np.zeros((self.stage_num, len(self.centers)), dtype=np.int64)
+
+        # raw stage times (in ms) and their histogram bins of the latest "length" cycles
+        self.samples = np.zeros((self.stage_num, length), dtype=np.float64)
+        self.sample_bins = np.zeros((self.stage_num, length), dtype=np.intp)
+        self.timestamps = np.zeros(length, dtype=np.float64)
+        self.cycle = 0
+
+        self.current = np.zeros(self.stage_num, dtype=np.float64)
+        self.last = time.perf_counter()
+
+    # reset the reference time, call it right before the loop starts
+    def start(self):
+        self.current[:] = 0
+        self.last = time.perf_counter()
+
+    # attribute time elapsed since the last mark to a stage, stages can be marked multiple times in a cycle
+    def mark(self, stage):
+        t = time.perf_counter()
+        self.current[self.index[stage]] += t - self.last
+        self.last = t
+
+    # save stage times of this cycle and start a new one
+    def end_cycle(self):
+        self.mark("other")
+        self.current *= 1000 # in ms
+        self.current[-1] = np.sum(self.current[:-1])
+
+        i = self.cycle % self.length
+        bins = np.clip(np.searchsorted(self.edges, self.current) - 1, 0, len(self.centers)-1)
+        stage_idx = np.arange(self.stage_num)
+        if self.cycle >= self.length:
+            # remove the oldest cycle from histograms
+            self.counts[stage_idx, self.sample_bins[:, i]] -= 1
+        self.counts[stage_idx, bins] += 1
+        self.samples[:, i] = self.current
+        self.sample_bins[:, i] = bins
+        self.timestamps[i] = self.last
+
+        self.cycle += 1
+        self.current[:] = 0
+        # time spent on the bookkeeping above goes into "other" of next cycle, instead of its first stage
+        t = time.perf_counter()
+        self.current[self.index["other"]] = t - self.last
+        self.last = t
+
+    # percentiles (0-100) of every stage time in ms, estimated from histograms, shape (num of stages, num of percentiles)
+    def percentiles(self, q=(50, 99)):
+        cum = np.cumsum(self.counts, axis=1)
+        total = cum[:, -1:]
+        if total[0, 0] == 0:
+            return np.full((self.stage_num, len(q)), np.nan)
+        target = np.array(q, dtype=np.float64)[np.newaxis, :]/100*total
+        # first bin whose cumulative count reaches the target
+        idx = np.sum(cum[:, np.newaxis, :] < target[:, :, np.newaxis], axis=2)
+        return self.centers[np.clip(idx, 0, len(self.centers)-1)]
+
+    # raw stage times in chronological order, shape (num of cycles, 1 + num of stages)
+    def history(self):
+        n = min(self.cycle, self.length)
+        start = self.cycle % self.length if self.cycle >= self.length else 0
+        order = (np.arange(n) + start) % self.length
+        return np.column_stack((self.timestamps[order], self.samples[:, order].T))
+
+    # dump raw stage times into a csv file, in background if the caller can't wait for the file to be written (history is copied first)
+    def dump(self, file_name, background=False):
+        history = self.history()
+        if background:
+            threading.Thread(target=self.save, args=(file_name, history), name="latency dump", daemon=True).start()
+        else:
+            self.save(file_name, history)
+
+    def save(self, file_name, history):
+        header = "perf_counter/s, " + ", ".join(f"{stage}/ms" for stage in self.stages)
+        np.savetxt(file_name, history, delimiter=", ", header=header, fmt="%.6f")
+        logging.info(f"feedback loop latency saved to {file_name}")
@@ -0,0 +1,634 @@
+import os
+import sys
+import time
+import queue
+import threading
+import multiprocessing
+import logging
+import traceback
+import ctypes
+import numpy as np
+
+from .daqbackend import daq_backend
+from .latency import latencyRecorder
+from .mailbox import latestMailbox, sharedMailbox
+from .hdflogger import hdfLogger
+from .recorder import flightRecorder, lockMonitor
+from .engine import lockEngine
+from .telemetry import telemetryRing
+from .sequence import setpointSequencer
+
+
+# The feedback loop that interfaces with DAQ: acquire traces, run them through lockEngine and write feedback voltages, until told to stop.
+# It doesn't depend on the GUI, so it can run in a thread (loopThread) or in a process of its own (loopProcess).
+# All configuration comes from the parameter snapshot (lockParams) it's created with.
+# Loop status of every cycle is posted into mailbox (latestMailbox or sharedMailbox), and commands are taken from commands (a queue) between cycles:
+#   ("params", lockParams): use a new parameter snapshot from next cycle on
+#   ("clear feedback", ch): reset feedback voltage of a channel, 0 is cavity, i is laser i-1
+#   ("dump latency", file_name): save time spent in each stage of latest cycles into a csv file
+#   ("sequence", laser, freqs, dwells, trigger, repeat): step a laser's setpoint through a sequence, see setpointSequencer,
+#       freqs of None (or empty) cancels it, a plain setpoint of the laser is followed by such a command
+#   ("stop",): finish the current cycle, close all DAQ tasks and return
+# If telemetry (a telemetryRing) is given, a compact record of every cycle is also written into it, for TCP telemetry subscribers.
+class lockLoop:
+    def __init__(self, params, backend, mailbox, commands, cavity_last_feedback=0.0, laser_last_feedback=None, telemetry=None):
+        self.params = params
+        self.config = params.config
+        self.cavity_config = params.cavity_config
+        self.laser_configs = params.laser_configs
+        self.mailbox = mailbox
+        self.commands = commands
+        self.telemetry = telemetry
+        self.cavity_last_feedback = cavity_last_feedback
+        self.laser_last_feedback = laser_last_feedback
+        self.active = True
+        self.counter = 0
+        self.err_counter = 1
+        self.samp_rate = self.config["sampling rate"]
+        self.dt = 1.0/self.samp_rate
+        # number of samples per scan
+        self.samp_num = params.samp_num
+        self.laser_num = len(self.laser_configs)
+        # scans are started either by "software", which pulses the trigger channel to retrigger the counter for every scan,
+        # or the counter is "free running" and a new scan starts every cycle period without any software action.
+        # A free running cycle is one scan followed by idle samples (ao channels hold their last values), and the loop
+        # reads and writes one cycle of data at a time, so the whole cycle is kept in lockstep with the hardware clock.
+        self.free_running = self.config["trigger mode"] == "free running"
+        self.cycle_samp_num = self.samp_num
+        if self.free_running:
+            self.cycle_samp_num = round(self.config["cycle period"]/1000*self.samp_rate)
+            if self.cycle_samp_num < self.samp_num:
+                if self.config["cycle period"] > 0:
+                    logging.warning(f"cycle period {self.config['cycle period']} ms is shorter than scan time, use scan time instead.")
+                self.cycle_samp_num = self.samp_num
+        cycle_time = self.cycle_samp_num/self.samp_rate*1000 if self.free_running else self.config["scan time"] # in ms
+        # a free running counter doesn't wait for software, so ao data are written this many cycles ahead of it (at least "ao lead"),
+        # a longer stall of the loop underflows the ao buffer, which stops the loop
+        self.ao_lead = max(2, int(np.ceil(self.config["ao lead"]/cycle_time))) if self.free_running else 1
+        # log laser frequency and cavity PZT voltage into hdf files in a background thread
+        fields = [('cavity DAQ voltage/V', 'f')] + [(f'laser{i} freq/MHz', 'f') for i in range(self.laser_num)]
+        self.logger = hdfLogger(self.config["hdf_filename"], fields)
+        # keep raw traces and status of latest cycles in memory, and save them when any channel loses lock
+        recorder_cycles = int(np.ceil(self.config["recorder length"]*1000/cycle_time))
+        self.recorder = flightRecorder(recorder_cycles, self.laser_num+1, self.samp_num) if recorder_cycles > 0 else None
+        self.lock_monitor = lockMonitor(self.config["RMS length"], self.laser_num+1)
+        # laser setpoint sequences, optionally advanced by trigger edges counted by a spare counter
+        self.sequencer = setpointSequencer(self.laser_num)
+        self.trigger_edges = 0
+
+        # real or simulated DAQ, the simulated one needs laser wavenumbers to place transmission peaks
+        self.backend = backend
+        self.backend.set_wavenumbers([self.cavity_config["wavenumber"]] + [laser["wavenumber"] for laser in self.laser_configs])
+
+        # laser ao channels are either updated "on demand" by software, or "hardware timed" on the counter clock,
+        # then new feedback voltages take effect at the start of next scan, like the cavity feedback does.
+        # A device can have only one ao timing engine (e.g. M series), so timed laser channels on the cavity ao device join the cavity ao task.
+        self.laser_ao_timed = self.config["laser ao mode"] == "hardware timed" and self.laser_num > 0
+        cavity_device = device_name(self.cavity_config["daq ao"])
+        self.laser_ao_combined = self.laser_ao_timed and all(device_name(laser["daq ao"]) == cavity_device for laser in self.laser_configs)
+
+        # the cavity scan is either "streamed", the sawtooth shifted by the feedback voltage is written in every cycle,
+        # or "regenerated" by the device from its buffer, where the sawtooth is written once, and only the feedback voltage is written
+        # in every cycle, on demand, to "cavity offset ao", a channel that is summed with the scan outside DAQ (e.g. by the piezo driver)
+        self.cavity_ao_regen = self.config["cavity ao mode"] == "regenerated"
+        if self.cavity_ao_regen and self.config["cavity offset ao"] == "None":
+            logging.error("regenerated cavity scan needs a cavity offset ao channel, stream it instead.")
+            self.cavity_ao_regen = False
+        if self.cavity_ao_regen and self.laser_ao_combined:
+            # they would have to be written into the regenerated buffer
+            logging.warning("laser ao channels on the cavity ao device can't be hardware timed with a regenerated cavity scan, update them on demand.")
+            self.laser_ao_timed = self.laser_ao_combined = False
+        if self.cavity_ao_regen and self.free_running:
+            # offset writes aren't synchronized with a free running counter, they land wherever the cycle is
+            logging.warning("with a regenerated cavity scan and a free running counter, cavity offset updates land at arbitrary points of a cycle "
+                            "and shift peaks of the scan being acquired, unless the cycle period leaves idle time for them.")
+
+        # initialize all DAQ tasks
+        self.ai_task_init() # read data for cavity and all lasers
+        self.cavity_ao_task_init() # cavity sanning voltage, synchronized with ai_task
+        self.laser_ao_task_init() # control laser piezo voltage, running in "on demand" mode, or hardware timed
+        self.cavity_offset_task_init() # cavity feedback voltage on top of a regenerated scan, running in "on demand" mode
+        self.counter_task_init() # configure a counter to use as the clock for ai_task and cavity_ao_task, for synchronization and retriggerability
+        self.do_task_init() # trigger the counter to generate a pulse train, running in "on demand" mode, not used if the counter is free running
+        self.edge_counter_task_init() # count external trigger edges for setpoint sequences, if a counter is assigned
+
+    # keys, shapes and dtypes of the loop status posted in every cycle, for mailboxes that need them in advance (sharedMailbox)
+    # transmission traces are chopped by "scan ignore", so their last axis can be shorter than samp_num
+    @staticmethod
+    def frame_fields(laser_num, samp_num):
+        return [
+                ("cavity pd_data", (samp_num,), np.float64),
+                ("cavity first peak", (), np.float64),
+                ("cavity pk sep", (), np.float64),
+                ("cavity error", (), np.float64),
+                ("cavity output", (), np.float64),
+                ("cavity peak found", (), np.bool_),
+                ("laser pd_data", (laser_num, samp_num), np.float64),
+                ("laser error", (laser_num,), np.float64),
+                ("laser output", (laser_num,), np.float64),
+                ("laser peak found", (laser_num,), np.bool_),
+                ("latency", (len(latencyRecorder.stages), 2), np.float64),
+                ]
+
+    # run the loop until a "stop" command, returns feedback voltages of cavity and lasers, to be used as the initial ones of next run
+    def run(self):
+        # time spent in each stage of every cycle
+        self.latency = latencyRecorder()
+
+        # peak finding and PID of every cycle, use feedback voltage from last run as the initial feedback voltage of this run, to avoid laser freq jump
+        self.engine = lockEngine(self.laser_num, self.params, self.latency, self.cavity_last_feedback, self.laser_last_feedback)
+        if self.recorder is not None:
+            self.recorder.record_params(self.params)
+
+        try:
+            self.loop()
+        finally:
+            # close all tasks and release resources when this loop finishes
+            self.ai_task.close()
+            self.cavity_ao_task.close()
+            if self.laser_ao_task is not None:
+                self.laser_ao_task.close()
+            if self.cavity_offset_task is not None:
+                self.cavity_offset_task.close()
+            self.counter_task.close()
+            if self.do_task is not None:
+                self.do_task.close()
+            if self.edge_counter_task is not None:
+                self.edge_counter_task.close()
+            self.counter = 0
+
+            # write all remaining log rows and close the log file
+            self.logger.stop()
+            if self.recorder is not None:
+                self.recorder.join()
+
+        return self.engine.cavity_pid.last_feedback[0], self.engine.laser_pid.last_feedback.copy()
+
+    def loop(self):
+        # cavity scanning voltage, reversed sawtooth wave, which stays at its end (0 V) for the rest of a free running cycle
+        self.cavity_scan = np.zeros(self.cycle_samp_num, dtype=np.float64)
+        self.cavity_scan[:self.samp_num] = np.linspace(self.config["scan amp"], 0, self.samp_num, dtype=np.float64)
+
+        # ao data are written from preallocated buffers through stream writers, cavity_row = cavity_scan + cavity_output
+        # hardware-timed laser channels get one cycle long constant waveform each, in laser_rows
+        self.cavity_writer = self.backend.cavity_writer(self.cavity_ao_task)
+        self.laser_writer = self.backend.laser_writer(self.laser_ao_task) if self.laser_ao_task is not None else None
+        self.cavity_offset_writer = self.backend.cavity_offset_writer(self.cavity_offset_task) if self.cavity_offset_task is not None else None
+        if self.laser_ao_combined:
+            self.cavity_waveform = np.empty((self.laser_num+1, self.cycle_samp_num), dtype=np.float64)
+            self.cavity_row = self.cavity_waveform[0]
+            self.laser_rows = self.cavity_waveform[1:]
+        else:
+            self.cavity_waveform = np.empty(self.cycle_samp_num, dtype=np.float64)
+            self.cavity_row = self.cavity_waveform
+            self.laser_rows = np.empty((self.laser_num, self.cycle_samp_num), dtype=np.float64) if self.laser_ao_timed else None
+
+        # a free running counter doesn't wait for software, so ao data of the first ao_lead cycles are written in advance,
+        # and from then on one write per read keeps them ao_lead cycles ahead
+        for i in range(self.ao_lead):
+            self.laser_ao_write()
+            if not self.cavity_ao_regen:
+                self.fill_cavity_waveform()
+                self.cavity_writer.write_many_sample(self.cavity_waveform)
+        if self.cavity_ao_regen:
+            # the device repeats it for every scan (cycle) from now on
+            self.cavity_writer.write_many_sample(self.cavity_scan)
+            self.cavity_offset_write()
+
+        # start all tasks
+        self.ai_task.start()
+        self.cavity_ao_task.start()
+        if self.laser_ao_task is not None:
+            self.laser_ao_task.start()
+        if self.cavity_offset_task is not None:
+            self.cavity_offset_task.start()
+        if self.do_task is not None:
+            self.do_task.start()
+        if self.edge_counter_task is not None:
+            self.edge_counter_task.start()
+
+        # ai data of all channels are read into these buffers, one row per channel
+        # in pipelined mode, two pd buffers are used alternately, one is being processed while the next scan is acquired
+        # a free running cycle is read as a whole, only its first samp_num samples (the scan) are processed
+        self.ai_reader = self.backend.ai_reader(self.ai_task)
+        self.pd_buffers = [np.zeros((self.laser_num+1, self.cycle_samp_num), dtype=np.float64) for i in range(2)]
+        self.ai_buffer = np.zeros((self.laser_num+1, self.cycle_samp_num), dtype=np.float64)
+        # pipelined mode can't be turned on/off while running
+        # a free running counter already acquires next scan while this one is processed, so it's never pipelined by software
+        self.pipeline = self.config["pipeline"] and not self.free_running
+
+        self.logger.start()
+        last_time_logging = 0
+        baseline_warned = False
+
+        # the clock starts last, a free running counter starts scanning right away, and its ao lead runs down from here
+        self.counter_task.start()
+        self.latency.start()
+
+        if self.pipeline:
+            # the first scan, later scans are triggered right after the previous one is read
+            self.trigger()
+
+        engine = self.engine
+        while self.active:
+            # parameters of this cycle, a new snapshot may have been sent since last cycle
+            self.handle_commands()
+            params = self.params
+            if params is not engine.params:
+                if self.recorder is not None:
+                    self.recorder.record_params(params)
+                engine.set_params(params)
+            # setpoints of the snapshot, every cycle, so a laser whose sequence was cancelled or has finished goes back to it
+            engine.laser_setpoint[:] = params.laser_setpoint
+            if self.sequencer.active():
+                # sequences override setpoints of the snapshot from this cycle on
+                self.sequencer.step(engine.laser_setpoint, self.read_trigger_edges() if self.sequencer.triggered() else 0)
+
+            pd_buffer = self.pd_buffers[self.counter%2] if self.pipeline else self.pd_buffers[0]
+            self.acquire(pd_buffer, params.average, pretriggered=self.pipeline)
+            pd_buffer = pd_buffer[:, :self.samp_num]
+            t = time.time()
+            if self.recorder is not None:
+                self.recorder.record_traces(t, pd_buffer)
+
+            if self.pipeline:
+                # start next scan with ao voltages calculated in last cycle, so DAQ acquires it while this cycle is being processed
+                # feedback calculated in this cycle is applied one scan later than in normal mode
+                self.ao_task_write()
+                self.latency.mark("ao write")
+                self.trigger()
+
+            # chop, remove baseline, find peaks and calculate feedback voltages
+            pd_data = engine.process(pd_buffer)
+
+            if self.recorder is not None or self.telemetry is not None:
+                err, output, found = engine.status()
+                lost = self.lock_monitor.update(err, found, params.lock_criteria)
+                if self.recorder is not None:
+                    self.recorder.record_status(err, output, found, engine.laser_setpoint)
+                    if lost.any():
+                        self.dump_recorder(params, np.flatnonzero(lost))
+                if self.telemetry is not None:
+                    # never waits, subscribers that fall behind lose the oldest records
+                    self.telemetry.write(self.counter, t, engine.cavity_first_peak, engine.cavity_pk_sep, params.cavity_setpoint, engine.laser_setpoint,
+                                         err, output, found, self.lock_monitor.locked)
+
+            # log laser frequency and cavity PZT voltage
+            if t - last_time_logging >= params.logging_interval:
+                act_freq = np.where(engine.laser_peak_found, engine.laser_setpoint-engine.laser_pid.last_err[1], np.nan)
+                self.logger.log(t, engine.cavity_output, *act_freq)
+                last_time_logging = t
+
+            if not self.pipeline:
+                self.ao_task_write()
+                self.latency.mark("ao write")
+
+            # post loop status of this cycle for GUI, all arrays are copies because the loop keeps updating them
+            if self.mailbox.empty():
+                # latency percentiles are relatively expensive, only refresh them after the GUI has taken the last frame
+                latency_pct = self.latency.percentiles((50, 99))
+                # baseline removal alone taking longer than a scan caps the loop rate, warn once
+                if (not baseline_warned) and (latency_pct[self.latency.index["baseline"], 0] > self.config["scan time"]):
+                    logging.warning(f"baseline removal takes {latency_pct[self.latency.index['baseline'], 0]:.2f} ms per cycle (median), "
+                                    f"longer than scan time {self.config['scan time']} ms, fewer arPLS iterations or channels per cycle may help.")
+                    baseline_warned = True
+            data_dict = {}
+            data_dict["cavity pd_data"] = pd_data[0].copy()
+            data_dict["cavity first peak"] = engine.cavity_first_peak
+            data_dict["cavity pk sep"] = engine.cavity_pk_sep
+            data_dict["cavity error"] = engine.cavity_pid.last_err[1, 0]
+            data_dict["cavity output"] = engine.cavity_output
+            data_dict["cavity peak found"] = engine.cavity_peak_found
+            data_dict["laser pd_data"] = pd_data[1:, :].copy()
+            data_dict["laser error"] = engine.laser_pid.last_err[1].copy()
+            data_dict["laser output"] = engine.laser_output.copy()
+            data_dict["laser peak found"] = engine.laser_peak_found.copy()
+            data_dict["latency"] = latency_pct
+            self.mailbox.post(data_dict)
+
+            self.counter += 1
+            self.latency.end_cycle()
+
+    # carry out all commands received since last cycle, without waiting
+    def handle_commands(self):
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                return
+
+            name = command[0]
+            if name == "params":
+                self.params = command[1]
+            elif name == "clear feedback":
+                if command[1] == 0:
+                    self.engine.cavity_pid.last_feedback[0] = 0
+                else:
+                    self.engine.laser_pid.last_feedback[command[1]-1] = 0
+            elif name == "dump latency":
+                # the history is copied here, and written into the file in background
+                self.latency.dump(command[1], background=True)
+            elif name == "sequence":
+                self.load_sequence(*command[1:])
+            elif name == "stop":
+                self.active = False
+            else:
+                logging.warning(f"feedback loop command {name} not supported.")
+
+    def load_sequence(self, laser, freqs=None, dwells=None, trigger=False, repeat=False):
+        if freqs is None or len(freqs) == 0:
+            self.sequencer.cancel(laser)
+            return
+        if trigger:
+            if self.edge_counter_task is None:
+                logging.error(f"laser {laser}: sequence needs an external trigger, but no sequence counter is assigned.")
+                return
+            # only edges from now on advance it
+            self.read_trigger_edges()
+        try:
+            self.sequencer.load(laser, freqs, dwells, trigger, repeat)
+        except (IndexError, ValueError) as err:
+            logging.error(f"laser {laser}: invalid sequence, {err}")
+
+    # number of external trigger edges since last read
+    def read_trigger_edges(self):
+        edges = self.edge_counter_task.read()
+        new = edges - self.trigger_edges
+        self.trigger_edges = edges
+        return new
+
+    # save latest cycles recorded by the flight recorder, channel 0 is cavity, channel i is laser i-1
+    def dump_recorder(self, params, lost):
+        file_name = os.path.join(os.path.dirname(self.config["hdf_filename"]), "flight_"+time.strftime("%Y%m%d_%H%M%S")+".hdf")
+        attrs = {key: val for key, val in vars(params).items() if isinstance(val, (int, float, str, np.ndarray))}
+        attrs["samp_num"] = self.samp_num
+        attrs["lost lock"] = lost
+        logging.info(f"channel {lost} lost lock.")
+        self.recorder.dump(file_name, attrs)
+
+    # trigger counter, to start AI/AO for one scan
+    def trigger(self):
+        self.do_task.write([False, True, False])
+        self.latency.mark("trigger")
+
+    # acquire and average num_run scans into pd_buffer, the first scan may have been triggered already
+    # a free running counter starts scans by itself, then every read waits for the next cycle to finish
+    def acquire(self, pd_buffer, num_run, pretriggered=False):
+        scan = pd_buffer[:, :self.samp_num]
+        for i in range(num_run):
+            if not self.free_running and (i > 0 or not pretriggered):
+                self.trigger()
+            # read straight into preallocated buffers, the first run goes into pd_buffer and later runs are added to it
+            self.ai_reader.read_many_sample(pd_buffer if i == 0 else self.ai_buffer, number_of_samples_per_channel=self.cycle_samp_num, timeout=10.0)
+            self.latency.mark("read")
+            if i > 0:
+                scan += self.ai_buffer[:, :self.samp_num]
+            self.latency.mark("convert")
+
+            if i < num_run - 1:
+                self.ao_task_write()
+                self.latency.mark("ao write")
+
+        if num_run > 1:
+            scan /= num_run
+
+    # initialize ai_task, which will handle analog read for all ai channels
+    def ai_task_init(self):
+        # cavity ai channel first, then laser ai channels, use the configured counter as clock
+        channels = [self.cavity_config["daq ai"]] + [laser["daq ai"] for laser in self.laser_configs]
+        self.ai_task = self.backend.ai_task("ai task "+time.strftime("%Y%m%d_%H%M%S"), channels, self.samp_rate, self.cycle_samp_num, self.config["counter PFI line"])
+
+    # initialize cavity_ao_task, hardware-timed laser channels on the same device are added to it
+    def cavity_ao_task_init(self):
+        laser_channels = [laser["daq ao"] for laser in self.laser_configs] if self.laser_ao_combined else []
+        self.cavity_ao_task = self.backend.cavity_ao_task("cavity ao task "+time.strftime("%Y%m%d_%H%M%S"), self.cavity_config["daq ao"], self.samp_rate, self.cycle_samp_num, self.config["counter PFI line"], laser_channels, self.cavity_ao_regen)
+
+    # initialize laser_ao_task, this task handles ao channel of all lasers, there's none if they are in cavity_ao_task
+    def laser_ao_task_init(self):
+        channels = [laser["daq ao"] for laser in self.laser_configs]
+        if self.laser_ao_combined:
+            self.laser_ao_task = None
+        elif self.laser_ao_timed:
+            self.laser_ao_task = self.backend.timed_laser_ao_task("laser ao task "+time.strftime("%Y%m%d_%H%M%S"), channels, self.samp_rate, self.cycle_samp_num, self.config["counter PFI line"])
+        else:
+            self.laser_ao_task = self.backend.laser_ao_task("laser ao task "+time.strftime("%Y%m%d_%H%M%S"), channels)
+
+    # initialize cavity_offset_task, only used with a regenerated cavity scan
+    def cavity_offset_task_init(self):
+        if self.cavity_ao_regen:
+            self.cavity_offset_task = self.backend.cavity_offset_task("cavity offset ao task "+time.strftime("%Y%m%d_%H%M%S"), self.config["cavity offset ao"])
+        else:
+            self.cavity_offset_task = None
+
+    # initialize a do task, it will be used to trigger the counter, there's none if the counter is free running
+    def do_task_init(self):
+        if self.free_running:
+            self.do_task = None
+        else:
+            self.do_task = self.backend.do_task("do task "+time.strftime("%Y%m%d_%H%M%S"), self.config["trigger channel"])
+
+    # initialize a counter task, it will be used as the clock for ai_task and cavity_ao_task
+    def counter_task_init(self):
+        # it will be triggered by the do channel in do_task, or generates pulses continuously if it's free running
+        self.counter_task = self.backend.counter_task("counter task "+time.strftime("%Y%m%d_%H%M%S"), self.config["counter channel"], self.samp_rate, self.samp_num, self.config["trigger channel"], self.free_running)
+
+    # initialize a counter task that counts external trigger edges, to advance setpoint sequences, "None" means there's no such trigger
+    def edge_counter_task_init(self):
+        if self.config["sequence counter"] == "None":
+            self.edge_counter_task = None
+        else:
+            self.edge_counter_task = self.backend.edge_counter_task("edge counter task "+time.strftime("%Y%m%d_%H%M%S"), self.config["sequence counter"], self.config["sequence trigger"])
+
+    # update cavity scanning voltage, shift the sawtooth in place, and fill laser rows that go into the same task
+    def fill_cavity_waveform(self):
+        np.add(self.cavity_scan, self.engine.cavity_output, out=self.cavity_row)
+        if self.laser_ao_combined:
+            self.laser_rows[:] = self.engine.laser_output[:, np.newaxis]
+
+    # generate laser piezo feedback voltage from ao channels, unless they are written along with the cavity ao channel
+    def laser_ao_write(self):
+        if self.laser_ao_combined:
+            return
+        try:
+            if self.laser_ao_timed:
+                self.laser_rows[:] = self.engine.laser_output[:, np.newaxis]
+                self.laser_writer.write_many_sample(self.laser_rows)
+            else:
+                self.laser_writer.write_one_sample(self.engine.laser_output)
+        except self.backend.DaqError as err:
+            if self.laser_ao_timed and self.free_running:
+                self.ao_underflow(err)
+            logging.error(f"A DAQ error happened at laser ao channels \n{err}")
+
+    # a free running counter has run past the ao data written (or the ao task failed otherwise), restarting the task would put
+    # ao out of phase with ai, so the loop stops
+    def ao_underflow(self, err):
+        raise RuntimeError(f"ao data fell behind the free running counter, a longer ao lead may help, the loop stops. \n{err}") from err
+
+    # shift the regenerated cavity scan by the feedback voltage
+    def cavity_offset_write(self):
+        try:
+            self.cavity_offset_writer.write_one_sample(self.engine.cavity_output)
+        except self.backend.DaqError as err:
+            logging.error(f"A DAQ error happened at cavity offset ao channel \n{err}")
+
+    def ao_task_write(self):
+        self.laser_ao_write()
+
+        if self.cavity_ao_regen:
+            # nothing is written into the cavity ao buffer, so the error below can't happen
+            self.cavity_offset_write()
+            return
+
+        try:
+            self.fill_cavity_waveform()
+            self.cavity_writer.write_many_sample(self.cavity_waveform)
+        except self.backend.DaqError as err:
+            if self.free_running:
+                self.ao_underflow(err)
+            # This is to handle error -50410, which occurs randomly.
+            # "There was no space in buffer when new data was written.
+            # The oldest unread data in the buffer was lost as a result"
+
+            # The only way I know now to avoid this error is to release buffer in EVERY cycle,
+            # by calling "self.cavity_ao_task.control(nidaqmx.constants.TaskMode.TASK_UNRESERVE)"
+            # and then write to buffer "self.cavity_ao_task.write(self.cavity_scan + self.cavity_output, auto_start=True)".
+            # But this way reduces performance.
+
+            # This error may only occur in PCIe-6259 or similar DAQs
+            logging.info(f"This is the {self.err_counter}-th time error occurs. \n{err}")
+            # Abort task, see https://zone.ni.com/reference/en-XX/help/370466AH-01/mxcncpts/taskstatemodel/
+            self.backend.abort(self.cavity_ao_task)
+            # write to and and restart task
+            self.cavity_ao_task.write(self.cavity_waveform, auto_start=True)
+            self.err_counter += 1
+
+
+# DAQ device of a physical channel, e.g. Dev2 of Dev2/ao0
+def device_name(channel):
+    return channel.strip("/").split("/")[0]
+
+# run a lockLoop in a thread of this process, loop status is posted into mailbox (a latestMailbox) and commands are sent with send()
+class loopThread(threading.Thread):
+    def __init__(self, params, backend, cavity_last_feedback=0.0, laser_last_feedback=None):
+        super().__init__(name="feedback loop", daemon=True)
+        self.mailbox = latestMailbox()
+        self.commands = queue.Queue()
+        self.telemetry = telemetryRing(len(params.laser_configs)+1)
+        self.loop = lockLoop(params, backend, self.mailbox, self.commands, cavity_last_feedback, laser_last_feedback, self.telemetry)
+        self.feedback = None
+
+    def run(self):
+        self.feedback = self.loop.run()
+
+    # send a command to the loop, it's carried out at the beginning of next cycle, see lockLoop
+    def send(self, *command):
+        self.commands.put(command)
+
+    @property
+    def latency(self):
+        return self.loop.latency
+
+    # wait until the loop finishes, returns its final feedback voltages of cavity and lasers, or None if it failed
+    # the telemetry ring is closed, so it must not be read any more
+    def wait(self):
+        if self.ident is not None:
+            self.join()
+        if self.telemetry is not None:
+            self.telemetry.close()
+            self.telemetry = None
+        return self.feedback
+
+# run a lockLoop in a separate process, so work in this process (e.g. plotting) doesn't compete with it for the GIL
+# loop status comes back through a sharedMailbox and commands go in through a queue, it has the same interface as loopThread
+class loopProcess:
+    def __init__(self, params, backend_name, cavity_last_feedback=0.0, laser_last_feedback=None, cpu=-1):
+        # spawn a fresh interpreter on all platforms, so no GUI state or DAQ handle is inherited
+        ctx = multiprocessing.get_context("spawn")
+        self.mailbox = sharedMailbox(lockLoop.frame_fields(len(params.laser_configs), params.samp_num))
+        self.telemetry = telemetryRing(len(params.laser_configs)+1)
+        self.commands = ctx.Queue()
+        self.result = ctx.Queue()
+        self.process = ctx.Process(target=run_loop_process, name="feedback loop",
+                                   args=(params, backend_name, self.mailbox.name, self.commands, self.result,
+                                         cavity_last_feedback, laser_last_feedback, cpu, self.telemetry.name))
+        self.feedback = None
+
+    def start(self):
+        self.process.start()
+
+    def send(self, *command):
+        self.commands.put(command)
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    # wait until the loop process finishes, returns its final feedback voltages of cavity and lasers, or None if it failed
+    def wait(self):
+        if self.mailbox is None:
+            return self.feedback
+        # the process may have died without a result (e.g. DAQ tasks failed to be created), don't wait for it then
+        deadline = time.monotonic() + 30
+        while self.feedback is None and time.monotonic() < deadline:
+            try:
+                self.feedback = self.result.get(timeout=0.1)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    # a result put right before it exited is in the pipe by now
+                    try:
+                        self.feedback = self.result.get(timeout=0.5)
+                    except queue.Empty:
+                        pass
+                    break
+        if self.feedback is None:
+            logging.error("feedback loop process didn't return its feedback voltages.")
+        self.process.join(timeout=10)
+        if self.process.is_alive():
+            logging.error("feedback loop process didn't stop, terminate it.")
+            self.process.terminate()
+        self.mailbox.close()
+        self.mailbox = None
+        self.telemetry.close()
+        self.telemetry = None
+        return self.feedback
+
+
+# target of the feedback loop process (loopProcess), it runs a lockLoop with a DAQ backend of the given name,
+# posts loop status into the sharedMailbox of the given name, writes telemetry into the telemetryRing of the given name,
+# and puts final feedback voltages into result when it finishes
+# cpu >= 0 pins this process to that cpu, so the loop has a core of its own
+def run_loop_process(params, backend_name, mailbox_name, commands, result, cavity_last_feedback, laser_last_feedback, cpu=-1, telemetry_name=None):
+    logging.getLogger().setLevel("INFO")
+    if sys.platform == "win32":
+        # timer resolution is per process on recent windows, set it to 1 ms as the GUI process does, see main.py
+        current_res = ctypes.c_ulong()
+        ctypes.windll.ntdll.NtSetTimerResolution(10000, True, ctypes.byref(current_res))
+    if cpu >= 0:
+        pin_to_cpu(cpu)
+
+    mailbox = sharedMailbox(lockLoop.frame_fields(len(params.laser_configs), params.samp_num), name=mailbox_name)
+    telemetry = telemetryRing(len(params.laser_configs)+1, name=telemetry_name) if telemetry_name is not None else None
+    try:
+        loop = lockLoop(params, daq_backend(backend_name), mailbox, commands, cavity_last_feedback, laser_last_feedback, telemetry)
+        result.put(loop.run())
+    except Exception:
+        logging.error(f"feedback loop process error: \n{traceback.format_exc()}")
+    finally:
+        mailbox.close()
+        if telemetry is not None:
+            telemetry.close()
+
+# run this process on the given cpu only
+def pin_to_cpu(cpu):
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, {cpu})
+        elif sys.platform == "win32":
+            if not ctypes.windll.kernel32.SetProcessAffinityMask(ctypes.windll.kernel32.GetCurrentProcess(), 1 << cpu):
+                raise ctypes.WinError()
+        else:
+            logging.warning("CPU affinity is not supported on this platform.")
+            return
+        logging.info(f"feedback loop process pinned to cpu {cpu}.")
+    except OSError as err:
+        logging.error(f"failed to pin feedback loop process to cpu {cpu}: {err}")
@@ -0,0 +1,117 @@
+import time
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+
+
+# A single-slot mailbox that always holds the latest frame.
+# The worker posts a frame (whose arrays it doesn't touch anymore) in every cycle, replacing any frame not taken yet,
+# and the GUI takes it at its own pace. Stale frames are dropped, so a slow GUI never builds up a backlog.
+class latestMailbox:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frame = None
+        self.posted = 0 # number of frames posted
+        self.taken = 0 # number of frames taken
+
+    # replace the frame in the slot
+    def post(self, frame):
+        with self.lock:
+            self.frame = frame
+            self.posted += 1
+
+    # return the latest frame and empty the slot, or None if no new frame is posted since last time
+    def take(self):
+        with self.lock:
+            frame = self.frame
+            self.frame = None
+            if frame is not None:
+                self.taken += 1
+        return frame
+
+    # True if the last frame has been taken, e.g. to decide whether to refresh data that's expensive to compute
+    def empty(self):
+        return self.frame is None
+
+    # number of frames dropped without being taken
+    def dropped(self):
+        with self.lock:
+            return self.posted - self.taken - (self.frame is not None)
+
+
+# The same single-slot mailbox in shared memory, so a worker in another process can post frames to the GUI without pickling or a pipe.
+# Frames are dictionaries of numpy arrays (or scalars) whose keys, maximal shapes and dtypes are given in fields, as (key, shape, dtype).
+# The last axis of an array can be shorter than in fields, its actual length is saved with the frame.
+# The owner (name=None) creates the shared memory and removes it in close(), the other side attaches to it by name.
+# There's one writer and one reader. The writer never waits: frames are protected by a sequence number (seqlock),
+# which is odd while a frame is being written, and the reader copies a frame out and retries if the number changed meanwhile.
+class sharedMailbox:
+    def __init__(self, fields, name=None):
+        self.fields = [(key, tuple(shape), np.dtype(dtype)) for key, shape, dtype in fields]
+        # header: sequence number, sequence number of the last frame taken, number of frames taken, and actual last axis length of every field
+        header_size = 8*(3+len(self.fields))
+        offsets = []
+        size = header_size
+        for key, shape, dtype in self.fields:
+            size = -(-size//dtype.alignment)*dtype.alignment
+            offsets.append(size)
+            size += int(np.prod(shape, dtype=np.int64))*dtype.itemsize
+
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(create=True, size=size) if self.owner else shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.header = np.ndarray(3+len(self.fields), dtype=np.int64, buffer=self.shm.buf)
+        self.slots = {key: np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset) for (key, shape, dtype), offset in zip(self.fields, offsets)}
+        if self.owner:
+            self.header[:] = 0
+
+    # replace the frame in the slot
+    def post(self, frame):
+        header = self.header
+        header[0] += 1 # odd, being written
+        for i, (key, shape, dtype) in enumerate(self.fields):
+            val = frame[key]
+            if len(shape) == 0:
+                self.slots[key][()] = val
+            else:
+                n = np.shape(val)[-1]
+                self.slots[key][..., :n] = val
+                header[3+i] = n
+        header[0] += 1 # even, complete
+
+    # return a copy of the latest frame and empty the slot, or None if no new frame is posted since last time
+    def take(self, retries=100):
+        header = self.header
+        for i in range(retries):
+            seq = int(header[0])
+            if seq == header[1]:
+                return None
+            if seq % 2 == 1:
+                # the writer is in the middle of a frame
+                time.sleep(0)
+                continue
+            frame = {}
+            for j, (key, shape, dtype) in enumerate(self.fields):
+                slot = self.slots[key]
+                frame[key] = slot[()] if len(shape) == 0 else slot[..., :header[3+j]].copy()
+            if header[0] == seq:
+                header[1] = seq
+                header[2] += 1
+                return frame
+        return None
+
+    # True if the last frame has been taken, e.g. to decide whether to refresh data that's expensive to compute
+    def empty(self):
+        return self.header[0] == self.header[1]
+
+    # number of frames dropped without being taken
+    def dropped(self):
+        return int(self.header[0]//2 - self.header[2] - (not self.empty()))
+
+    # detach from the shared memory, and remove it if this is the owner
+    def close(self):
+        self.header = None
+        self.slots = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
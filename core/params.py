@@ -0,0 +1,71 @@
+import json
+import numpy as np
+
+
+# A read-only snapshot of all parameters used in the feedback loop, compiled from config dictionaries.
+# Quantities the loop needs are precomputed here, e.g. unit conversion factors and laser setpoints,
+# so the loop doesn't look up or recompute them in every cycle.
+# The GUI builds a new snapshot whenever a parameter changes and hands it to the loop by replacing a reference,
+# the loop picks it up at the beginning of next cycle, so a cycle never sees a partially applied change.
+class lockParams:
+    def __init__(self, config, cavity_config, laser_configs):
+        # copies of the config dictionaries it's compiled from
+        self.config = dict(config)
+        self.cavity_config = dict(cavity_config)
+        self.laser_configs = [dict(laser) for laser in laser_configs]
+
+        self.samp_rate = config["sampling rate"]
+        self.scan_time = config["scan time"] # in ms
+        self.scan_ignore = config["scan ignore"] # in ms
+        self.samp_num = round(config["scan time"]/1000*config["sampling rate"]) # number of samples per scan
+        self.loop_time = config["scan time"]/1000 # approximate loop time for PID, in s
+        self.sample_to_ms = 1000/config["sampling rate"] # convert sample index into ms
+        # number of samples chopped at the beginning of a scan
+        self.start_length = round(config["scan ignore"]/1000*config["sampling rate"])
+        self.cavity_fsr = config["cavity FSR"]
+        self.average = config["average"]
+        self.baseline_remove = config["baseline remove"]
+        self.baseline_method = config["baseline method"]
+        self.arpls_lam = config["arPLS lambda"]
+        self.arpls_max_iter = config["arPLS max iter"]
+        self.arpls_channels = config.get("arPLS channels", 0) # snapshots recorded before it existed solve all channels
+        self.lock_criteria = config["lock criteria"]
+        self.logging_interval = config["logging interval"] # in s
+
+        # cavity first, then lasers
+        self.peak_height = self.array([cavity_config["peak height"]] + [laser["peak height"] for laser in laser_configs])
+        self.peak_width = self.array([cavity_config["peak width"]] + [laser["peak width"] for laser in laser_configs])
+
+        # cavity setpoint relative to the chopped scan, in ms
+        self.cavity_setpoint = cavity_config["set point"] - config["scan ignore"]
+        self.cavity_gains = self.gains([cavity_config])
+
+        # laser frequency setpoints from the chosen source, in MHz
+        self.laser_setpoint = self.array([laser["global freq"] if laser["freq source"] == "global" else laser["local freq"] for laser in laser_configs])
+        # convert peak position relative to cavity peak separation into laser frequency in MHz
+        self.laser_freq_scale = self.array([config["cavity FSR"]*laser["wavenumber"]/cavity_config["wavenumber"] for laser in laser_configs])
+        self.laser_gains = self.gains(laser_configs)
+
+    # config dictionaries in a json string, see from_json()
+    def to_json(self):
+        return json.dumps({"config": self.config, "cavity config": self.cavity_config, "laser configs": self.laser_configs})
+
+    @classmethod
+    def from_json(cls, text):
+        d = json.loads(text)
+        return cls(d["config"], d["cavity config"], d["laser configs"])
+
+    def array(self, val):
+        a = np.array(val, dtype=np.float64)
+        a.setflags(write=False)
+        return a
+
+    # arguments of pidBank.set_gains()
+    def gains(self, configs):
+        return tuple(self.array([c[key] for c in configs]) for key in ["kp", "ki", "kd", "kp on", "ki on", "kd on", "offset", "limit"]) + (self.loop_time,)
+
+    # no attribute can be changed after it's compiled
+    def __setattr__(self, name, val):
+        if hasattr(self, name):
+            raise AttributeError(f"lockParams is read-only, can't change {name}.")
+        super().__setattr__(name, val)
@@ -0,0 +1,61 @@
+import numpy as np
+
+
+# find transmission peaks of all channels at once
+# data: 2D array, one channel per row
+# heights, widths: 1D arrays, minimal peak height (V) and width (number of samples) of each channel
+# Every group of consecutive samples at or above "height" counts as one peak candidate, its position is the maximum in the group.
+# A candidate is accepted if the group is at least "width" samples long, and its maximum is not at either end of the trace.
+# Return peak positions of all channels (sorted by channel, then position) and number of peaks in each channel.
+def find_peaks_batch(data, heights, widths):
+    ch_num, samp_num = data.shape
+    above = np.zeros((ch_num, samp_num+2), dtype=np.int8)
+    above[:, 1:-1] = data >= np.reshape(heights, (-1, 1))
+
+    # rising and falling edges of "above height" groups, falling edges are exclusive ends
+    edges = np.diff(above, axis=1)
+    ch, start = np.nonzero(edges == 1)
+    _, end = np.nonzero(edges == -1)
+    lengths = end - start
+
+    keep = lengths >= np.asarray(widths)[ch]
+    ch, start, lengths = ch[keep], start[keep], lengths[keep]
+    if len(ch) == 0:
+        return np.empty(0, dtype=np.intp), np.zeros(ch_num, dtype=np.intp)
+
+    # flattened indices of all samples in all groups, group by group
+    group_offsets = np.cumsum(lengths) - lengths
+    idx = np.arange(np.sum(lengths)) + np.repeat(ch*samp_num + start - group_offsets, lengths)
+    vals = data.ravel()[idx]
+
+    # position of the (first) maximum in each group
+    group_max = np.maximum.reduceat(vals, group_offsets)
+    is_max = np.flatnonzero(vals == np.repeat(group_max, lengths))
+    group_id = np.repeat(np.arange(len(lengths)), lengths)[is_max]
+    first = np.flatnonzero(np.diff(group_id, prepend=-1))
+    peaks = idx[is_max[first]] - ch*samp_num
+
+    # a maximum at either end of the trace may be part of a peak outside of it
+    keep = (peaks > 0) & (peaks < samp_num-1)
+    peaks, ch = peaks[keep], ch[keep]
+
+    return peaks, np.bincount(ch, minlength=ch_num)
+
+# for each group of values, return the value closest to zero (keep its sign), NaN if the group is empty
+# values: 1D array, values of all groups one after another
+# counts: 1D array, number of values in each group
+def closest_to_zero(values, counts):
+    closest = np.full(len(counts), np.nan)
+    nonempty = counts > 0
+    if len(values) == 0:
+        return closest
+
+    starts = (np.cumsum(counts) - counts)[nonempty]
+    abs_values = np.abs(values)
+    group_min = np.minimum.reduceat(abs_values, starts)
+    is_min = np.flatnonzero(abs_values == np.repeat(group_min, counts[nonempty]))
+    group_id = np.repeat(np.arange(len(starts)), counts[nonempty])[is_min]
+    first = np.flatnonzero(np.diff(group_id, prepend=-1))
+    closest[nonempty] = values[is_min[first]]
+
+    return closest
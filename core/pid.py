@@ -0,0 +1,59 @@
+import logging
+import numpy as np
+
+
+# PID controllers of several channels, gains, limits, offsets and error history are all kept in arrays,
+# so all channels are updated with a few vector operations in every cycle
+class pidBank:
+    def __init__(self, num, last_feedback=None):
+        self.num = num
+        self.kp = np.zeros(num, dtype=np.float64)
+        self.ki = np.zeros(num, dtype=np.float64)
+        self.kd = np.zeros(num, dtype=np.float64)
+        self.offset = np.zeros(num, dtype=np.float64)
+        self.limit = np.zeros(num, dtype=np.float64)
+        self.dt = 1.0 # loop time in s
+
+        # frequency errors in last two cycles, last_err[1] is the latest one
+        self.last_err = np.zeros((2, num), dtype=np.float64)
+        # feedback voltage from last run can be used as the initial feedback voltage, to avoid laser freq jump
+        self.last_feedback = np.zeros(num, dtype=np.float64) if last_feedback is None else np.array(last_feedback, dtype=np.float64)
+        self.output = np.zeros(num, dtype=np.float64)
+        self.feedback = np.zeros(num, dtype=np.float64)
+        self.valid = np.zeros(num, dtype=np.bool_)
+
+    # gains are multiplied by their on/off states, dt is the approximate loop time in s
+    def set_gains(self, kp, ki, kd, kp_on, ki_on, kd_on, offset, limit, dt):
+        self.kp[:] = np.multiply(kp, kp_on)
+        self.ki[:] = np.multiply(ki, ki_on)
+        self.kd[:] = np.multiply(kd, kd_on)
+        self.offset[:] = offset
+        self.limit[:] = limit
+        self.dt = dt
+
+    # keep feedback voltages of all channels, output = offset + last feedback
+    def hold(self):
+        self.valid[:] = False
+        np.add(self.offset, self.last_feedback, out=self.output)
+        return self.output
+
+    # update feedback voltages of channels where valid is True, other channels hold their last feedback voltages
+    def update(self, err, valid):
+        np.copyto(self.valid, valid)
+        last_err = self.last_err
+        feedback = self.feedback
+        feedback[:] = self.last_feedback + (err-last_err[1])*self.kp + err*self.ki*self.dt + (err+last_err[0]-2*last_err[1])*self.kd/self.dt
+        # coerce feedback voltage to avoid big jump
+        np.clip(feedback, self.last_feedback-self.limit, self.last_feedback+self.limit, out=feedback)
+
+        # check if feedback voltage is NaN, use feedback voltage from last cycle if it is
+        nan = np.isnan(feedback)
+        if np.any(nan & self.valid):
+            logging.warning(f"feedback voltage of channel {np.flatnonzero(nan & self.valid)} is NaN.")
+        np.copyto(self.last_feedback, feedback, where=self.valid & ~nan)
+        np.add(self.offset, self.last_feedback, out=self.output)
+
+        np.copyto(last_err[0], last_err[1], where=self.valid)
+        np.copyto(last_err[1], err, where=self.valid)
+
+        return self.output
@@ -0,0 +1,134 @@
+import os
+import logging
+import threading
+import numpy as np
+import h5py
+
+from .ringbuffer import rollingStats
+
+
+# An always-on recorder of the latest cycles of the feedback loop: raw traces, errors, outputs, peak found flags and laser setpoints.
+# All buffers are preallocated and written by index, so recording costs a few array copies per cycle.
+# When dump() is called (e.g. on lock loss), the filled buffers are handed over to a background thread that writes them into an hdf file,
+# and recording continues in a spare set of buffers. Buffers are allocated with np.empty, so the spare set doesn't take memory until it's used.
+# Parameter snapshots (lockParams) are recorded with the cycle they're first used in, so the recording can be replayed (see replay.py).
+class flightRecorder:
+    def __init__(self, length, ch_num, samp_num):
+        self.length = max(int(length), 1) # number of cycles to keep
+        self.shape = (ch_num, samp_num)
+        self.buffers = [self.allocate(), None] # the one in use, and the spare one
+        self.index = 0 # number of cycles recorded into the current buffers
+        self.params_log = [] # (index, params) of every parameter snapshot used
+        self.dump_thread = None
+
+    def allocate(self):
+        return {
+                "time": np.empty(self.length, dtype=np.float64),
+                "pd_data": np.empty((self.length,) + self.shape, dtype=np.float32),
+                "error": np.empty((self.length, self.shape[0]), dtype=np.float32),
+                "output": np.empty((self.length, self.shape[0]), dtype=np.float32),
+                "peak found": np.empty((self.length, self.shape[0]), dtype=np.bool_),
+                # setpoints in use, which setpoint sequences change in between parameter snapshots
+                "laser setpoint": np.empty((self.length, self.shape[0]-1), dtype=np.float64),
+                }
+
+    # record a new parameter snapshot, which is used from this cycle on
+    # snapshots that ended before the oldest cycle still kept are dropped, the one in force at that cycle is kept
+    def record_params(self, params):
+        self.params_log.append((self.index, params))
+        first = self.index - self.length + 1
+        drop = 0
+        while drop < len(self.params_log)-1 and self.params_log[drop+1][0] <= first:
+            drop += 1
+        if drop:
+            del self.params_log[:drop]
+
+    # record raw traces of this cycle, call it before baseline removal modifies them
+    def record_traces(self, t, pd_data):
+        i = self.index % self.length
+        buf = self.buffers[0]
+        buf["time"][i] = t
+        np.copyto(buf["pd_data"][i], pd_data, casting="same_kind")
+
+    # record errors, outputs and peak found flags of this cycle (cavity first, then lasers), laser setpoints (MHz) used in it,
+    # and move on to next cycle
+    def record_status(self, err, output, found, laser_setpoint):
+        i = self.index % self.length
+        buf = self.buffers[0]
+        buf["error"][i] = err
+        buf["output"][i] = output
+        buf["peak found"][i] = found
+        buf["laser setpoint"][i] = laser_setpoint
+        self.index += 1
+
+    # write recorded cycles into an hdf file in background, attrs are saved as file attributes
+    # returns False if the last dump hasn't finished, in which case nothing is dumped
+    def dump(self, file_name, attrs={}):
+        if (self.dump_thread is not None) and self.dump_thread.is_alive():
+            logging.warning(f"flight recorder is still writing last dump, {file_name} is skipped.")
+            return False
+
+        buf, index, params_log = self.buffers[0], self.index, self.params_log
+        self.buffers = [self.buffers[1] if self.buffers[1] is not None else self.allocate(), buf]
+        self.index = 0
+        # parameters in use carry over to the new buffers
+        self.params_log = [(0, params_log[-1][1])] if params_log else []
+        self.dump_thread = threading.Thread(target=self.write, args=(file_name, buf, index, params_log, attrs), name="flight recorder", daemon=True)
+        self.dump_thread.start()
+        return True
+
+    # write buffers in chronological order, a few cycles at a time, so the feedback loop thread isn't blocked for long
+    def write(self, file_name, buf, index, params_log, attrs, chunk=100):
+        num = min(index, self.length)
+        start = index % self.length if index > self.length else 0
+        order = (np.arange(num) + start) % self.length
+
+        # parameter snapshots in json, and the (chronological) cycle they're first used in
+        # the snapshot in use when the first kept cycle was recorded starts at cycle 0, older ones are discarded
+        first = index - num
+        params_cycle = [max(i-first, 0) for i, params in params_log]
+        keep = [k for k in range(len(params_log)) if (k == len(params_log)-1) or (params_cycle[k+1] > 0)]
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+            with h5py.File(file_name, "w") as f:
+                for key, val in attrs.items():
+                    f.attrs[key] = val
+                for key, data in buf.items():
+                    dset = f.create_dataset(key, shape=(num,)+data.shape[1:], dtype=data.dtype)
+                    for i in range(0, num, chunk):
+                        dset[i:i+chunk] = data[order[i:i+chunk]]
+                f.create_dataset("params", data=[params_log[k][1].to_json() for k in keep], dtype=h5py.string_dtype(encoding='utf-8'))
+                f.create_dataset("params cycle", data=np.array([params_cycle[k] for k in keep], dtype=np.int64))
+            logging.info(f"flight recorder saved {num} cycles to {file_name}")
+        except Exception as err:
+            logging.error(f"flight recorder failed to save {file_name}: {err}")
+
+    # wait for the last dump to finish
+    def join(self):
+        if self.dump_thread is not None:
+            self.dump_thread.join()
+
+
+# tell whether each channel is locked in every cycle, using the same criteria as the GUI:
+# rms of recent errors, and the latest error, are both smaller than lock criteria, and peaks are found.
+# A lock loss is only reported if the channel has been locked for at least rms_length cycles, to ignore flapping while acquiring lock.
+class lockMonitor:
+    def __init__(self, rms_length, ch_num):
+        self.stats = rollingStats(rms_length, (ch_num,))
+        self.min_locked = self.stats.maxlen
+        self.locked = np.zeros(ch_num, dtype=np.bool_)
+        self.locked_cycles = np.zeros(ch_num, dtype=np.int64) # number of cycles each channel has been locked for
+        self.lost = np.zeros(ch_num, dtype=np.bool_)
+
+    # errors and found flags of cavity first, then lasers, returns a mask of channels that just lost a stable lock
+    def update(self, err, found, lock_criteria):
+        self.stats.append(err)
+        np.less(self.stats.var(), lock_criteria**2, out=self.locked)
+        self.locked &= np.abs(err) < lock_criteria
+        self.locked &= found
+        # lasers can only be locked when cavity peaks are found
+        self.locked[1:] &= found[0]
+        np.greater(self.locked_cycles >= self.min_locked, self.locked, out=self.lost)
+        self.locked_cycles += 1
+        self.locked_cycles *= self.locked
+        return self.lost
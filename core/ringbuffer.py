@@ -0,0 +1,70 @@
+import numpy as np
+
+
+# a fixed-length ring buffer of floats, which keeps mean and variance of its content updated in O(1) per append
+# every value is written twice (at i and i+maxlen), so the content is always available as a contiguous view in chronological order
+# values can be scalars (shape=()) or arrays of a given shape, e.g. errors of all channels in one cycle, whose statistics are kept element-wise
+class rollingStats:
+    def __init__(self, maxlen, shape=()):
+        self.maxlen = max(int(maxlen), 1)
+        self.shape = shape
+        self.buffer = np.zeros((2*self.maxlen,) + shape, dtype=np.float64)
+        self.head = 0 # where the next value goes, also the oldest value when the buffer is full
+        self.count = 0
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.m2 = np.zeros(shape, dtype=np.float64) # sum of squared deviations from the mean (Welford's algorithm)
+        self.appended = 0
+        # temporary arrays, so appending doesn't allocate
+        self.delta = np.zeros(shape, dtype=np.float64)
+        self.tmp = np.zeros(shape, dtype=np.float64)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, x):
+        if self.count < self.maxlen:
+            # Welford's update
+            self.count += 1
+            delta = x - self.mean
+            self.mean += delta/self.count
+            self.m2 += delta*(x - self.mean)
+        else:
+            # replace the oldest value, see https://jonisalonen.com/2014/efficient-and-accurate-rolling-standard-deviation/
+            # m2 += (x - old)*(x - new mean + old - old mean)
+            old = self.buffer[self.head]
+            np.subtract(x, old, out=self.delta)
+            np.add(x, old, out=self.tmp)
+            self.tmp -= self.mean
+            self.mean += self.delta/self.count
+            self.tmp -= self.mean
+            self.tmp *= self.delta
+            self.m2 += self.tmp
+
+        self.buffer[self.head] = x
+        self.buffer[self.head+self.maxlen] = x
+        self.head = (self.head + 1) % self.maxlen
+
+        # recompute from scratch once in a while to get rid of accumulated rounding errors (and NaN that has left the window)
+        self.appended += 1
+        if self.appended % self.maxlen == 0:
+            data = self.view()
+            self.mean[...] = np.mean(data, axis=0)
+            self.m2[...] = np.sum((data - self.mean)**2, axis=0)
+
+    # content in chronological order, a view into the buffer, valid until next append
+    def view(self):
+        if self.count < self.maxlen:
+            return self.buffer[:self.count]
+        return self.buffer[self.head:self.head+self.maxlen]
+
+    # population variance, same as np.var(), element-wise for array values
+    def var(self):
+        if self.count == 0:
+            return np.full(self.shape, np.nan)[()]
+        return (np.maximum(self.m2, 0)/self.count)[()]
+
+    # population standard deviation, same as np.std(), element-wise for array values
+    def std(self):
+        if self.count == 0:
+            return np.full(self.shape, np.nan)[()]
+        return np.sqrt(np.maximum(self.m2, 0)/self.count)[()]
@@ -0,0 +1,82 @@
+import logging
+import numpy as np
+
+
+# Setpoint sequences of lasers, stepped through by the feedback loop on cycle boundaries, so a frequency scan doesn't need
+# one TCP round trip per point. A sequence is a list of frequencies (MHz) and how many cycles each of them is held (dwells),
+# or, with trigger=True, the next frequency is taken at every edge of an external trigger instead.
+# The first frequency is used from the next cycle on. When a sequence ends it's removed, and the laser goes back to the setpoint
+# in the parameter snapshot, unless repeat=True, which starts it over until it's cancelled.
+class setpointSequencer:
+    def __init__(self, laser_num):
+        self.laser_num = laser_num
+        self.sequences = {} # laser index: sequence state
+
+    # start a sequence for a laser, replacing the one it may have
+    def load(self, laser, freqs, dwells, trigger=False, repeat=False):
+        if not 0 <= laser < self.laser_num:
+            raise IndexError(f"laser {laser} doesn't exist.")
+        freqs = np.asarray(freqs, dtype=np.float64)
+        dwells = np.maximum(np.asarray(dwells, dtype=np.int64), 1)
+        if len(freqs) == 0 or len(freqs) != len(dwells):
+            raise ValueError("a sequence needs one dwell per frequency, and at least one frequency.")
+        self.sequences[laser] = {"freqs": freqs, "dwells": dwells, "trigger": trigger, "repeat": repeat, "index": 0, "remaining": dwells[0]}
+        logging.info(f"laser {laser}: sequence of {len(freqs)} points loaded{', advanced by external trigger' if trigger else ''}.")
+
+    def cancel(self, laser):
+        if self.sequences.pop(laser, None) is not None:
+            logging.info(f"laser {laser}: sequence cancelled.")
+
+    def active(self):
+        return len(self.sequences) > 0
+
+    # True if any sequence waits for external trigger edges
+    def triggered(self):
+        return any(seq["trigger"] for seq in self.sequences.values())
+
+    # write setpoints of this cycle into setpoint (MHz, one per laser), edges is the number of trigger edges since last cycle
+    def step(self, setpoint, edges=0):
+        for laser, seq in list(self.sequences.items()):
+            if seq["trigger"]:
+                if edges > 1:
+                    logging.warning(f"laser {laser}: {edges} trigger edges in one cycle, {edges-1} point(s) skipped.")
+                seq["index"] += edges
+            elif seq["remaining"] == 0:
+                seq["index"] += 1
+            if seq["index"] >= len(seq["freqs"]):
+                if not seq["repeat"]:
+                    del self.sequences[laser]
+                    logging.info(f"laser {laser}: sequence finished.")
+                    continue
+                seq["index"] %= len(seq["freqs"])
+            if seq["remaining"] == 0:
+                seq["remaining"] = seq["dwells"][seq["index"]]
+            setpoint[laser] = seq["freqs"][seq["index"]]
+            seq["remaining"] -= 1
+
+# frequencies and dwells of a linear ramp from start to stop (both included) in steps points, each held for dwell cycles
+def ramp(start, stop, steps, dwell):
+    return np.linspace(start, stop, steps), np.full(steps, dwell, dtype=np.int64)
+
+# hand a setpoint sequence from the TCP server (see tcpServer) to a running lock, shared by mainWindow and lockServer,
+# call it with the lock's params lock held. send is the send() of the running loop, None if the lock isn't running,
+# config and laser_configs are the lock's config dictionaries.
+# The laser's global setpoint becomes the last point, so the laser stays there when the sequence ends, and other parameter
+# changes don't cancel it, compile_params() compiles the snapshot with it. Empty freqs cancels the sequence the laser may have.
+# Raises if the sequence can't run, so the TCP server doesn't echo it.
+def send_sequence(send, config, laser_configs, compile_params, laser, freqs, dwells, trigger=False, repeat=False):
+    if len(freqs) == 0:
+        if send is not None:
+            send("sequence", laser, None)
+        return
+
+    laser_config = laser_configs[laser]
+    if laser_config["freq source"] != "global":
+        raise ValueError(f"laser {laser} doesn't use global frequency.")
+    if send is None:
+        raise RuntimeError("lock isn't running.")
+    if trigger and config["sequence counter"] == "None":
+        raise ValueError(f"laser {laser}: sequence needs an external trigger, but no sequence counter is assigned.")
+    laser_config["global freq"] = float(freqs[-1])
+    send("params", compile_params())
+    send("sequence", laser, np.array(freqs, dtype=np.float64), np.array(dwells, dtype=np.int64), trigger, repeat)
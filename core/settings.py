@@ -0,0 +1,94 @@
+import configparser
+
+
+# Settings .ini files (see saved_settings/) have a [Setting] section, a [Cavity] section and one [Laser<i>] section per laser.
+# These functions turn sections into config dictionaries with the keys the GUI and lockParams use, so the lock can also be set up without GUI.
+
+# load a settings file, returns config, cavity config and laser configs
+def load_settings(file_name):
+    cf = configparser.ConfigParser()
+    cf.optionxform = str # make config key name case sensitive
+    if not cf.read(file_name):
+        raise FileNotFoundError(f"settings file {file_name} not found.")
+    return read_settings(cf)
+
+# config, cavity config and laser configs from a ConfigParser, global frequency setpoints of lasers start from 0
+def read_settings(cf):
+    config = setting_section(cf["Setting"])
+    cavity_config = cavity_section(cf["Cavity"])
+    laser_configs = [dict(laser_section(cf[f"Laser{i}"]), **{"global freq": 0.0}) for i in range(config["num of lasers"])]
+    return config, cavity_config, laser_configs
+
+# the [Setting] section
+def setting_section(section):
+    config = {}
+    config["scan amp"] = section.getfloat("scan amp/V")
+    config["scan time"] = section.getfloat("scan time/ms")
+    config["scan ignore"] = section.getfloat("scan ignore/ms")
+    config["sampling rate"] = section.getint("sampling rate")
+    config["cavity FSR"] = section.getfloat("cavity FSR/MHz")
+    config["lock criteria"] = section.getfloat("lock criteria/MHz")
+    config["RMS length"] = section.getint("RMS length")
+    config["display rate"] = section.getint("display rate", fallback=30)
+    config["counter channel"] = section.get("counter channel")
+    config["counter PFI line"] = section.get("counter PFI line")
+    config["trigger channel"] = section.get("trigger channel")
+    config["trigger mode"] = section.get("trigger mode", fallback="software")
+    config["cycle period"] = section.getfloat("cycle period/ms", fallback=0.0)
+    config["ao lead"] = section.getfloat("ao lead/ms", fallback=20.0)
+    config["laser ao mode"] = section.get("laser ao mode", fallback="on demand")
+    config["cavity ao mode"] = section.get("cavity ao mode", fallback="streamed")
+    config["cavity offset ao"] = section.get("cavity offset ao", fallback="None")
+    config["sequence counter"] = section.get("sequence counter", fallback="None")
+    config["sequence trigger"] = section.get("sequence trigger", fallback="None")
+    config["host address"] = section.get("host address")
+    config["port"] = section.getint("port")
+    config["num of lasers"] = section.getint("num of lasers")
+    config["hdf_filename"] = section.get("hdf_filename")
+    config["window title"] = section.get("window title")
+    config["color list"] = [x.strip() for x in section.get("color list").split(",")]
+    config["average"] = section.getint("average")
+    config["baseline remove"] = section.getboolean("baseline remove")
+    config["baseline method"] = section.get("baseline method", fallback="mean")
+    config["arPLS lambda"] = section.getfloat("arPLS lambda", fallback=1e5)
+    config["arPLS max iter"] = max(section.getint("arPLS max iter", fallback=2), 1) # at least one iteration, see arPLSBaseline
+    config["arPLS channels"] = max(section.getint("arPLS channels/cycle", fallback=0), 0)
+    config["pipeline"] = section.getboolean("pipeline", fallback=False)
+    config["logging interval"] = section.getfloat("logging interval/s", fallback=120.0)
+    config["recorder length"] = section.getfloat("recorder length/s", fallback=10.0)
+    config["process mode"] = section.getboolean("process mode", fallback=False)
+    config["loop cpu"] = section.getint("loop cpu", fallback=-1)
+    config["daq backend"] = section.get("daq backend", fallback="nidaqmx")
+    return config
+
+# keys shared by the [Cavity] and [Laser<i>] sections
+def channel_section(section):
+    config = {}
+    config["peak height"] = section.getfloat("peak height/V")
+    config["peak width"] = section.getint("peak width/pts")
+    config["kp"] = section.getfloat("kp")
+    config["kp on"] = section.getboolean("kp on")
+    config["ki"] = section.getfloat("ki")
+    config["ki on"] = section.getboolean("ki on")
+    config["kd"] = section.getfloat("kd")
+    config["kd on"] = section.getboolean("kd on")
+    config["offset"] = section.getfloat("offset/V")
+    config["limit"] = section.getfloat("limit/V")
+    config["daq ai"] = section.get("daq ai")
+    config["daq ao"] = section.get("daq ao")
+    config["wavenumber"] = section.getfloat("wavenumber/cm-1")
+    return config
+
+# the [Cavity] section
+def cavity_section(section):
+    config = channel_section(section)
+    config["set point"] = section.getfloat("set point/ms")
+    return config
+
+# a [Laser<i>] section
+def laser_section(section):
+    config = channel_section(section)
+    config["label"] = section.get("label")
+    config["local freq"] = section.getfloat("local freq/MHz")
+    config["freq source"] = section.get("freq source")
+    return config
@@ -0,0 +1,327 @@
+import socket
+import threading
+import struct
+import asyncio
+import logging
+import numpy as np
+
+from .sequence import ramp
+
+
+# TCP server that receives laser frequency setpoints from client PCs, it doesn't depend on the GUI.
+# Data protocol is as following: (10 bytes per message)
+# the first 2 bytes are index of the laser whose frequency setpoint need to change (unsigned short, big endian)
+# the rest 8 bytes are laser frequency in MHz (double, big endian)
+# Every message is echoed back once its setpoint is handed to the lock.
+#
+# It's an asyncio server running in the thread that calls serve(). Every connection has its own receive buffer,
+# so messages of clients sending at the same time never mix, and replies are written without blocking (asyncio buffers them
+# and sends them when the socket is ready). A client that doesn't read its replies is paused instead of growing the buffer.
+# Setpoints received from all clients in one event loop iteration are applied together: set_freq(laser, freq) is called for
+# the latest setpoint of every laser, then publish() once, so a burst of messages costs one parameter snapshot.
+# notify(dict) is called for every connection change and applied setpoint,
+# dict["type"] is "open connection" (with "client addr"), "close connection" or "data" (with "laser" and "freq").
+#
+# Setpoint sequences: a 10-byte header with 0xFFFE (sequence_index, unsigned short), laser index (unsigned short), flags (unsigned short)
+# and number of points (unsigned int), followed by that many 10-byte points, each with a dwell in cycles (unsigned short, 1 to 65535)
+# and a frequency in MHz (double), all big endian. The lock steps through the points on cycle boundaries, see setpointSequencer.
+# Flags: bit 0 advances to the next point at every external trigger edge instead (dwells are ignored), bit 1 makes it a linear ramp,
+# whose two points are (dwell, start frequency) and (number of steps, stop frequency), bit 2 repeats the sequence until it's cancelled.
+# A header with 0 points cancels the sequence of that laser, and so does a plain setpoint for it. The whole sequence is echoed
+# once set_sequence(laser, freqs, dwells, trigger, repeat) has handed it to the lock, notify() gets "sequence" (with "laser" and "points").
+# set_sequence() is called with empty freqs and dwells to cancel, also for every laser that gets a plain setpoint, and raises if the lock
+# can't run the sequence, which is then not echoed.
+#
+# Telemetry: a message with laser index 0xFFFF (subscribe_index) subscribes its connection to loop telemetry,
+# the 8 bytes are the number of records per second it wants (0 unsubscribes, inf or any rate above the cycle rate gets every cycle).
+# The message is echoed as an acknowledgement. Records are then sent as 0xFFFD (record_index, unsigned short), record size in bytes
+# (unsigned short), and the record itself, see telemetry_dtype() for its layout. Telemetry comes from telemetryRings handed over
+# with set_telemetry(), they are polled every poll_interval seconds. A subscriber whose connection has more than max_buffered bytes
+# waiting to be sent loses records instead, so a slow client neither delays other clients nor makes the server buffer grow.
+class tcpServer:
+    msg_size = 10
+    msg_format = struct.Struct(">Hd")
+    subscribe_index = 0xFFFF
+    sequence_index = 0xFFFE
+    sequence_header = struct.Struct(">HHHI")
+    sequence_point = np.dtype([("dwell", ">u2"), ("freq", ">f8")])
+    max_sequence = 1000000 # points
+    record_index = 0xFFFD
+    record_header = struct.Struct(">HH")
+    poll_interval = 0.005
+    max_buffered = 65536
+
+    def __init__(self, host, port, set_freq, notify=lambda event: None, publish=lambda: None, set_sequence=None):
+        if host == "None":
+            self.host = socket.gethostbyname(socket.gethostname())
+        else:
+            self.host = host
+        self.port = port
+        self.set_freq = set_freq
+        self.notify = notify
+        self.publish = publish
+        self.set_sequence = set_sequence
+        self.loop = None
+        self.stopped = False
+        self.pending = {} # latest setpoint of every laser received in this event loop iteration
+        self.apply_scheduled = False
+        self.sequences = [] # (connection, laser, flags, points) of sequences received in this event loop iteration
+        self.replies = {} # connection: messages to echo once pending setpoints are applied
+        self.telemetry = {} # lock index: [telemetryRing, number of records read]
+
+        # bind here, so an address in use is reported to the caller
+        self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Avoid bind() exception: OSError: [Errno 48] Address already in use
+        self.server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_sock.bind((self.host, self.port))
+        self.server_sock.listen()
+        logging.info(f"listening on: ({self.host}, {self.port})")
+        self.server_sock.setblocking(False)
+
+    # serve until stop() is called, then close all connections and the server socket
+    def serve(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+        self.stop_event = asyncio.Event()
+        self.thread_id = threading.get_ident()
+        self.loop = asyncio.get_running_loop()
+        if self.stopped:
+            self.stop_event.set()
+        server = await self.loop.create_server(lambda: tcpConnection(self), sock=self.server_sock)
+        poller = asyncio.create_task(self.poll_telemetry())
+        async with server:
+            await self.stop_event.wait()
+            poller.cancel()
+            server.close()
+            for conn in list(self.replies):
+                conn.transport.close()
+        self.server_sock.close()
+
+    # make serve() return, it can be called from any thread
+    def stop(self):
+        self.stopped = True
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.stop_event.set)
+            except RuntimeError:
+                # event loop has already finished
+                pass
+
+    # read records from telemetryRing ring of lock index from now on, or stop reading it if ring is None.
+    # It can be called from any thread, once it returns the old ring of that index is never read again, so it can be closed.
+    def set_telemetry(self, ring, index=0):
+        def swap():
+            if ring is None:
+                self.telemetry.pop(index, None)
+            else:
+                self.telemetry[index] = [ring, ring.written()]
+        loop = self.loop
+        if loop is None or not loop.is_running() or threading.get_ident() == self.thread_id:
+            swap()
+            return
+        done = threading.Event()
+        def swap_in_loop():
+            swap()
+            done.set()
+        try:
+            loop.call_soon_threadsafe(swap_in_loop)
+        except RuntimeError:
+            # event loop has already finished
+            swap()
+            return
+        if not done.wait(timeout=5):
+            logging.error("TCP server didn't release telemetry.")
+
+    async def poll_telemetry(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            subscribers = [conn for conn in self.replies if conn.rate > 0]
+            for index, source in list(self.telemetry.items()):
+                ring, since = source
+                if not subscribers:
+                    # nobody to send them to, skip records written so far
+                    source[1] = ring.written()
+                    continue
+                records, source[1] = ring.read(since)
+                if len(records) == 0:
+                    continue
+                records["lock"] = index
+                times = records["time"]
+                data = records.tobytes()
+                size = records.dtype.itemsize
+                header = self.record_header.pack(self.record_index, size)
+                for conn in subscribers:
+                    # the first record of every 1/rate seconds, so the average rate is the one asked for
+                    selected = []
+                    due = conn.due.get(index, -np.inf)
+                    for i, t in enumerate(times):
+                        if t >= due:
+                            selected.append(i)
+                            due = due + conn.period if t < due + conn.period else t + conn.period
+                    if not selected:
+                        continue
+                    conn.due[index] = due
+                    if conn.transport.get_write_buffer_size() > self.max_buffered:
+                        conn.dropped += len(selected)
+                        continue
+                    conn.transport.write(b"".join(header + data[i*size:(i+1)*size] for i in selected))
+                    conn.sent += len(selected)
+
+    def subscribe(self, conn, rate):
+        if rate > 0:
+            conn.rate = rate
+            conn.period = 0.0 if rate == np.inf else 1.0/rate
+            logging.info(f"telemetry subscription at {rate} records/s.")
+        else:
+            if conn.rate > 0:
+                logging.info(f"telemetry subscription ended, {conn.sent} records sent, {conn.dropped} dropped.")
+            conn.rate = 0.0
+
+    def connection_made(self, conn, addr):
+        logging.info(f"accepted connection from: {addr}")
+        self.replies[conn] = bytearray()
+        self.notify({"type": "open connection", "client addr": addr})
+
+    def connection_lost(self, conn):
+        logging.info("client shutting down...")
+        self.replies.pop(conn, None)
+        self.notify({"type": "close connection"})
+
+    # complete messages received from a connection
+    def received(self, conn, data):
+        if not self.apply_scheduled:
+            # apply after all data already received in this event loop iteration is parsed
+            self.loop.call_soon(self.apply)
+            self.apply_scheduled = True
+        reply = self.replies[conn]
+        size = self.msg_size
+        for i, (laser, freq) in enumerate(self.msg_format.iter_unpack(data)):
+            msg = data[i*size:(i+1)*size]
+            if conn.sequence is not None:
+                # points of a sequence
+                conn.sequence.append(msg)
+                self.sequence_received(conn)
+            elif laser == self.sequence_index:
+                count = self.sequence_header.unpack(msg)[3]
+                if count > self.max_sequence:
+                    # the rest of this connection's data can't be framed any more
+                    logging.error(f"TCP server error: sequence of {count} points is too long, close the connection.")
+                    conn.transport.close()
+                    return
+                conn.sequence = [msg]
+                conn.sequence_count = count
+                self.sequence_received(conn)
+            else:
+                if laser == self.subscribe_index:
+                    self.subscribe(conn, freq)
+                else:
+                    self.pending[laser] = freq
+                reply += msg
+
+    # move the sequence of a connection to the ones to apply, once all its points are received
+    def sequence_received(self, conn):
+        if len(conn.sequence) <= conn.sequence_count:
+            return
+        _, laser, flags, _ = self.sequence_header.unpack(conn.sequence[0])
+        self.sequences.append((conn, laser, flags, b"".join(conn.sequence)))
+        conn.sequence = None
+
+    def apply(self):
+        self.apply_scheduled = False
+        pending, self.pending = self.pending, {}
+        invalid = set()
+        for laser, freq in pending.items():
+            try:
+                self.set_freq(laser, freq)
+            except Exception as err:
+                logging.error(f"TCP server error, laser {laser}: \n{err}")
+                invalid.add(laser)
+        if pending:
+            try:
+                self.publish()
+            except Exception as err:
+                logging.error(f"TCP server error: \n{err}")
+            # a plain setpoint ends the sequence of its laser, sequences of this batch are loaded after this
+            if self.set_sequence is not None:
+                for laser in pending:
+                    if laser in invalid:
+                        continue
+                    try:
+                        self.set_sequence(laser, [], [], False, False)
+                    except Exception as err:
+                        logging.error(f"TCP server error, laser {laser}: \n{err}")
+
+        for laser, freq in pending.items():
+            if laser not in invalid:
+                self.notify({"type": "data", "laser": laser, "freq": freq})
+
+        if invalid:
+            # messages whose setpoint isn't applied aren't echoed
+            for conn, reply in self.replies.items():
+                self.replies[conn] = bytearray(b"".join(self.msg_format.pack(laser, freq) for laser, freq in self.msg_format.iter_unpack(reply) if laser not in invalid))
+
+        # sequences go after setpoints, so a sequence wins over a setpoint of the same laser in the same batch
+        sequences, self.sequences = self.sequences, []
+        for conn, laser, flags, msg in sequences:
+            try:
+                if self.set_sequence is None:
+                    raise ValueError("sequences aren't supported by this server.")
+                points = np.frombuffer(msg, dtype=self.sequence_point, offset=self.msg_size)
+                freqs, dwells = points["freq"], points["dwell"]
+                if flags & 2 and len(points) > 0:
+                    if len(points) != 2:
+                        raise ValueError("a ramp needs exactly two points.")
+                    freqs, dwells = ramp(freqs[0], freqs[1], int(dwells[1]), int(dwells[0]))
+                self.set_sequence(laser, freqs, dwells, bool(flags & 1), bool(flags & 4))
+            except Exception as err:
+                logging.error(f"TCP server error, sequence of laser {laser}: \n{err}")
+                continue
+            self.notify({"type": "sequence", "laser": laser, "points": len(freqs)})
+            if conn in self.replies:
+                self.replies[conn] += msg
+
+        for conn, reply in self.replies.items():
+            if not reply:
+                continue
+            conn.transport.write(bytes(reply))
+            self.replies[conn] = bytearray()
+
+# one client connection, it keeps its own buffer of partially received messages
+class tcpConnection(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+        self.buffer = bytearray()
+        # messages of a sequence being received, and its number of points, see tcpServer
+        self.sequence = None
+        self.sequence_count = 0
+        # telemetry subscription, see tcpServer
+        self.rate = 0.0
+        self.period = 0.0
+        self.due = {} # lock index: time from which the next record is sent
+        self.sent = 0
+        self.dropped = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.connection_made(self, transport.get_extra_info("peername"))
+
+    def data_received(self, data):
+        self.buffer += data
+        n = len(self.buffer) - len(self.buffer) % self.server.msg_size
+        if n > 0:
+            self.server.received(self, bytes(self.buffer[:n]))
+            del self.buffer[:n]
+
+    def connection_lost(self, exc):
+        if exc is not None:
+            logging.error(f"TCP connection error: \n{exc}")
+        self.server.subscribe(self, 0)
+        self.server.connection_lost(self)
+
+    # the client doesn't read replies fast enough, stop reading its messages until it catches up
+    def pause_writing(self):
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.transport.resume_reading()
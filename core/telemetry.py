@@ -0,0 +1,83 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+
+# record of one feedback loop cycle, as it's kept in telemetryRing and sent to subscribed TCP clients (big endian, no padding)
+# channel 0 is cavity, channel i is laser i-1; bit 0 of flags is peak found, bit 1 is locked
+def telemetry_dtype(ch_num):
+    return np.dtype([
+                     ("lock", "u1"), # index of the lock, set by the TCP server when a supervisor runs several locks
+                     ("cycle", ">u8"),
+                     ("time", ">f8"), # time.time() of the cycle
+                     ("cavity first peak", ">f4"), # in ms, relative to the chopped scan
+                     ("cavity pk sep", ">f4"), # in ms
+                     ("setpoint", ">f4", (ch_num,)), # cavity in ms relative to the chopped scan, lasers in MHz
+                     ("error", ">f4", (ch_num,)), # in MHz
+                     ("output", ">f4", (ch_num,)), # in V
+                     ("flags", "u1", (ch_num,)),
+                    ])
+
+# number of channels in a record of the given size in bytes
+def telemetry_ch_num(itemsize):
+    return (itemsize - telemetry_dtype(0).itemsize)//13
+
+
+# A ring of records of the latest cycles in shared memory, written by the feedback loop in every cycle and read by the TCP server,
+# in the same or in another process. The writer never waits for readers: it overwrites the oldest record and then bumps the record count.
+# A reader remembers how many records it has read, and drops the records that are overwritten before or while it copies them.
+# The owner (name=None) creates the shared memory and removes it in close(), the other side attaches to it by name.
+class telemetryRing:
+    def __init__(self, ch_num, length=4096, name=None):
+        self.dtype = telemetry_dtype(ch_num)
+        self.length = length
+        self.owner = name is None
+        size = 8 + length*self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=size) if self.owner else shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.count = np.ndarray(1, dtype=np.int64, buffer=self.shm.buf) # number of records written
+        self.records = np.ndarray(length, dtype=self.dtype, buffer=self.shm.buf, offset=8)
+        # the record of this cycle is filled here and then copied into the ring at once
+        self.record = np.zeros((), dtype=self.dtype)
+        if self.owner:
+            self.count[0] = 0
+
+    # add the record of one cycle
+    def write(self, cycle, t, first_peak, pk_sep, cavity_setpoint, laser_setpoint, err, output, found, locked):
+        record = self.record
+        record["cycle"] = cycle
+        record["time"] = t
+        record["cavity first peak"] = first_peak
+        record["cavity pk sep"] = pk_sep
+        record["setpoint"][0] = cavity_setpoint
+        record["setpoint"][1:] = laser_setpoint
+        record["error"] = err
+        record["output"] = output
+        np.add(found, 2*locked, out=record["flags"], casting="unsafe")
+        n = int(self.count[0])
+        self.records[n % self.length] = record
+        self.count[0] = n + 1
+
+    # number of records written so far, a reader starts from here to skip old records
+    def written(self):
+        return int(self.count[0])
+
+    # copies of records written since the first "since" records, and the number to pass as "since" next time
+    # the writer overwrites the slot of record count-length before it bumps count, so the oldest safe record is count-length+1
+    def read(self, since):
+        end = int(self.count[0])
+        start = max(since, end - self.length + 1)
+        idx = np.arange(start, end) % self.length
+        records = self.records[idx]
+        # records that have been (or are being) overwritten while being copied
+        start2 = int(self.count[0]) - self.length + 1
+        if start2 > start:
+            records = records[start2-start:]
+        return records, end
+
+    # detach from the shared memory, and remove it if this is the owner
+    def close(self):
+        self.count = None
+        self.records = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,180 @@
+# Run the lock without GUI: load a settings file, run the feedback loop, TCP server and hdf logger, and report lock status in the log.
+# Nothing is plotted, so an unattended lock PC doesn't spend CPU on rendering. Stop it with Ctrl+C (or SIGTERM).
+# With --status-file, the latest status is also written into a json file at every report, for other programs to watch.
+# Usage: python headless.py [saved_settings/config_latest.ini] [--status-interval 10] [--status-file status.json] [--duration s]
+
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import argparse
+import threading
+import ctypes
+import numpy as np
+
+from core import daq_backend, lockParams, lockMonitor, loopThread, loopProcess, load_settings, tcpServer, send_sequence
+
+
+# owns everything mainWindow owns when the lock runs: config dictionaries, the feedback loop and the TCP server
+class lockServer:
+    def __init__(self, file_name):
+        self.config, self.cavity_config, self.laser_configs = load_settings(file_name)
+        self.laser_num = len(self.laser_configs)
+        self.params_lock = threading.Lock()
+        self.daq_backend = daq_backend(self.config["daq backend"])
+        self.worker = None
+        self.tcp_thread = None
+        # used to save feedback voltage for the loop
+        self.cavity_last_feedback = 0
+        self.laser_last_feedback = np.zeros(self.laser_num, dtype=np.float64)
+
+    def compile_params(self):
+        return lockParams(self.config, self.cavity_config, self.laser_configs)
+
+    # hand a new parameter snapshot to the running loop, see mainWindow.publish_params()
+    def publish_params(self):
+        with self.params_lock:
+            if self.worker is not None:
+                self.worker.send("params", self.compile_params())
+
+    # called by the TCP server for every setpoint received, publish_params() is called after a batch of them
+    def set_freq(self, laser, freq):
+        self.laser_configs[laser]["global freq"] = freq
+
+    # called by the TCP server for a setpoint sequence, empty freqs cancels it, see send_sequence()
+    def set_sequence(self, laser, freqs, dwells, trigger, repeat):
+        with self.params_lock:
+            send_sequence(None if self.worker is None else self.worker.send, self.config, self.laser_configs, self.compile_params,
+                          laser, freqs, dwells, trigger, repeat)
+
+    def tcp_event(self, event):
+        if event["type"] == "open connection":
+            logging.info(f"client {event['client addr']} connected.")
+        elif event["type"] == "close connection":
+            logging.info("client disconnected.")
+
+    # start the feedback loop, and the TCP server if tcp is True (a supervisor may run one TCP server for several locks)
+    def start(self, tcp=True):
+        # the lock monitor judges lock status from frames taken out of the mailbox, with the same criteria as the GUI
+        self.monitor = lockMonitor(self.config["RMS length"], self.laser_num+1)
+        self.frame = None
+        if self.config["process mode"]:
+            self.worker = loopProcess(self.compile_params(), self.config["daq backend"], self.cavity_last_feedback, self.laser_last_feedback, self.config["loop cpu"])
+        else:
+            self.worker = loopThread(self.compile_params(), self.daq_backend, self.cavity_last_feedback, self.laser_last_feedback)
+        self.worker.start()
+
+        if not tcp:
+            return
+        self.tcp = tcpServer(self.config["host address"], self.config["port"], self.set_freq, self.tcp_event, self.publish_params, self.set_sequence)
+        self.tcp.set_telemetry(self.worker.telemetry)
+        self.tcp_thread = threading.Thread(target=self.tcp.serve, name="tcp server", daemon=True)
+        self.tcp_thread.start()
+
+    def stop(self):
+        if self.tcp_thread is not None:
+            self.tcp.stop()
+            self.tcp_thread.join()
+            self.tcp_thread = None
+
+        if self.worker is not None:
+            self.worker.send("stop")
+            feedback = self.worker.wait()
+            if feedback is not None:
+                self.cavity_last_feedback, self.laser_last_feedback = feedback
+            self.worker = None
+
+    def running(self):
+        return self.worker is not None and self.worker.is_alive()
+
+    # take the latest frame if there's a new one, and update lock status with it
+    def pull(self):
+        frame = self.worker.mailbox.take()
+        if frame is None:
+            return
+        err = np.concatenate(([frame["cavity error"]], frame["laser error"]))
+        found = np.concatenate(([frame["cavity peak found"]], frame["laser peak found"]))
+        self.monitor.update(err, found, self.config["lock criteria"])
+        self.frame = frame
+
+    # lock status of the cavity and every laser, from the latest frame
+    def status(self):
+        if self.frame is None:
+            return None
+        frame = self.frame
+        rms = self.monitor.stats.std()
+        status = {"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                  "cavity": {"locked": bool(self.monitor.locked[0]), "error/MHz": float(frame["cavity error"]), "rms/MHz": float(rms[0]),
+                             "output/V": float(frame["cavity output"]), "first peak/ms": float(self.config["scan ignore"]+frame["cavity first peak"])},
+                  "lasers": []}
+        for i, laser in enumerate(self.laser_configs):
+            setpoint = laser["local freq"] if laser["freq source"] == "local" else laser["global freq"]
+            found = bool(frame["laser peak found"][i])
+            status["lasers"].append({"label": laser["label"], "locked": bool(self.monitor.locked[i+1]), "setpoint/MHz": setpoint,
+                                     "freq/MHz": setpoint-float(frame["laser error"][i]) if found else None,
+                                     "rms/MHz": float(rms[i+1]), "output/V": float(frame["laser output"][i])})
+        cycle = frame["latency"][-1]
+        status["cycle p50/ms"], status["cycle p99/ms"] = float(cycle[0]), float(cycle[1])
+        return status
+
+# one line per report
+def status_line(status):
+    cavity = status["cavity"]
+    line = f"cavity {'locked' if cavity['locked'] else 'UNLOCKED'} rms {cavity['rms/MHz']:.2f} MHz"
+    for laser in status["lasers"]:
+        freq = "no peak" if laser["freq/MHz"] is None else f"{laser['freq/MHz']:.1f} MHz"
+        line += f" | {laser['label']} {'locked' if laser['locked'] else 'UNLOCKED'} {freq} rms {laser['rms/MHz']:.2f} MHz"
+    return line + f" | cycle p50 {status['cycle p50/ms']:.2f} ms, p99 {status['cycle p99/ms']:.2f} ms"
+
+def write_status(file_name, status):
+    # write a new file and replace the old one, so readers never see a partial file
+    tmp = file_name + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(status, f, indent=1)
+    os.replace(tmp, file_name)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the cavity lock without GUI.")
+    parser.add_argument("settings", nargs="?", default=os.path.join("saved_settings", "config_latest.ini"), help="settings file to load")
+    parser.add_argument("--status-interval", type=float, default=10.0, help="seconds between lock status reports")
+    parser.add_argument("--status-file", help="also write the latest status into this json file")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds, run until interrupted by default")
+    args = parser.parse_args()
+
+    logging.basicConfig(level="INFO", format="%(asctime)s %(levelname)s: %(message)s")
+    if sys.platform == "win32":
+        # units are 100 ns, set windows timer resolution to be 1 ms, see main.py
+        current_res = ctypes.c_ulong()
+        ctypes.windll.ntdll.NtSetTimerResolution(10000, True, ctypes.byref(current_res))
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    server = lockServer(args.settings)
+    server.start()
+    logging.info(f"lock started with {args.settings}, {server.laser_num} laser(s), {'process' if server.config['process mode'] else 'thread'} mode.")
+    t0 = time.time()
+    last_report = t0
+    try:
+        # frames are taken at display rate, same as the GUI
+        while not stop.wait(1/server.config["display rate"]):
+            if not server.running():
+                logging.error("feedback loop stopped unexpectedly, see errors above.")
+                break
+            server.pull()
+            t = time.time()
+            if t - last_report >= args.status_interval:
+                last_report = t
+                status = server.status()
+                if status is not None:
+                    logging.info(status_line(status))
+                    if args.status_file:
+                        write_status(args.status_file, status)
+            if args.duration is not None and t - t0 >= args.duration:
+                break
+    finally:
+        server.stop()
+        logging.info("lock stopped.")
@@ -2,26 +2,20 @@ import sys
 import time
 import logging
 import traceback
+import threading
 import configparser
 import numpy as np
-from scipy import signal
-from scipy import sparse
-from scipy.sparse import linalg
 import PyQt5
 import pyqtgraph as pg
 import PyQt5.QtGui as QtGui
 import PyQt5.QtWidgets as qt
 import os
-import nidaqmx
 import qdarkstyle # see https://github.com/ColinDuquesnoy/QDarkStyleSheet
-from collections import deque
 import socket
-import selectors
-import struct
 import ctypes
-import h5py
 
 from widgets import NewBox, NewComboBox, NewDoubleSpinBox, NewPlot, NewScrollArea, NewSpinBox, hLine, pt_to_px, ScientificDoubleSpinBox
+from core import daq_backend, latencyRecorder, lockParams, rollingStats, minmax_decimate, loopThread, loopProcess, setting_section, cavity_section, laser_section, tcpServer, send_sequence
 
 
 # the base class for cavityColumn class and laserColumn class
@@ -166,24 +160,23 @@ class abstractLaserColumn(qt.QGroupBox):
 
     # collect available DAQ devices and their channels and update the content of DAQ channel comboBoxes
     def update_daq_channel(self):
+        backend = self.parent.daq_backend
         in_ch = self.daq_in_cb.currentText()
         self.daq_in_cb.clear()
         # get available DAQ devices
-        dev_collect = nidaqmx.system._collections.device_collection.DeviceCollection()
-        for i in dev_collect.device_names:
+        dev_names = backend.device_names()
+        for i in dev_names:
             # get available AI channels for each DAQ device
-            ch_collect = nidaqmx.system._collections.physical_channel_collection.AIPhysicalChannelCollection(i)
-            for j in ch_collect.channel_names:
+            for j in backend.ai_channel_names(i):
                 # add available AI channels to comboBox option list
                 self.daq_in_cb.addItem(j)
         self.daq_in_cb.setCurrentText(in_ch)
 
         out_ch = self.daq_out_cb.currentText()
         self.daq_out_cb.clear()
-        for i in dev_collect.device_names:
+        for i in dev_names:
             # get available AO channels for each DAQ device
-            ch_collect = nidaqmx.system._collections.physical_channel_collection.AOPhysicalChannelCollection(i)
-            for j in ch_collect.channel_names:
+            for j in backend.ao_channel_names(i):
                 # add available AO channels to comboBox option list
                 self.daq_out_cb.addItem(j)
         self.daq_out_cb.setCurrentText(out_ch)
@@ -191,22 +184,7 @@ class abstractLaserColumn(qt.QGroupBox):
     # update the value of self.config dictionary
     def update_config_elem(self, text, val):
         self.config[text] = val
-
-    # update self.config from config
-    def update_config(self, config):
-        self.config["peak height"] = config.getfloat("peak height/V")
-        self.config["peak width"] = config.getint("peak width/pts")
-        self.config["kp"] = config.getfloat("kp")
-        self.config["kp on"] = config.getboolean("kp on")
-        self.config["ki"] = config.getfloat("ki")
-        self.config["ki on"] = config.getboolean("ki on")
-        self.config["kd"] = config.getfloat("kd")
-        self.config["kd on"] = config.getboolean("kd on")
-        self.config["offset"] = config.getfloat("offset/V")
-        self.config["limit"] = config.getfloat("limit/V")
-        self.config["daq ai"] = config.get("daq ai")
-        self.config["daq ao"] = config.get("daq ao")
-        self.config["wavenumber"] = config.getfloat("wavenumber/cm-1")
+        self.parent.publish_params()
 
     # update widget value/text from self.config
     def update_widgets(self):
@@ -294,13 +272,13 @@ class cavityColumn(abstractLaserColumn):
 
     def clear_feedback(self):
         try:
-            self.parent.daq_thread.cavity_last_feedback = 0
+            self.parent.daq_thread.send("clear feedback", 0)
         except AttributeError:
             pass
 
+    # update self.config from the [Cavity] section of a settings file
     def update_config(self, config):
-        super().update_config(config)
-        self.config["set point"] = config.getfloat("set point/ms")
+        self.config.update(cavity_section(config))
 
     def update_widgets(self):
         super().update_widgets()
@@ -383,15 +361,13 @@ class laserColumn(abstractLaserColumn):
 
     def clear_feedback(self):
         try:
-            self.parent.daq_thread.laser_last_feedback[self.index] = 0
+            self.parent.daq_thread.send("clear feedback", self.index+1)
         except AttributeError:
             pass
 
+    # update self.config from a [Laser<i>] section of a settings file
     def update_config(self, config):
-        super().update_config(config)
-        self.config["label"] = config.get("label")
-        self.config["local freq"] = config.getfloat("local freq/MHz")
-        self.config["freq source"] = config.get("freq source")
+        self.config.update(laser_section(config))
 
     def update_widgets(self):
         super().update_widgets()
@@ -412,416 +388,57 @@ class laserColumn(abstractLaserColumn):
 
         return config
 
-    # set frequency setpoint source, local or global
+    # set frequency setpoint source, local or global, a sequence of global setpoints ends when switched to local
     def set_freq_source(self, source, val):
         if val:
             self.update_config_elem("freq source", source)
+            if source == "local":
+                self.parent.set_sequence(self.index, [], [], False, False)
 
-# the worker thread that interfaces with DAQ and calculate PID feedback voltage
-class daqThread(PyQt5.QtCore.QThread):
-    signal = PyQt5.QtCore.pyqtSignal(dict)
-
+# the worker thread that runs the feedback loop (core/loop.py) in the GUI process
+class daqThread(loopThread):
     def __init__(self, parent):
-        super().__init__()
         self.parent = parent
-        self.counter = 0
-        self.err_counter = 1
-        self.samp_rate = self.parent.config["sampling rate"]
-        self.dt = 1.0/self.samp_rate
-        # number of samples to write/read
-        self.samp_num = round(self.parent.config["scan time"]/1000.0*self.samp_rate)
-        self.laser_num = len(self.parent.laser_list)
-
-        # initialize all DAQ tasks
-        self.ai_task_init() # read data for cavity and all lasers
-        self.cavity_ao_task_init() # cavity sanning voltage, synchronized with ai_task
-        self.laser_ao_task_init() # control laser piezo voltage, running in "on demand" mode
-        self.counter_task_init() # configure a counter to use as the clock for ai_task and cavity_ao_task, for synchronization and retriggerability
-        self.do_task_init() # trigger the counter to generate a pulse train, running in "on demand" mode
-
-    def run(self):
-        self.laser_output = np.empty(self.laser_num, dtype=np.float64)
-        self.laser_last_err = np.zeros((self.laser_num, 2), dtype=np.float64) # save frequency errors in laset two cycles, used for PID calculation
-        self.laser_last_feedback = self.parent.laser_last_feedback # use feedback voltage from last run as the initial feedback voltage of this run, to avoid laser freq jump
-        self.laser_peak_found = np.zeros(self.laser_num, dtype=np.bool_) # initially all False
-        for i, laser in enumerate(self.parent.laser_list):
-            self.laser_output[i] = laser.config["offset"] + self.laser_last_feedback[i]
-
-        self.cavity_scan = np.linspace(self.parent.config["scan amp"], 0, self.samp_num, dtype=np.float64) # cavity scanning voltage, reversed sawtooth wave
-        self.cavity_last_err = np.zeros(2, dtype=np.float64) # save frequency errors in laset two cycles, used for PID calculation
-        self.cavity_last_feedback = self.parent.cavity_last_feedback # use feedback voltage from last run as the initial feedback voltage of this run, to avoid laser freq jump
-        self.cavity_output = self.parent.cavity.config["offset"] + self.cavity_last_feedback
-        self.cavity_peak_found = False
-
-        self.laser_ao_task.write(self.laser_output)
-        self.cavity_ao_task.write(self.cavity_scan + self.cavity_output)
-
-        # start all tasks
-        self.ai_task.start()
-        self.cavity_ao_task.start()
-        self.laser_ao_task.start()
-        self.counter_task.start()
-        self.do_task.start()
-
-        while self.parent.active:
-            num_run = self.parent.config["average"]
-            for i in range(num_run):
-                # trigger counter, to start AI/AO for the first cycle
-                self.do_task.write([False, True, False])
-                if i == 0:
-                    pd_data = np.array(self.ai_task.read(number_of_samples_per_channel=self.samp_num, timeout=10.0), dtype=np.float64)
-                else:
-                    ai_read = np.array(self.ai_task.read(number_of_samples_per_channel=self.samp_num, timeout=10.0), dtype=np.float64)
-                    pd_data = (ai_read + pd_data*i)/(i+1)
-
-                if i < num_run - 1:
-                    self.ao_task_write()
-
-            # force pd_data to be a 2D array (in case there's only one channel in ai_task so ai_task.read() returns a 1D array)
-            if pd_data.ndim != 2:
-                pd_data = np.reshape(pd_data, (len(pd_data), -1))
-
-            # chop array, because the beginning part of the data array usually have undesired peaks
-            start_length = round(self.parent.config["scan ignore"]/1000*self.samp_rate)
-            pd_data = pd_data[:, start_length:]
-
-            # remove baseline
-            if self.parent.config["baseline remove"]:
-                for i in range(len(pd_data)):
-                    # logging.info(pd_data[i])
-                    # _, pd_data_arPLS, info = self.baseline_arPLS(pd_data[i], ratio=1e-2, lam=1e5, niter=100, full_output=True) # great algorithm, just too slow for us
-                    # pd_data[i] = pd_data_arPLS
-                    pd_data[i] = pd_data[i] - np.mean(pd_data[i])
-
-            # find cavity peaks using "peak height/width" criteria
-            cavity_peaks, _ = signal.find_peaks(pd_data[0], height=self.parent.cavity.config["peak height"], width=self.parent.cavity.config["peak width"])
-
-            # normally this frequency lock method requires two cavity scanning peaks
-            if len(cavity_peaks) == 2:
-                self.cavity_peak_found = True
-                # convert the position of the first peak into unit ms
-                cavity_first_peak = cavity_peaks[0]*self.dt*1000
-                # convert the separation of peaks into unit ms
-                cavity_pk_sep = (cavity_peaks[1] - cavity_peaks[0])*self.dt*1000
-                # calculate cavity error signal in unit MHz
-                cavity_err = (self.parent.cavity.config["set point"] - self.parent.config["scan ignore"] - cavity_first_peak)/cavity_pk_sep*self.parent.config["cavity FSR"]
-                # calculate cavity PID feedback voltage, use "scan time" for an approximate loop time
-                cavity_feedback = self.cavity_last_feedback + \
-                                  (cavity_err-self.cavity_last_err[1])*self.parent.cavity.config["kp"]*self.parent.cavity.config["kp on"] + \
-                                  cavity_err*self.parent.cavity.config["ki"]*self.parent.cavity.config["ki on"]*self.parent.config["scan time"]/1000 + \
-                                  (cavity_err+self.cavity_last_err[0]-2*self.cavity_last_err[1])*self.parent.cavity.config["kd"]*self.parent.cavity.config["kd on"]/(self.parent.config["scan time"]/1000)
-                # coerce cavity feedbak voltage to avoid big jump
-                cavity_feedback = np.clip(cavity_feedback, self.cavity_last_feedback-self.parent.cavity.config["limit"], self.cavity_last_feedback+self.parent.cavity.config["limit"])
-                # check if cavity feedback voltage is NaN, use feedback voltage from last cycle if it is
-                if not np.isnan(cavity_feedback):
-                    self.cavity_last_feedback = cavity_feedback
-                    self.cavity_output = self.parent.cavity.config["offset"] + cavity_feedback
-                else:
-                    logging.warning("cavity feedback voltage is NaN.")
-                    self.cavity_output = self.parent.cavity.config["offset"] + self.cavity_last_feedback
-                self.cavity_last_err[0] = self.cavity_last_err[1]
-                self.cavity_last_err[1] = cavity_err
-
-                for i, laser in enumerate(self.parent.laser_list):
-                    # find laser peak using "peak height/width" criteria
-                    laser_peak, _ = signal.find_peaks(pd_data[i+1], height=laser.config["peak height"], width=laser.config["peak width"])
-                    if len(laser_peak) > 0:
-                        self.laser_peak_found[i] = True
-                        # choose a frequency setpoint source
-                        freq_setpoint = laser.config["global freq"] if laser.config["freq source"] == "global" else laser.config["local freq"]
-                        
-                        # calculate laser frequency error signal, use the peak that's closest to the setpoint
-                        laser_err = freq_setpoint - (laser_peak*self.dt*1000-cavity_first_peak)/cavity_pk_sep*self.parent.config["cavity FSR"]*(laser.config["wavenumber"]/self.parent.cavity.config["wavenumber"])
-                        laser_err = np.amin(abs(laser_err))
-
-                        # below is the old calculated error using the first peak
-                        # calculate laser frequency error signal, use the position of the first peak
-                        # laser_err = freq_setpoint - (laser_peak[0]*self.dt*1000-cavity_first_peak)/cavity_pk_sep*self.parent.config["cavity FSR"]*(laser.config["wavenumber"]/self.parent.cavity.config["wavenumber"])
-                        
-                        # calculate laser PID feedback volatge, use "scan time" for an approximate loop time
-                        laser_feedback = self.laser_last_feedback[i] + \
-                                         (laser_err-self.laser_last_err[i][1])*laser.config["kp"]*laser.config["kp on"] + \
-                                         laser_err*laser.config["ki"]*laser.config["ki on"]*self.parent.config["scan time"]/1000 + \
-                                         (laser_err+self.laser_last_err[i][0]-2*self.laser_last_err[i][1])*laser.config["kd"]*laser.config["kd on"]/(self.parent.config["scan time"]/1000)
-                        
-                        # coerce laser feedbak voltage to avoid big jump
-                        laser_feedback = np.clip(laser_feedback, self.laser_last_feedback[i]-self.parent.cavity.config["limit"], self.laser_last_feedback[i]+self.parent.cavity.config["limit"])
-                        
-                        # check if laser feedback voltage is NaN, use feedback voltage from last cycle if it is
-                        if not np.isnan(laser_feedback):
-                            self.laser_last_feedback[i] = laser_feedback
-                            self.laser_output[i] = laser.config["offset"] + laser_feedback
-                        else:
-                            logging.warning(f"laser {i} feedback voltage is NaN.")
-                            self.laser_output[i] = laser.config["offset"] + self.laser_last_feedback[i]
-                        self.laser_last_err[i][0] = self.laser_last_err[i][1]
-                        self.laser_last_err[i][1] = laser_err
-
-                    else:
-                        self.laser_peak_found[i] = False
-                        self.laser_output[i] = laser.config["offset"] + self.laser_last_feedback[i]
-
-            else:
-                self.cavity_peak_found = False
-                # otherwise use feedback voltage from last cycle
-                cavity_first_peak = cavity_peaks[0]*self.dt*1000 if len(cavity_peaks)>0 else np.nan # in ms
-                cavity_pk_sep = np.nan
-                self.cavity_output = self.parent.cavity.config["offset"] + self.cavity_last_feedback
-                for i, laser in enumerate(self.parent.laser_list):
-                    self.laser_output[i] = laser.config["offset"] + self.laser_last_feedback[i]
-
-            self.ao_task_write()
-
-            # update GUI widgets every certain number of cycles
-            if self.counter%self.parent.config["display per"] == 0:
-                data_dict = {}
-                data_dict["cavity pd_data"] = pd_data[0]
-                data_dict["cavity first peak"] = cavity_first_peak
-                data_dict["cavity pk sep"] = cavity_pk_sep
-                data_dict["cavity error"] = self.cavity_last_err[1]
-                data_dict["cavity output"] = self.cavity_output
-                data_dict["cavity peak found"] = self.cavity_peak_found
-                data_dict["laser pd_data"] = pd_data[1:, :]
-                data_dict["laser error"] = self.laser_last_err[:, 1]
-                data_dict["laser output"] = self.laser_output
-                data_dict["laser peak found"] = self.laser_peak_found
-                self.signal.emit(data_dict)
-
-            self.counter += 1
-
-        # save feedback voltage to parent data attribute
-        self.parent.cavity_last_feedback = self.cavity_last_feedback
-        self.parent.laser_last_feedback = self.laser_last_feedback
-
-        # close all tasks and release resources when this loop finishes
-        self.ai_task.close()
-        self.cavity_ao_task.close()
-        self.laser_ao_task.close()
-        self.counter_task.close()
-        self.do_task.close()
-        self.counter = 0
-
-    # initialize ai_task, which will handle analog read for all ai channels
-    def ai_task_init(self):
-        self.ai_task = nidaqmx.Task("ai task "+time.strftime("%Y%m%d_%H%M%S"))
-        # add cavity ai channel to this task
-        self.ai_task.ai_channels.add_ai_voltage_chan(self.parent.cavity.config["daq ai"], min_val=-0.5, max_val=1.2, units=nidaqmx.constants.VoltageUnits.VOLTS)
-        # add laser ai channels to this task
-        for laser in self.parent.laser_list:
-            self.ai_task.ai_channels.add_ai_voltage_chan(laser.config["daq ai"], min_val=-0.5, max_val=1.2, units=nidaqmx.constants.VoltageUnits.VOLTS)
-        # use the configured counter as clock and make acquisition type to be CONTINUOUS
-        self.ai_task.timing.cfg_samp_clk_timing(
-                                                rate = self.samp_rate,
-                                                source = self.parent.config["counter PFI line"],
-                                                active_edge = nidaqmx.constants.Edge.RISING,
-                                                sample_mode = nidaqmx.constants.AcquisitionType.CONTINUOUS,
-                                                samps_per_chan = self.samp_num
-                                            )
-
-    # initialize cavity_ao_task
-    def cavity_ao_task_init(self):
-        self.cavity_ao_task = nidaqmx.Task("cavity ao task "+time.strftime("%Y%m%d_%H%M%S"))
-        # add cavity ao channel to this task
-        cavity_ao_ch = self.cavity_ao_task.ao_channels.add_ao_voltage_chan(self.parent.cavity.config["daq ao"], min_val=-2.0, max_val=6.0, units=nidaqmx.constants.VoltageUnits.VOLTS)
-        # to avoid error200018
-        # https://forums.ni.com/t5/Multifunction-DAQ/poor-analog-output-performance-error-200018/td-p/1525156?profile.language=en
-        cavity_ao_ch.ao_data_xfer_mech = nidaqmx.constants.DataTransferActiveTransferMode.DMA
-        cavity_ao_ch.ao_data_xfer_req_cond = nidaqmx.constants.OutputDataTransferCondition.ON_BOARD_MEMORY_LESS_THAN_FULL
-        # use the configured counter as clock and make acquisition type to be CONTINUOUS
-        self.cavity_ao_task.timing.cfg_samp_clk_timing(
-                                            rate = self.samp_rate,
-                                            # rate = 1000,
-                                            source = self.parent.config["counter PFI line"],
-                                            active_edge = nidaqmx.constants.Edge.RISING,
-                                            sample_mode = nidaqmx.constants.AcquisitionType.CONTINUOUS,
-                                            samps_per_chan = self.samp_num
-                                        )
-        # disable sample regeneration
-        self.cavity_ao_task.out_stream.regen_mode = nidaqmx.constants.RegenerationMode.DONT_ALLOW_REGENERATION
-        # self.cavity_ao_task.out_stream.regen_mode = nidaqmx.constants.RegenerationMode.ALLOW_REGENERATION
-
-    # initialize laser_ao_task, this task handles ao channel of all lasers
-    def laser_ao_task_init(self):
-        self.laser_ao_task = nidaqmx.Task("laser ao task "+time.strftime("%Y%m%d_%H%M%S"))
-        # add laser ao channel to this task
-        for laser in self.parent.laser_list:
-            self.laser_ao_task.ao_channels.add_ao_voltage_chan(laser.config["daq ao"], min_val=-2.0, max_val=2.0, units=nidaqmx.constants.VoltageUnits.VOLTS)
-        # no sample clock timing or trigger is specified, this task is running in "on demand" mode.
-
-    # initialize a do task, it will be used to trigger the counter
-    def do_task_init(self):
-        self.do_task = nidaqmx.Task("do task "+time.strftime("%Y%m%d_%H%M%S"))
-        self.do_task.do_channels.add_do_chan(self.parent.config["trigger channel"])
-        # no sample clock timing or trigger is specified, this task is running in "on demand" mode.
-
-    # initialize a counter task, it will be used as the clock for ai_task and cavity_ao_task
-    def counter_task_init(self):
-        self.counter_task = nidaqmx.Task("counter task "+time.strftime("%Y%m%d_%H%M%S"))
-        self.counter_task.co_channels.add_co_pulse_chan_freq(
-                                                            counter=self.parent.config["counter channel"],
-                                                            units=nidaqmx.constants.FrequencyUnits.HZ,
-                                                            freq=self.samp_rate,
-                                                            duty_cycle=0.5)
-        self.counter_task.timing.cfg_implicit_timing(sample_mode=nidaqmx.constants.AcquisitionType.FINITE, samps_per_chan=self.samp_num)
-        # it will be triggered by the do channel in do_task
-        self.counter_task.triggers.start_trigger.cfg_dig_edge_start_trig(trigger_source=self.parent.config["trigger channel"], trigger_edge=nidaqmx.constants.Edge.RISING)
-        # make this task retriggerable
-        self.counter_task.triggers.start_trigger.retriggerable = True
-
-    def ao_task_write(self):
-        try:
-            # generate laser piezo feedback voltage from ao channels
-            self.laser_ao_task.write(self.laser_output)
-        except nidaqmx.errors.DaqError as err:
-            logging.error(f"A DAQ error happened at laser ao channels \n{err}")
-
-        try:
-            # update cavity scanning voltage
-            self.cavity_ao_task.write(self.cavity_scan + self.cavity_output)
-        except nidaqmx.errors.DaqError as err:
-            # This is to handle error -50410, which occurs randomly.
-            # "There was no space in buffer when new data was written.
-            # The oldest unread data in the buffer was lost as a result"
-
-            # The only way I know now to avoid this error is to release buffer in EVERY cycle,
-            # by calling "self.cavity_ao_task.control(nidaqmx.constants.TaskMode.TASK_UNRESERVE)"
-            # and then write to buffer "self.cavity_ao_task.write(self.cavity_scan + self.cavity_output, auto_start=True)".
-            # But this way reduces performance.
-
-            # This error may only occur in PCIe-6259 or similar DAQs
-            logging.info(f"This is the {self.err_counter}-th time error occurs. \n{err}")
-            # Abort task, see https://zone.ni.com/reference/en-XX/help/370466AH-01/mxcncpts/taskstatemodel/
-            self.cavity_ao_task.control(nidaqmx.constants.TaskMode.TASK_ABORT)
-            # write to and and restart task
-            self.cavity_ao_task.write(self.cavity_scan + self.cavity_output, auto_start=True)
-            self.err_counter += 1
+        super().__init__(self.parent.compile_params(), self.parent.daq_backend, self.parent.cavity_last_feedback, self.parent.laser_last_feedback)
 
-    # code from https://stackoverflow.com/a/67509948
-    def baseline_arPLS(self, y, ratio=1e-6, lam=100, niter=50, full_output=False):
-        # lam for lambda, smoothness parameter
-        L = len(y)
+    def isRunning(self):
+        return self.is_alive()
 
-        diag = np.ones(L - 2)
-        D = sparse.spdiags([diag, -2*diag, diag], [0, -1, -2], L, L - 2)
+    # wait until closed, and save feedback voltage to parent data attribute
+    def wait(self):
+        feedback = super().wait()
+        if feedback is not None:
+            self.parent.cavity_last_feedback, self.parent.laser_last_feedback = feedback
 
-        H = lam * D.dot(D.T)  # The transposes are flipped w.r.t the Algorithm on pg. 252
-
-        w = np.ones(L)
-        W = sparse.spdiags(w, 0, L, L)
-
-        crit = 1
-        count = 0
-
-        while crit > ratio:
-            z = linalg.spsolve(W + H, W * y)
-            d = y - z
-            dn = d[d < 0]
-
-            m = np.mean(dn)
-            s = np.std(dn)
-
-            w_new = 1 / (1 + np.exp(2 * (d - (2*s - m))/s))
-
-            crit = np.linalg.norm(w_new - w) / np.linalg.norm(w)
-
-            w = w_new
-            W.setdiag(w)  # Do not create a new matrix, just update diagonal values
-
-            count += 1
+# run the feedback loop in a separate process, so plotting and other work in the GUI process don't compete with it for the GIL
+class daqProcess(loopProcess):
+    def __init__(self, parent):
+        self.parent = parent
+        super().__init__(self.parent.compile_params(), self.parent.config["daq backend"], self.parent.cavity_last_feedback,
+                         self.parent.laser_last_feedback, self.parent.config["loop cpu"])
 
-            if count > niter:
-                logging.warning('Maximum number of iterations exceeded')
-                break
+    def isRunning(self):
+        return self.is_alive()
 
-        if full_output:
-            info = {'num_iter': count, 'stop_criterion': crit}
-            return z, d, info
-        else:
-            return z
+    def wait(self):
+        feedback = super().wait()
+        if feedback is not None:
+            self.parent.cavity_last_feedback, self.parent.laser_last_feedback = feedback
 
-# There is a great tutorial about socket programming: https://realpython.com/python-sockets/
-# part of my code is adapted from here.
+# the thread that runs the TCP server (core/tcpserver.py), setpoints from the client PC go to laser columns
 class tcpThread(PyQt5.QtCore.QThread):
     signal = PyQt5.QtCore.pyqtSignal(dict)
 
     def __init__(self, parent):
         super().__init__()
         self.parent = parent
-        self.data = bytes()
-        if self.parent.config["host address"] == "None":
-            self.host = socket.gethostbyname(socket.gethostname())
-        else:
-            self.host = self.parent.config["host address"]
-        self.port = self.parent.config["port"]
-        self.sel = selectors.DefaultSelector()
-
-        self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # Avoid bind() exception: OSError: [Errno 48] Address already in use
-        self.server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server_sock.bind((self.host, self.port))
-        self.server_sock.listen()
-        logging.info(f"listening on: ({self.host}, {self.port})")
-        self.server_sock.setblocking(False)
-        self.sel.register(self.server_sock, selectors.EVENT_READ, data=None)
-
-        # only used for network delay calibration
-        # self.do_task = nidaqmx.Task()
-        # self.do_task.do_channels.add_do_chan("Dev2/port0/line0")
-        # self.do_task.start()
+        self.server = tcpServer(self.parent.config["host address"], self.parent.config["port"], self.set_freq, self.signal.emit, self.parent.publish_params, self.parent.set_sequence)
 
     def run(self):
-        while self.parent.tcp_active:
-            events = self.sel.select(timeout=0.1)
-            for key, mask in events:
-                if key.data is None:
-                    # this event is from self.server_sock listening
-                    self.accept_wrapper(key.fileobj)
-                else:
-                    s = key.fileobj
-                    try:
-                        data = s.recv(1024) # 1024 bytes should be enough for our data
-                    except Exception as err:
-                        logging.error(f"TCP connection error: \n{err}")
-                        continue
-                    if data:
-                        self.data += data
-                        while len(self.data) >= 10:
-                            try:
-                                # data protocol is as following: (10 bytes in total)
-                                # the first 2 bytes are index of the laser whose frequency setpoint need to change
-                                # theh rest 8 bytes are laser frequency
-                                laser_num = struct.unpack('>H', self.data[0:2])[0]
-                                laser_freq = struct.unpack('>d', self.data[2:10])[0]
-                                self.parent.laser_list[laser_num].config["global freq"] = laser_freq
-                                # logging.info(f"laser {laser_num}: freq = {laser_freq}")
-                                self.signal.emit({"type": "data", "laser": laser_num, "freq": laser_freq})
-                                s.sendall(self.data[:10])
-                                # self.do_task.write([True, False]*20)
-                            except Exception as err:
-                                logging.error(f"TCP Thread error: \n{err}")
-                            finally:
-                                self.data = self.data[10:]
-                    else:
-                        # empty data will be interpreted as the signal of client shutting down
-                        logging.info("client shutting down...")
-                        self.sel.unregister(s)
-                        s.close()
-                        self.signal.emit({"type": "close connection"})
-
-        self.sel.unregister(self.server_sock)
-        self.server_sock.close()
-        self.sel.close()
-        # self.do_task.close()
-
-    def accept_wrapper(self, sock):
-        conn, addr = sock.accept()  # Should be ready to read
-        logging.info(f"accepted connection from: {addr}")
-        conn.setblocking(False)
-        self.sel.register(conn, selectors.EVENT_READ, data=123) # In this application, 'data' keyword can be anything but None
-        return_dict = {}
-        return_dict["type"] = "open connection"
-        return_dict["client addr"] = addr
-        self.signal.emit(return_dict)
+        self.server.serve()
+
+    def set_freq(self, laser, freq):
+        self.parent.laser_list[laser].config["global freq"] = freq
 
 class mainWindow(qt.QMainWindow):
     def __init__(self, app):
@@ -829,8 +446,21 @@ class mainWindow(qt.QMainWindow):
         self.app = app
         self.config = {}
         self.active = False
+        self.params_lock = threading.Lock()
+        self.scan_axis_key = None # scan config the cached time axis of transmission plots is built for
+        # GUI pulls the latest loop status from DAQ thread at a fixed rate
+        self.display_timer = PyQt5.QtCore.QTimer(self)
+        self.display_timer.timeout.connect(self.pull_feedback)
         logging.getLogger().setLevel("INFO")
 
+        cf = configparser.ConfigParser()
+        cf.optionxform = str # make config key name case sensitive
+        cf.read(os.path.join("saved_settings", "config_latest.ini"))
+
+        # DAQ backend has to be chosen before any DAQ channel comboBox is populated
+        self.config["daq backend"] = cf["Setting"].get("daq backend", fallback="nidaqmx")
+        self.daq_backend = daq_backend(self.config["daq backend"])
+
         self.box = NewBox(layout_type="grid")
         self.box.frame.setRowStretch(0, 3)
         self.box.frame.setRowStretch(1, 8)
@@ -858,21 +488,12 @@ class mainWindow(qt.QMainWindow):
         self.resize(pt_to_px(540), pt_to_px(750))
         self.show()
 
-        cf = configparser.ConfigParser()
-        cf.optionxform = str # make config key name case sensitive
-        cf.read("saved_settings\config_latest.ini")
-
         self.update_daq_channel()
         self.update_config(cf)
         self.update_widgets()
 
         self.scan_plot.setRange(yRange=(0, self.cavity.config["peak height"]*2.6))
 
-        # type of data that will be written into a hdf file for logging
-        self.dtp = [('time', h5py.string_dtype(encoding='utf-8')), ('cavity DAQ voltage/V', 'f')]
-        for i in range(len(self.laser_list)):
-            self.dtp.append((f'laser{i} freq/MHz', 'f'))
-
         # used to save feedback voltage for daq_thread
         self.cavity_last_feedback = 0
         self.laser_last_feedback = np.zeros(len(self.laser_list), dtype=np.float64)
@@ -942,13 +563,13 @@ class mainWindow(qt.QMainWindow):
         self.scan_box.frame.addWidget(self.lock_criteria_dsb, 1, 3)
 
         self.scan_box.frame.addWidget(qt.QLabel("RMS Length:"), 1, 4, alignment = PyQt5.QtCore.Qt.AlignRight)
-        self.rms_length_sb = NewSpinBox(range=(0, 10000), suffix=None)
+        self.rms_length_sb = NewSpinBox(range=(1, 1000000), suffix=None)
         self.rms_length_sb.valueChanged[int].connect(lambda val, text="RMS length": self.update_config_elem(text, val))
         self.scan_box.frame.addWidget(self.rms_length_sb, 1, 5)
 
-        self.scan_box.frame.addWidget(qt.QLabel("Display per:"), 1, 6, alignment = PyQt5.QtCore.Qt.AlignRight)
-        self.disp_rate_sb = NewSpinBox(range=(5, 10000), suffix=" Cycles")
-        self.disp_rate_sb.valueChanged[int].connect(lambda val, text="display per": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(qt.QLabel("Display rate:"), 1, 6, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.disp_rate_sb = NewSpinBox(range=(1, 100), suffix=" Hz")
+        self.disp_rate_sb.valueChanged[int].connect(lambda val, text="display rate": self.update_config_elem(text, val))
         self.scan_box.frame.addWidget(self.disp_rate_sb, 1, 7)
 
         self.scan_box.frame.addWidget(qt.QLabel("Average:"), 2, 0, alignment = PyQt5.QtCore.Qt.AlignRight)
@@ -960,7 +581,121 @@ class mainWindow(qt.QMainWindow):
         self.baseline_chb = qt.QCheckBox()
         self.baseline_chb.setTristate(False)
         self.baseline_chb.toggled[bool].connect(lambda val, text="baseline remove": self.update_config_elem(text, val))
-        self.scan_box.frame.addWidget(self.baseline_chb, 2, 4)     
+        self.scan_box.frame.addWidget(self.baseline_chb, 2, 4)
+
+        self.scan_box.frame.addWidget(qt.QLabel("Baseline method:"), 5, 0, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.baseline_cb = NewComboBox()
+        self.baseline_cb.setStyleSheet("QComboBox {padding-right: 0px;}")
+        self.baseline_cb.addItems(["mean", "arPLS"])
+        self.baseline_cb.currentTextChanged[str].connect(lambda val, text="baseline method": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(self.baseline_cb, 5, 1)
+
+        self.scan_box.frame.addWidget(qt.QLabel("arPLS lambda:"), 5, 2, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.arpls_lam_dsb = ScientificDoubleSpinBox(range=(1, 1e10), decimals=1, suffix=None)
+        self.arpls_lam_dsb.valueChanged[float].connect(lambda val, text="arPLS lambda": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(self.arpls_lam_dsb, 5, 3)
+
+        self.scan_box.frame.addWidget(qt.QLabel("arPLS iter:"), 5, 4, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.arpls_iter_sb = NewSpinBox(range=(1, 100), suffix=" /cycle")
+        self.arpls_iter_sb.valueChanged[int].connect(lambda val, text="arPLS max iter": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(self.arpls_iter_sb, 5, 5)
+
+        self.scan_box.frame.addWidget(qt.QLabel("arPLS ch:"), 6, 6, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.arpls_ch_sb = NewSpinBox(range=(0, 100), suffix=" /cycle")
+        self.arpls_ch_sb.setToolTip("arPLS solves this many channels (cavity included) per cycle in turn, the others reuse their last baseline, 0 for all.\n"
+                                    "Its solve takes about 0.1 us per sample per channel per iteration, e.g. 16 lasers at 1.25 MS/s take ~10 ms per cycle in all,\n"
+                                    "so cap it to keep up with scan time.")
+        self.arpls_ch_sb.valueChanged[int].connect(lambda val, text="arPLS channels": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(self.arpls_ch_sb, 6, 7)
+
+        self.scan_box.frame.addWidget(qt.QLabel("Pipelined:"), 5, 6, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.pipeline_chb = qt.QCheckBox()
+        self.pipeline_chb.setTristate(False)
+        self.pipeline_chb.setToolTip("Trigger next scan before processing this one, feedback is applied one cycle later")
+        self.pipeline_chb.toggled[bool].connect(lambda val, text="pipeline": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(self.pipeline_chb, 5, 7)
+
+        self.scan_box.frame.addWidget(qt.QLabel("Logging interval:"), 6, 0, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.logging_interval_dsb = NewDoubleSpinBox(range=(0, 3600), decimals=3, suffix=" s")
+        self.logging_interval_dsb.setToolTip("Log laser frequencies and cavity voltage into hdf files at this interval, 0 to log every cycle")
+        self.logging_interval_dsb.valueChanged[float].connect(lambda val, text="logging interval": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(self.logging_interval_dsb, 6, 1)
+
+        self.scan_box.frame.addWidget(qt.QLabel("Recorder length:"), 6, 2, 1, 2, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.recorder_length_dsb = NewDoubleSpinBox(range=(0, 600), decimals=1, suffix=" s")
+        self.recorder_length_dsb.setToolTip("Keep raw traces of this long in memory and save them when the cavity or any laser loses lock, 0 to disable")
+        self.recorder_length_dsb.valueChanged[float].connect(lambda val, text="recorder length": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(self.recorder_length_dsb, 6, 4)
+
+        self.scan_box.frame.addWidget(qt.QLabel("Process mode:"), 7, 0, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.process_mode_chb = qt.QCheckBox()
+        self.process_mode_chb.setTristate(False)
+        self.process_mode_chb.setToolTip("Run the feedback loop in a separate process, so GUI load doesn't affect loop timing")
+        self.process_mode_chb.toggled[bool].connect(lambda val, text="process mode": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(self.process_mode_chb, 7, 1)
+
+        self.scan_box.frame.addWidget(qt.QLabel("Loop CPU:"), 7, 2, 1, 2, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.loop_cpu_sb = NewSpinBox(range=(-1, max((os.cpu_count() or 1)-1, 0)), suffix=None)
+        self.loop_cpu_sb.setSpecialValueText("any")
+        self.loop_cpu_sb.setToolTip("Pin the feedback loop process to this CPU, only used in process mode")
+        self.loop_cpu_sb.valueChanged[int].connect(lambda val, text="loop cpu": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(self.loop_cpu_sb, 7, 4)
+
+        self.scan_box.frame.addWidget(qt.QLabel("Laser AO:"), 7, 5, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.laser_ao_mode_cb = NewComboBox()
+        self.laser_ao_mode_cb.setStyleSheet("QComboBox {padding-right: 0px;}")
+        self.laser_ao_mode_cb.addItems(["on demand", "hardware timed"])
+        self.laser_ao_mode_cb.setToolTip("Hardware timed: laser feedback is updated at the start of every scan, on the counter clock")
+        self.laser_ao_mode_cb.currentTextChanged[str].connect(lambda val, text="laser ao mode": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(self.laser_ao_mode_cb, 7, 6, 1, 2)
+
+        self.scan_box.frame.addWidget(qt.QLabel("Seq. counter:"), 8, 0, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.seq_counter_cb = NewComboBox()
+        self.seq_counter_cb.setStyleSheet("QComboBox {padding-right: 0px;}")
+        self.seq_counter_cb.setToolTip("Counter that counts external trigger edges to advance setpoint sequences, None if there's no such trigger")
+        self.seq_counter_cb.currentTextChanged[str].connect(lambda val, text="sequence counter": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(self.seq_counter_cb, 8, 1, 1, 2)
+
+        self.scan_box.frame.addWidget(qt.QLabel("Seq. trigger:"), 8, 4, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.seq_trigger_cb = NewComboBox()
+        self.seq_trigger_cb.setStyleSheet("QComboBox {padding-right: 0px;}")
+        self.seq_trigger_cb.currentTextChanged[str].connect(lambda val, text="sequence trigger": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(self.seq_trigger_cb, 8, 5, 1, 2)
+
+        self.scan_box.frame.addWidget(qt.QLabel("Trigger mode:"), 9, 0, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.trigger_mode_cb = NewComboBox()
+        self.trigger_mode_cb.setStyleSheet("QComboBox {padding-right: 0px;}")
+        self.trigger_mode_cb.addItems(["software", "free running"])
+        self.trigger_mode_cb.setToolTip("Free running: the counter starts a scan every cycle period by itself, no trigger pulse is written per scan")
+        self.trigger_mode_cb.currentTextChanged[str].connect(lambda val, text="trigger mode": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(self.trigger_mode_cb, 9, 1, 1, 2)
+
+        self.scan_box.frame.addWidget(qt.QLabel("Cycle period:"), 9, 4, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.cycle_period_dsb = NewDoubleSpinBox(range=(0, 1000), decimals=2, suffix=" ms")
+        self.cycle_period_dsb.setToolTip("Time from one scan to the next in free running mode, 0 (or shorter than scan time) for back-to-back scans")
+        self.cycle_period_dsb.valueChanged[float].connect(lambda val, text="cycle period": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(self.cycle_period_dsb, 9, 5)
+
+        self.scan_box.frame.addWidget(qt.QLabel("AO lead:"), 9, 6, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.ao_lead_dsb = NewDoubleSpinBox(range=(0, 1000), decimals=1, suffix=" ms")
+        self.ao_lead_dsb.setToolTip("In free running mode, ao data are written this far ahead of the counter (at least two cycles), the loop stops if it stalls for longer")
+        self.ao_lead_dsb.valueChanged[float].connect(lambda val, text="ao lead": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(self.ao_lead_dsb, 9, 7)
+
+        self.scan_box.frame.addWidget(qt.QLabel("Cavity AO:"), 10, 0, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.cavity_ao_mode_cb = NewComboBox()
+        self.cavity_ao_mode_cb.setStyleSheet("QComboBox {padding-right: 0px;}")
+        self.cavity_ao_mode_cb.addItems(["streamed", "regenerated"])
+        self.cavity_ao_mode_cb.setToolTip("Regenerated: the scan stays in DAQ buffer, only the feedback voltage is written to the offset ao channel in every cycle")
+        self.cavity_ao_mode_cb.currentTextChanged[str].connect(lambda val, text="cavity ao mode": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(self.cavity_ao_mode_cb, 10, 1, 1, 2)
+
+        self.scan_box.frame.addWidget(qt.QLabel("Offset AO:"), 10, 4, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.cavity_offset_cb = NewComboBox()
+        self.cavity_offset_cb.setStyleSheet("QComboBox {padding-right: 0px;}")
+        self.cavity_offset_cb.setToolTip("AO channel that carries cavity feedback voltage with a regenerated scan, summed with the cavity ao channel outside DAQ")
+        self.cavity_offset_cb.currentTextChanged[str].connect(lambda val, text="cavity offset ao": self.update_config_elem(text, val))
+        self.scan_box.frame.addWidget(self.cavity_offset_cb, 10, 5, 1, 2)
         
         self.scan_box.frame.addWidget(qt.QLabel("Counter ch:"), 3, 0, alignment = PyQt5.QtCore.Qt.AlignRight)
         self.counter_cb = NewComboBox()
@@ -984,6 +719,13 @@ class mainWindow(qt.QMainWindow):
         self.refresh_daq_pb.clicked[bool].connect(lambda val: self.refresh_all_daq_ch())
         self.scan_box.frame.addWidget(self.refresh_daq_pb, 4, 4, 1, 3)
 
+        self.scan_box.frame.addWidget(qt.QLabel("DAQ backend:"), 2, 5, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.backend_cb = NewComboBox()
+        self.backend_cb.setStyleSheet("QComboBox {padding-right: 0px;}")
+        self.backend_cb.addItems(["nidaqmx", "simulated"])
+        self.backend_cb.currentTextChanged[str].connect(lambda val: self.set_daq_backend(val))
+        self.scan_box.frame.addWidget(self.backend_cb, 2, 6, 1, 2)
+
         # third sub-box in this part, used for setting saving/loading control
         self.file_box = NewBox(layout_type="hbox")
         self.file_box.setStyleSheet("QGroupBox {border: 1px solid #304249;}")
@@ -1023,6 +765,27 @@ class mainWindow(qt.QMainWindow):
         self.tcp_restart_pb.clicked[bool].connect(lambda val: self.tcp_restart())
         self.tcp_box.frame.addWidget(self.tcp_restart_pb)
 
+        # fifth sub-box in this part, shows p50/p99 time spent in each stage of the feedback loop
+        self.latency_box = NewBox(layout_type="grid")
+        self.latency_box.setMaximumWidth(pt_to_px(520))
+        self.latency_box.setStyleSheet("QGroupBox {border: 1px solid #304249;}")
+        control_box.frame.addWidget(self.latency_box)
+
+        self.latency_box.frame.addWidget(qt.QLabel("p50:"), 1, 0, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.latency_box.frame.addWidget(qt.QLabel("p99:"), 2, 0, alignment = PyQt5.QtCore.Qt.AlignRight)
+        self.latency_la = []
+        for i, stage in enumerate(latencyRecorder.stages):
+            self.latency_box.frame.addWidget(qt.QLabel(stage), 0, i+1, alignment = PyQt5.QtCore.Qt.AlignHCenter)
+            p50_la = qt.QLabel("- ms")
+            p99_la = qt.QLabel("- ms")
+            self.latency_box.frame.addWidget(p50_la, 1, i+1, alignment = PyQt5.QtCore.Qt.AlignHCenter)
+            self.latency_box.frame.addWidget(p99_la, 2, i+1, alignment = PyQt5.QtCore.Qt.AlignHCenter)
+            self.latency_la.append((p50_la, p99_la))
+
+        self.dump_latency_pb = qt.QPushButton("Dump latency")
+        self.dump_latency_pb.clicked[bool].connect(lambda val: self.dump_latency())
+        self.latency_box.frame.addWidget(self.dump_latency_pb, 0, len(latencyRecorder.stages)+1, 3, 1)
+
         self.laser_box = NewBox(layout_type="hbox")
         control_box.frame.addWidget(self.laser_box)
 
@@ -1067,25 +830,10 @@ class mainWindow(qt.QMainWindow):
     def update_config(self, config):
         self.tcp_stop()
 
-        self.config["scan amp"] = config["Setting"].getfloat("scan amp/V")
-        self.config["scan time"] = config["Setting"].getfloat("scan time/ms")
-        self.config["scan ignore"] = config["Setting"].getfloat("scan ignore/ms")
-        self.config["sampling rate"] = config["Setting"].getint("sampling rate")
-        self.config["cavity FSR"] = config["Setting"].getfloat("cavity FSR/MHz")
-        self.config["lock criteria"] = config["Setting"].getfloat("lock criteria/MHz")
-        self.config["RMS length"] = config["Setting"].getint("RMS length")
-        self.config["display per"] = config["Setting"].getint("display per")
-        self.config["counter channel"] = config["Setting"].get("counter channel")
-        self.config["counter PFI line"] = config["Setting"].get("counter PFI line")
-        self.config["trigger channel"] = config["Setting"].get("trigger channel")
-        self.config["host address"] = config["Setting"].get("host address")
-        self.config["port"] = config["Setting"].getint("port")
-        self.config["num of lasers"] = config["Setting"].getint("num of lasers")
-        self.config["hdf_filename"] = config["Setting"].get("hdf_filename")
-        self.config["window title"] = config["Setting"].get("window title")
-        self.config["color list"] = [x.strip() for x in config["Setting"].get("color list").split(",")]
-        self.config["average"] = config["Setting"].getint("average")
-        self.config["baseline remove"] = config["Setting"].getboolean("baseline remove")
+        setting = setting_section(config["Setting"])
+        backend = setting.pop("daq backend")
+        self.config.update(setting)
+        self.set_daq_backend(backend)
 
         # update number of lasers, add or delete current laserColumn instances
         self.update_lasers(self.config["num of lasers"])
@@ -1106,9 +854,24 @@ class mainWindow(qt.QMainWindow):
         self.cavity_fsr_dsb.setValue(self.config["cavity FSR"])
         self.lock_criteria_dsb.setValue(self.config["lock criteria"])
         self.rms_length_sb.setValue(self.config["RMS length"])
-        self.disp_rate_sb.setValue(self.config["display per"])
+        self.disp_rate_sb.setValue(self.config["display rate"])
         self.ave_rate_sb.setValue(self.config["average"])
         self.baseline_chb.setChecked(self.config["baseline remove"])
+        self.baseline_cb.setCurrentText(self.config["baseline method"])
+        self.arpls_lam_dsb.setValue(self.config["arPLS lambda"])
+        self.arpls_iter_sb.setValue(self.config["arPLS max iter"])
+        self.arpls_ch_sb.setValue(self.config["arPLS channels"])
+        self.pipeline_chb.setChecked(self.config["pipeline"])
+        self.logging_interval_dsb.setValue(self.config["logging interval"])
+        self.recorder_length_dsb.setValue(self.config["recorder length"])
+        self.process_mode_chb.setChecked(self.config["process mode"])
+        self.loop_cpu_sb.setValue(self.config["loop cpu"])
+        self.laser_ao_mode_cb.setCurrentText(self.config["laser ao mode"])
+        self.trigger_mode_cb.setCurrentText(self.config["trigger mode"])
+        self.cycle_period_dsb.setValue(self.config["cycle period"])
+        self.ao_lead_dsb.setValue(self.config["ao lead"])
+        self.cavity_ao_mode_cb.setCurrentText(self.config["cavity ao mode"])
+        self.backend_cb.setCurrentText(self.config["daq backend"])
 
         self.counter_cb.setCurrentText(self.config["counter channel"])
         self.config["counter channel"] = self.counter_cb.currentText()
@@ -1116,6 +879,12 @@ class mainWindow(qt.QMainWindow):
         self.config["counter PFI line"] = self.counter_pfi_cb.currentText()
         self.trigger_cb.setCurrentText(self.config["trigger channel"])
         self.config["trigger channel"] = self.trigger_cb.currentText()
+        self.seq_counter_cb.setCurrentText(self.config["sequence counter"])
+        self.config["sequence counter"] = self.seq_counter_cb.currentText()
+        self.seq_trigger_cb.setCurrentText(self.config["sequence trigger"])
+        self.config["sequence trigger"] = self.seq_trigger_cb.currentText()
+        self.cavity_offset_cb.setCurrentText(self.config["cavity offset ao"])
+        self.config["cavity offset ao"] = self.cavity_offset_cb.currentText()
 
         if self.config["host address"] == "None":
             self.server_addr_la.setText(socket.gethostbyname(socket.gethostname())+" ("+str(self.config["port"])+")")
@@ -1134,6 +903,7 @@ class mainWindow(qt.QMainWindow):
     # update self.config elements
     def update_config_elem(self, text, val):
         self.config[text] = val
+        self.publish_params()
 
         if text == "scan time":
             self.scan_ignore_dsb.setMaximum(val)
@@ -1141,6 +911,9 @@ class mainWindow(qt.QMainWindow):
         if text == "scan ignore":
             self.cavity.setpoint_dsb.setMinimum(val)
 
+        if text == "display rate":
+            self.display_timer.setInterval(round(1000/val))
+
     # load settings from a local .ini file
     def load_setting(self):
         # open a file dialog to choose a configuration file to load
@@ -1195,10 +968,23 @@ class mainWindow(qt.QMainWindow):
         config["Setting"]["cavity FSR/MHz"] = str(self.config["cavity FSR"])
         config["Setting"]["lock criteria/MHz"] = str(self.config["lock criteria"])
         config["Setting"]["RMS length"] = str(self.config["RMS length"])
-        config["Setting"]["display per"] = str(self.config["display per"])
+        config["Setting"]["display rate"] = str(self.config["display rate"])
         config["Setting"]["counter channel"] = self.config["counter channel"]
         config["Setting"]["counter PFI line"] = self.config["counter PFI line"]
         config["Setting"]["trigger channel"] = self.config["trigger channel"]
+        config["Setting"]["# trigger mode can be software (a do pulse starts every scan) or free running (a scan starts every cycle period, 0 for back-to-back scans)"] = None
+        config["Setting"]["trigger mode"] = self.config["trigger mode"]
+        config["Setting"]["cycle period/ms"] = str(self.config["cycle period"])
+        config["Setting"]["# in free running mode, ao data are written at least this far ahead of the counter (and at least two cycles)"] = None
+        config["Setting"]["ao lead/ms"] = str(self.config["ao lead"])
+        config["Setting"]["# laser ao mode can be on demand or hardware timed (updated at the start of every scan, on the counter clock)"] = None
+        config["Setting"]["laser ao mode"] = self.config["laser ao mode"]
+        config["Setting"]["# cavity ao mode can be streamed (whole scan written every cycle) or regenerated (scan kept in DAQ buffer, feedback written to cavity offset ao)"] = None
+        config["Setting"]["cavity ao mode"] = self.config["cavity ao mode"]
+        config["Setting"]["cavity offset ao"] = self.config["cavity offset ao"]
+        config["Setting"]["# counter that counts external trigger edges to advance setpoint sequences, None if there's no such trigger"] = None
+        config["Setting"]["sequence counter"] = self.config["sequence counter"]
+        config["Setting"]["sequence trigger"] = self.config["sequence trigger"]
         config["Setting"]["# host address can be None or a valid address"] = None
         config["Setting"]["host address"] = self.config["host address"]
         config["Setting"]["port"] = str(self.config["port"])
@@ -1208,6 +994,22 @@ class mainWindow(qt.QMainWindow):
         config["Setting"]["color list"] = ", ".join(self.config["color list"])
         config["Setting"]["average"] = str(self.config["average"])
         config["Setting"]["baseline remove"] = str(self.config["baseline remove"])
+        config["Setting"]["# baseline method can be mean or arPLS"] = None
+        config["Setting"]["baseline method"] = self.config["baseline method"]
+        config["Setting"]["arPLS lambda"] = str(self.config["arPLS lambda"])
+        config["Setting"]["arPLS max iter"] = str(self.config["arPLS max iter"])
+        config["Setting"]["# arPLS solves this many channels (cavity included) per cycle in turn, the others reuse their last baseline, 0 for all of them"] = None
+        config["Setting"]["arPLS channels/cycle"] = str(self.config["arPLS channels"])
+        config["Setting"]["pipeline"] = str(self.config["pipeline"])
+        config["Setting"]["# logging interval can be 0 to log every cycle"] = None
+        config["Setting"]["logging interval/s"] = str(self.config["logging interval"])
+        config["Setting"]["# raw traces of this long are saved when any laser loses lock, 0 to disable"] = None
+        config["Setting"]["recorder length/s"] = str(self.config["recorder length"])
+        config["Setting"]["# run feedback loop in a separate process, pinned to loop cpu (-1 to not pin it)"] = None
+        config["Setting"]["process mode"] = str(self.config["process mode"])
+        config["Setting"]["loop cpu"] = str(self.config["loop cpu"])
+        config["Setting"]["# daq backend can be nidaqmx or simulated"] = None
+        config["Setting"]["daq backend"] = self.config["daq backend"]
 
         # export cavity/laser config
         config["Cavity"] = self.cavity.save_config()
@@ -1217,12 +1019,21 @@ class mainWindow(qt.QMainWindow):
         return config
 
     def toggle_more_ctrl(self):
-        for i in [self.scan_box, self.file_box, self.tcp_box]:
+        for i in [self.scan_box, self.file_box, self.tcp_box, self.latency_box]:
             if i.isVisible():
                 i.hide()
             else:
                 i.show()
 
+    # switch between real and simulated DAQ, available DAQ channels are refreshed accordingly
+    def set_daq_backend(self, name):
+        if name == self.daq_backend.name:
+            return
+
+        self.daq_backend = daq_backend(name)
+        self.config["daq backend"] = self.daq_backend.name
+        self.refresh_all_daq_ch()
+
     def refresh_all_daq_ch(self):
         self.update_daq_channel()
         self.cavity.update_daq_channel()
@@ -1237,26 +1048,30 @@ class mainWindow(qt.QMainWindow):
 
         self.enable_widgets(False)
 
-        self.cavity_err_queue = deque([], maxlen=self.config["RMS length"])
+        self.cavity_err_queue = rollingStats(self.config["RMS length"])
         self.laser_err_list = []
         self.cavity.locked = False
         for laser in self.laser_list:
             laser.locked = False
-            self.laser_err_list.append(deque([], maxlen=self.config["RMS length"]))
+            self.laser_err_list.append(rollingStats(self.config["RMS length"]))
 
-        self.last_time_logging = 0
         self.daq_start()
 
     # update GUI indicators to show feedback loop status
     @PyQt5.QtCore.pyqtSlot(dict)
     def feedback(self, dict):
         data_len = len(dict["cavity pd_data"])
-        self.cavity.scan_curve.setData(np.linspace(self.config["scan ignore"], self.config["scan time"], data_len), dict["cavity pd_data"])
+        scan_axis = self.scan_axis(data_len)
+        # min/max decimation down to plot width in pixels, cavity first, then lasers
+        bins = max(int(self.scan_plot.getViewBox().width()), 100)
+        cavity_idx = minmax_decimate(dict["cavity pd_data"], bins)
+        laser_idx = minmax_decimate(dict["laser pd_data"], bins)
+        self.cavity.scan_curve.setData(scan_axis[cavity_idx], dict["cavity pd_data"][cavity_idx])
         self.cavity.first_peak_la.setText("{:.2f} ms".format(self.config["scan ignore"]+dict["cavity first peak"]))
         self.cavity.peak_sep_la.setText("{:.2f} ms".format(dict["cavity pk sep"]))
         self.cavity.daq_output_la.setText("{:.3f} V".format(dict["cavity output"]))
         self.cavity_err_queue.append(dict["cavity error"])
-        rms = np.std(self.cavity_err_queue)
+        rms = self.cavity_err_queue.std()
         self.cavity.rms_width_la.setText("{:.2f} MHz".format(rms))
         if rms < self.config["lock criteria"] and np.abs(dict["cavity error"]) < self.config["lock criteria"] and dict["cavity peak found"]:
             if not self.cavity.locked:
@@ -1266,17 +1081,17 @@ class mainWindow(qt.QMainWindow):
             if self.cavity.locked:
                 self.cavity.locked = False
                 self.cavity.locked_la.setStyleSheet("QLabel{background: #304249}")
-        self.cavity.err_curve.setData(np.array(self.cavity_err_queue))
+        self.cavity.err_curve.setData(self.cavity_err_queue.view())
 
         act_freq = []
         for i, laser in enumerate(self.laser_list):
-            laser.scan_curve.setData(np.linspace(self.config["scan ignore"], self.config["scan time"], data_len), dict["laser pd_data"][i])
+            laser.scan_curve.setData(scan_axis[laser_idx[i]], dict["laser pd_data"][i][laser_idx[i]])
             laser.daq_output_la.setText("{:.3f} V".format(dict["laser output"][i]))
             self.laser_err_list[i].append(dict["laser error"][i])
             freq_setpoint = laser.config["local freq"] if laser.config["freq source"] == "local" else laser.config["global freq"]
             act_freq.append(freq_setpoint-dict["laser error"][i] if dict["laser peak found"][i] else np.NaN)
             laser.actual_freq_la.setText("{:.1f} MHz".format(act_freq[i]))
-            rms = np.std(self.laser_err_list[i])
+            rms = self.laser_err_list[i].std()
             laser.rms_width_la.setText("{:.2f} MHz".format(rms))
             if (rms < self.config["lock criteria"]) and (np.abs(dict["laser error"][i]) < self.config["lock criteria"]) and dict["cavity peak found"] and dict["laser peak found"][i]:
                 if not laser.locked:
@@ -1286,33 +1101,34 @@ class mainWindow(qt.QMainWindow):
                 if laser.locked:
                     laser.locked = False
                     laser.locked_la.setStyleSheet("QLabel{background: #304249}")
-            laser.err_curve.setData(np.array(self.laser_err_list[i]))
-
-        # log laser frequency and cavity PZT voltage
-        t = time.time()
-        if t - self.last_time_logging > 120: # in second
-            data = [time.strftime("%H:%M:%S"), dict["cavity output"]] + act_freq
-            with h5py.File(self.config["hdf_filename"] + "_" + time.strftime("%Y%b") + ".hdf", "a") as hdf_file:
-                key = time.strftime("%b%d")
-                if key in hdf_file.keys():
-                    dset = hdf_file[key]
-                    counter = 2
-                    # if the number of lasers changes, data can't be written to the old dset, because of its different format
-                    # if the number of lasers changes, search if there's a dset that has the right format, otherwise create a new one
-                    # dset is named after time.strftime("%b%d") or time.strftime("%b%d") + f"_{counter}" (e.g. Jan24 or Jan24_2)
-                    while len(dset[0]) != len(data):
-                        if (key + f"_{counter}") in hdf_file.keys():
-                            dset = hdf_file[key + f"_{counter}"]
-                            counter += 1
-                        else:
-                            dset = hdf_file.create_dataset(key + f"_{counter}", shape=(0,), dtype=self.dtp, maxshape=(None,), compression="gzip", compression_opts=4)
-                            break
-                else:
-                    dset = hdf_file.create_dataset(key, shape=(0,), dtype=self.dtp, maxshape=(None,), compression="gzip", compression_opts=4)
-
-                dset.resize(dset.shape[0]+1, axis=0)
-                dset[-1:] = [tuple(data)]
-                self.last_time_logging = t
+            laser.err_curve.setData(self.laser_err_list[i].view())
+
+        for (p50_la, p99_la), (p50, p99) in zip(self.latency_la, dict["latency"]):
+            p50_la.setText("{:.3f} ms".format(p50))
+            p99_la.setText("{:.3f} ms".format(p99))
+
+    # time axis (in ms) of transmission plots, only rebuilt when scan config or data length changes
+    def scan_axis(self, data_len):
+        key = (self.config["scan ignore"], self.config["scan time"], data_len)
+        if key != self.scan_axis_key:
+            self.scan_axis_data = np.linspace(self.config["scan ignore"], self.config["scan time"], data_len)
+            self.scan_axis_key = key
+        return self.scan_axis_data
+
+    # save time spent in each stage of latest feedback loop cycles into a csv file
+    # while running, the loop saves it itself, otherwise the last loop that ran in this process (not in a separate one) is used
+    def dump_latency(self):
+        file_name = os.path.join(os.path.dirname(self.config["hdf_filename"]), "latency_"+time.strftime("%Y%m%d_%H%M%S")+".csv")
+        if self.active:
+            self.daq_thread.send("dump latency", file_name)
+            return
+
+        try:
+            latency = self.daq_thread.latency
+        except AttributeError:
+            logging.warning("No feedback loop latency recorded yet, or it's recorded in a stopped loop process.")
+            return
+        latency.dump(file_name)
 
     # stop frequency lock
     def stop(self):
@@ -1327,31 +1143,82 @@ class mainWindow(qt.QMainWindow):
     # stop DAQ thread
     def daq_stop(self):
         self.active = False
+        self.display_timer.stop()
         try:
+            self.daq_thread.send("stop")
+            # the TCP server has to let go of telemetry before the loop closes it
+            self.set_telemetry(None)
             self.daq_thread.wait() # wait until closed
         except AttributeError as err:
             pass
 
-    # start DAQ thread
+    # compile a read-only snapshot of parameters used in the feedback loop
+    def compile_params(self):
+        return lockParams(self.config, self.cavity.config, [laser.config for laser in self.laser_list])
+
+    # hand a new parameter snapshot to the running feedback loop, it's picked up at the beginning of next cycle
+    # it can be called from GUI and TCP threads, the lock makes sure the latest config always wins
+    def publish_params(self):
+        if not self.active:
+            return
+
+        with self.params_lock:
+            try:
+                self.daq_thread.send("params", self.compile_params())
+            except AttributeError:
+                # DAQ thread is being created, it will compile parameters itself
+                pass
+
+    # hand a setpoint sequence from the TCP server to the running feedback loop, empty freqs cancels it, see send_sequence()
+    def set_sequence(self, laser, freqs, dwells, trigger, repeat):
+        with self.params_lock:
+            # DAQ thread may be being created, then it has no sequence yet and can't take one
+            send = getattr(self.daq_thread, "send", None) if self.active else None
+            send_sequence(send, self.config, [column.config for column in self.laser_list], self.compile_params, laser, freqs, dwells, trigger, repeat)
+
+    # start DAQ thread, or DAQ process in process mode
     def daq_start(self):
         self.active = True
-        self.daq_thread = daqThread(self)
-        self.daq_thread.signal.connect(self.feedback)
+        self.daq_thread = daqProcess(self) if self.config["process mode"] else daqThread(self)
         self.daq_thread.start()
+        self.set_telemetry(self.daq_thread.telemetry)
+        self.display_timer.start(round(1000/self.config["display rate"]))
+
+    # show the latest loop status if there's a new one
+    def pull_feedback(self):
+        data_dict = self.daq_thread.mailbox.take()
+        if data_dict is not None:
+            self.feedback(data_dict)
+        elif not self.daq_thread.isRunning():
+            logging.error("feedback loop stopped unexpectedly, see errors above.")
+            self.stop()
 
     # enable or disable/gray out some control widgets
     def enable_widgets(self, enabled):
         self.scan_amp_dsb.setEnabled(enabled)
         self.scan_time_dsb.setEnabled(enabled)
         self.samp_rate_sb.setEnabled(enabled)
-
-        self.rms_length_sb.setEnabled(enabled) # deque max length can't be changed
+        self.pipeline_chb.setEnabled(enabled)
+        self.recorder_length_dsb.setEnabled(enabled)
+        self.process_mode_chb.setEnabled(enabled)
+        self.loop_cpu_sb.setEnabled(enabled)
+        self.laser_ao_mode_cb.setEnabled(enabled)
+        self.trigger_mode_cb.setEnabled(enabled)
+        self.cycle_period_dsb.setEnabled(enabled)
+        self.ao_lead_dsb.setEnabled(enabled)
+        self.cavity_ao_mode_cb.setEnabled(enabled)
+        self.cavity_offset_cb.setEnabled(enabled)
+
+        self.rms_length_sb.setEnabled(enabled) # ring buffer length can't be changed
 
         self.counter_cb.setEnabled(enabled)
         self.counter_pfi_cb.setEnabled(enabled)
         self.trigger_cb.setEnabled(enabled)
+        self.seq_counter_cb.setEnabled(enabled)
+        self.seq_trigger_cb.setEnabled(enabled)
 
         self.refresh_daq_pb.setEnabled(enabled)
+        self.backend_cb.setEnabled(enabled)
 
         self.load_setting_pb.setEnabled(enabled)
 
@@ -1366,30 +1233,45 @@ class mainWindow(qt.QMainWindow):
     def update_daq_channel(self):
         counter_ch = self.counter_cb.currentText()
         self.counter_cb.clear()
+        seq_counter = self.seq_counter_cb.currentText()
+        self.seq_counter_cb.clear()
+        self.seq_counter_cb.addItem("None")
         # get available DAQ devices
-        dev_collect = nidaqmx.system._collections.device_collection.DeviceCollection()
-        for i in dev_collect.device_names:
+        dev_names = self.daq_backend.device_names()
+        for i in dev_names:
             # get available CO channels for each DAQ device
-            ch_collect = nidaqmx.system._collections.physical_channel_collection.COPhysicalChannelCollection(i)
-            for j in ch_collect.channel_names:
+            for j in self.daq_backend.co_channel_names(i):
                 # add available CO channels to comboBox option list
                 self.counter_cb.addItem(j)
+                self.seq_counter_cb.addItem(j)
         self.counter_cb.setCurrentText(counter_ch)
+        self.seq_counter_cb.setCurrentText(seq_counter)
 
         counter_pfi = self.counter_pfi_cb.currentText()
         self.counter_pfi_cb.clear()
         trigger_ch = self.trigger_cb.currentText()
         self.trigger_cb.clear()
-        for i in dev_collect.device_names:
-            dev = nidaqmx.system.device.Device(i)
+        seq_trigger = self.seq_trigger_cb.currentText()
+        self.seq_trigger_cb.clear()
+        self.seq_trigger_cb.addItem("None")
+        for i in dev_names:
             # For wach DAq terminal
-            for j in dev.terminals:
-                if "PFI" in j:
-                    # add available PFI lines to comboBox option list
-                    self.counter_pfi_cb.addItem(j)
-                    self.trigger_cb.addItem(j)
+            for j in self.daq_backend.pfi_lines(i):
+                # add available PFI lines to comboBox option list
+                self.counter_pfi_cb.addItem(j)
+                self.trigger_cb.addItem(j)
+                self.seq_trigger_cb.addItem(j)
         self.counter_pfi_cb.setCurrentText(counter_pfi)
         self.trigger_cb.setCurrentText(trigger_ch)
+        self.seq_trigger_cb.setCurrentText(seq_trigger)
+
+        cavity_offset = self.cavity_offset_cb.currentText()
+        self.cavity_offset_cb.clear()
+        self.cavity_offset_cb.addItem("None")
+        for i in dev_names:
+            for j in self.daq_backend.ao_channel_names(i):
+                self.cavity_offset_cb.addItem(j)
+        self.cavity_offset_cb.setCurrentText(cavity_offset)
 
     # update widgets to indicate TCP connection status
     @PyQt5.QtCore.pyqtSlot(dict)
@@ -1405,6 +1287,8 @@ class mainWindow(qt.QMainWindow):
             self.tcp_la.setStyleSheet("QLabel{background: #304249;}")
         elif dict["type"] == "data":
             self.laser_list[dict["laser"]].global_freq_la.setText("{:.1f} MHz".format(dict["freq"]))
+        elif dict["type"] == "sequence":
+            self.laser_list[dict["laser"]].global_freq_la.setText("{} pt sequence".format(dict["points"]))
         else:
             logging.warning("TCP thread return dict type not supported")
 
@@ -1414,8 +1298,8 @@ class mainWindow(qt.QMainWindow):
 
     # stop tcp thread
     def tcp_stop(self):
-        self.tcp_active = False
         try:
+            self.tcp_thread.server.stop()
             self.tcp_thread.wait() # wait until closed
         except AttributeError as err:
             pass
@@ -1426,15 +1310,24 @@ class mainWindow(qt.QMainWindow):
 
     # start tcp thread
     def tcp_start(self):
-        self.tcp_active = True
         self.tcp_thread = tcpThread(self)
         self.tcp_thread.signal.connect(self.update_tcp_widget)
         self.tcp_thread.start()
+        if self.active:
+            self.set_telemetry(self.daq_thread.telemetry)
+
+    # hand telemetry of the feedback loop (a telemetryRing, or None) to the TCP server, for its telemetry subscribers
+    def set_telemetry(self, ring):
+        try:
+            self.tcp_thread.server.set_telemetry(ring)
+        except AttributeError:
+            # TCP server isn't running
+            pass
 
     def closeEvent(self, event):
         if not self.active:
             config = self.compile_config()
-            configfile = open("saved_settings\config_latest.ini", "w")
+            configfile = open(os.path.join("saved_settings", "config_latest.ini"), "w")
             config.write(configfile)
             configfile.close()
 
@@ -1448,7 +1341,7 @@ class mainWindow(qt.QMainWindow):
                                 qt.QMessageBox.No)
             if ans == qt.QMessageBox.Yes:
                 config = self.compile_config()
-                configfile = open("saved_settings\config_latest.ini", "w")
+                configfile = open(os.path.join("saved_settings", "config_latest.ini"), "w")
                 config.write(configfile)
                 configfile.close()
 
@@ -1460,9 +1353,10 @@ if __name__ == '__main__':
     # Thanks O. Grasdijk for pointing this out,
     # nidaqmx.Task.read() uses windows timer for timing, higher timer resolution can improve loop performance
     # default resolution can vary in differnt computers
-    current_res = ctypes.c_ulong()
-    # units are 100 ns, set windows timer resolution to be 1 ms.
-    ctypes.windll.ntdll.NtSetTimerResolution(10000, True, ctypes.byref(current_res))
+    if sys.platform == "win32":
+        current_res = ctypes.c_ulong()
+        # units are 100 ns, set windows timer resolution to be 1 ms.
+        ctypes.windll.ntdll.NtSetTimerResolution(10000, True, ctypes.byref(current_res))
 
     app = qt.QApplication(sys.argv)
     # screen = app.screens()
@@ -0,0 +1,99 @@
+# Replay traces recorded by the flight recorder (flight_<time>.hdf, see core/recorder.py) through the lock algorithm,
+# as fast as the CPU allows, and compare errors and feedback voltages with the ones recorded in the live loop.
+# The PID state is initialized from the first recorded cycle, parameter snapshots are applied in the cycles they were used in,
+# and laser setpoints of every cycle are taken from the recording, since setpoint sequences change them between snapshots.
+# arPLS weights of the first cycle aren't recorded, so with arPLS baseline removal the first few cycles may differ slightly.
+# Usage: python replay.py flight_<time>.hdf [--repeat N] [--output replayed.hdf]
+
+import argparse
+import time
+import numpy as np
+import h5py
+
+from core import lockParams, lockEngine, latencyRecorder
+
+
+def load(file_name):
+    with h5py.File(file_name, "r") as f:
+        record = {key: f[key][()] for key in ["time", "pd_data", "error", "output", "peak found", "params cycle"]}
+        record["params"] = [lockParams.from_json(p) for p in f["params"].asstr()[()]]
+        # files recorded before setpoints were kept use the ones in parameter snapshots
+        record["laser setpoint"] = f["laser setpoint"][()] if "laser setpoint" in f else None
+    return record
+
+# run recorded traces from the second cycle on, returns errors, outputs, peak found flags of every cycle and the latency recorder
+def replay(record):
+    cycle_num, ch_num, samp_num = record["pd_data"].shape
+    laser_num = ch_num - 1
+    params_log = dict(zip(record["params cycle"], record["params"]))
+    params = record["params"][0]
+
+    # PID state after the first recorded cycle, output = offset + last feedback
+    latency = latencyRecorder(length=max(cycle_num, 1))
+    engine = lockEngine(laser_num, params, latency,
+                        cavity_last_feedback=record["output"][0, 0] - params.cavity_gains[6][0],
+                        laser_last_feedback=record["output"][0, 1:] - params.laser_gains[6])
+    engine.cavity_pid.last_err[:, 0] = record["error"][0, 0]
+    engine.laser_pid.last_err[:] = record["error"][0, 1:]
+
+    error = np.zeros((cycle_num, ch_num), dtype=np.float64)
+    output = np.zeros((cycle_num, ch_num), dtype=np.float64)
+    found = np.zeros((cycle_num, ch_num), dtype=np.bool_)
+    error[0], output[0], found[0] = record["error"][0], record["output"][0], record["peak found"][0]
+
+    pd_buffer = np.empty((ch_num, samp_num), dtype=np.float64)
+    latency.start()
+    for i in range(1, cycle_num):
+        if i in params_log:
+            engine.set_params(params_log[i])
+        if record["laser setpoint"] is not None:
+            engine.laser_setpoint[:] = record["laser setpoint"][i]
+        np.copyto(pd_buffer, record["pd_data"][i])
+        latency.mark("read")
+        engine.process(pd_buffer)
+        error[i], output[i], found[i] = engine.status()
+        latency.end_cycle()
+
+    return error, output, found, latency
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a flight recorder file through the lock algorithm.")
+    parser.add_argument("file", help="flight recorder hdf file")
+    parser.add_argument("--repeat", type=int, default=1, help="number of times to replay, for throughput measurement")
+    parser.add_argument("--output", help="save replayed errors, outputs and peak found flags into this hdf file")
+    args = parser.parse_args()
+
+    record = load(args.file)
+    cycle_num, ch_num, samp_num = record["pd_data"].shape
+    print(f"{cycle_num} cycles, {ch_num} channels, {samp_num} samples per channel, {len(record['params'])} parameter snapshot(s)")
+    if cycle_num > 1:
+        print(f"recorded at {(cycle_num-1)/(record['time'][-1]-record['time'][0]):.1f} cycles/s")
+
+    best = np.inf
+    for n in range(args.repeat):
+        t0 = time.perf_counter()
+        error, output, found, latency = replay(record)
+        best = min(best, time.perf_counter() - t0)
+    print(f"replayed at {(cycle_num-1)/best:.1f} cycles/s")
+
+    pct = latency.percentiles((50, 99))
+    for stage in ["read", "convert", "baseline", "peaks", "pid", "cycle"]:
+        p50, p99 = pct[latency.index[stage]]
+        print(f"{stage:>10}: p50 {p50*1000:8.1f} us, p99 {p99*1000:8.1f} us")
+
+    # recorded values are float32
+    err_diff = np.abs(error.astype(np.float32) - record["error"])
+    out_diff = np.abs(output.astype(np.float32) - record["output"])
+    found_diff = found != record["peak found"]
+    for ch in range(ch_num):
+        name = "cavity" if ch == 0 else f"laser{ch-1}"
+        differ = np.flatnonzero((err_diff[:, ch] > 1e-3) | found_diff[:, ch])
+        print(f"{name:>10}: max error diff {np.nanmax(err_diff[:, ch]):.3g} MHz, max output diff {np.nanmax(out_diff[:, ch]):.3g} V, "
+              f"{np.sum(found_diff[:, ch])} peak found mismatch(es), first differing cycle {differ[0] if len(differ) else None}")
+
+    if args.output:
+        with h5py.File(args.output, "w") as f:
+            f.create_dataset("error", data=error)
+            f.create_dataset("output", data=output)
+            f.create_dataset("peak found", data=found)
+        print(f"replayed sequences saved to {args.output}")
@@ -0,0 +1,177 @@
+# Run several independent cavity locks (e.g. one per DAQ card and cavity) from one program, without GUI.
+# Every lock has its own settings file, and runs its feedback loop in a process of its own, optionally pinned to a cpu core.
+# All locks share one TCP endpoint, where lasers are numbered globally: lasers of the first lock first, then lasers of the second lock, and so on.
+# Lock status of all locks is reported in one table in the log, and optionally written into one json file (the dashboard).
+# See saved_settings/supervisor.ini for an example configuration.
+# Usage: python supervisor.py [saved_settings/supervisor.ini] [--duration s]
+
+import os
+import sys
+import time
+import signal
+import logging
+import argparse
+import threading
+import configparser
+import ctypes
+
+from core import tcpServer
+from headless import lockServer, status_line, write_status
+
+
+class lockSupervisor:
+    def __init__(self, file_name):
+        cf = configparser.ConfigParser()
+        cf.optionxform = str # make config key name case sensitive
+        if not cf.read(file_name):
+            raise FileNotFoundError(f"supervisor file {file_name} not found.")
+
+        self.config = {}
+        self.config["host address"] = cf["Supervisor"].get("host address")
+        self.config["port"] = cf["Supervisor"].getint("port")
+        self.config["status interval"] = cf["Supervisor"].getfloat("status interval/s", fallback=10.0)
+        self.config["status file"] = cf["Supervisor"].get("status file", fallback="None")
+        self.config["display rate"] = cf["Supervisor"].getint("display rate", fallback=10)
+
+        # one lock per [Lock<i>] section, every lock always runs in its own process
+        self.locks = []
+        self.names = []
+        i = 0
+        while f"Lock{i}" in cf:
+            section = cf[f"Lock{i}"]
+            lock = lockServer(section.get("settings"))
+            lock.config["process mode"] = True
+            lock.config["loop cpu"] = section.getint("loop cpu", fallback=-1)
+            self.locks.append(lock)
+            self.names.append(section.get("name", fallback=lock.config["window title"]))
+            i += 1
+        if not self.locks:
+            raise ValueError(f"no [Lock0] section in {file_name}.")
+        self.check_resources()
+
+        # global laser index -> (lock, laser index in that lock)
+        self.laser_map = [(lock, j) for lock in self.locks for j in range(lock.laser_num)]
+        self.tcp_thread = None
+        self.changed = set()
+
+    # DAQ channels and log files can't be shared by two locks
+    def check_resources(self):
+        owner = {}
+        for i, lock in enumerate(self.locks):
+            resources = [lock.config["counter channel"], lock.config["hdf_filename"], lock.cavity_config["daq ai"], lock.cavity_config["daq ao"]]
+            if lock.config["trigger mode"] == "software":
+                resources.append(lock.config["trigger channel"])
+            if lock.config["sequence counter"] != "None":
+                resources.append(lock.config["sequence counter"])
+            if lock.config["cavity offset ao"] != "None":
+                resources.append(lock.config["cavity offset ao"])
+            resources += [laser[key] for laser in lock.laser_configs for key in ["daq ai", "daq ao"]]
+            for res in resources:
+                if owner.get(res, i) != i:
+                    raise ValueError(f"{res} is used by both Lock{owner[res]} and Lock{i}.")
+                owner[res] = i
+
+    # called by the TCP server for every setpoint received, laser is the global laser index
+    def set_freq(self, laser, freq):
+        lock, j = self.laser_map[laser]
+        lock.set_freq(j, freq)
+        self.changed.add(lock)
+
+    def set_sequence(self, laser, freqs, dwells, trigger, repeat):
+        lock, j = self.laser_map[laser]
+        lock.set_sequence(j, freqs, dwells, trigger, repeat)
+
+    # hand new parameter snapshots to locks whose setpoints are changed, called after a batch of setpoints
+    def publish_params(self):
+        for lock in self.changed:
+            lock.publish_params()
+        self.changed.clear()
+
+    def tcp_event(self, event):
+        if event["type"] == "open connection":
+            logging.info(f"client {event['client addr']} connected.")
+        elif event["type"] == "close connection":
+            logging.info("client disconnected.")
+
+    def start(self):
+        for name, lock in zip(self.names, self.locks):
+            lock.start(tcp=False)
+            logging.info(f"{name} started, {lock.laser_num} laser(s), cpu {lock.config['loop cpu']}.")
+
+        self.tcp = tcpServer(self.config["host address"], self.config["port"], self.set_freq, self.tcp_event, self.publish_params, self.set_sequence)
+        # telemetry records carry the index of their lock
+        for i, lock in enumerate(self.locks):
+            self.tcp.set_telemetry(lock.worker.telemetry, i)
+        self.tcp_thread = threading.Thread(target=self.tcp.serve, name="tcp server", daemon=True)
+        self.tcp_thread.start()
+
+    def stop(self):
+        if self.tcp_thread is not None:
+            self.tcp.stop()
+            self.tcp_thread.join()
+            self.tcp_thread = None
+        # ask all loops to stop first, so they finish in parallel
+        for lock in self.locks:
+            if lock.worker is not None:
+                lock.worker.send("stop")
+        for lock in self.locks:
+            lock.stop()
+
+    def pull(self):
+        for lock in self.locks:
+            lock.pull()
+
+    # status of all locks, lasers have their global index
+    def status(self):
+        status = {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "locks": []}
+        index = 0
+        for name, lock in zip(self.names, self.locks):
+            s = lock.status()
+            if s is not None:
+                for laser in s["lasers"]:
+                    laser["index"] = index
+                    index += 1
+            else:
+                index += lock.laser_num
+            status["locks"].append({"name": name, "running": lock.running(), "status": s})
+        return status
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run several cavity locks, each in its own process, with one TCP endpoint.")
+    parser.add_argument("settings", nargs="?", default=os.path.join("saved_settings", "supervisor.ini"), help="supervisor file to load")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds, run until interrupted by default")
+    args = parser.parse_args()
+
+    logging.basicConfig(level="INFO", format="%(asctime)s %(levelname)s: %(message)s")
+    if sys.platform == "win32":
+        # units are 100 ns, set windows timer resolution to be 1 ms, see main.py
+        current_res = ctypes.c_ulong()
+        ctypes.windll.ntdll.NtSetTimerResolution(10000, True, ctypes.byref(current_res))
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    supervisor = lockSupervisor(args.settings)
+    supervisor.start()
+    t0 = time.time()
+    last_report = t0
+    try:
+        while not stop.wait(1/supervisor.config["display rate"]):
+            supervisor.pull()
+            t = time.time()
+            if t - last_report >= supervisor.config["status interval"]:
+                last_report = t
+                status = supervisor.status()
+                for lock in status["locks"]:
+                    if not lock["running"]:
+                        logging.error(f"{lock['name']}: feedback loop stopped, see errors above.")
+                    elif lock["status"] is not None:
+                        logging.info(f"{lock['name']}: " + status_line(lock["status"]))
+                if supervisor.config["status file"] != "None":
+                    write_status(supervisor.config["status file"], status)
+            if args.duration is not None and t - t0 >= args.duration:
+                break
+    finally:
+        supervisor.stop()
+        logging.info("all locks stopped.")
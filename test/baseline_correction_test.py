@@ -4,6 +4,11 @@ import numpy as np
 from scipy.interpolate import CubicSpline
 import matplotlib.pyplot as plt
 import time
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from core import arPLSBaseline
 
 # code from https://stackoverflow.com/a/67509948
 def baseline_arPLS(y, ratio=1e-6, lam=100, niter=50, full_output=False):
@@ -82,8 +87,38 @@ for i in range(repeat):
                                          full_output=True)
 print(f"average execution time {(time.time()-t0)/repeat*1000} ms.")
 
+# banded solver, cold start, same stop criterion as above
+fast = arPLSBaseline(lam=1e5, ratio=1e-2, max_iter=101)
+spectra_fast = fast.remove(np.array([spectra_base]))[0]
+print(f"max difference between banded and sparse solver {np.amax(np.abs(spectra_fast-spectra_arPLS))}")
+
+# banded solver, warm start and at most 5 iterations per call, as used in the feedback loop
+fast = arPLSBaseline(lam=1e5, ratio=1e-2, max_iter=5)
+t0 = time.time()
+for i in range(repeat):
+    spectra_fast = fast.remove(np.array([spectra_sim + baseline + np.random.randn(len(x_vals)) * 0.01]))[0]
+print(f"average execution time (banded solver, warm start) {(time.time()-t0)/repeat*1000} ms.")
+
+# max_iter=0 (e.g. from an ini file) still does one iteration, instead of leaving traces unprocessed or uninitialized
+zero = arPLSBaseline(lam=1e5, ratio=1e-2, max_iter=1).remove(np.array([spectra_base]))[0]
+for fast in (arPLSBaseline(lam=1e5, ratio=1e-2, max_iter=0), arPLSBaseline(lam=1e5, ratio=1e-2)):
+    spectra_zero = fast.remove(np.array([spectra_base]), max_iter=0)[0]
+    assert np.array_equal(spectra_zero, zero) and fast.num_iter[0] == 1, "max_iter=0 isn't clamped to one iteration"
+print("max_iter=0 is clamped to one iteration")
+
+# with ch_per_cycle, all channels are solved in the first cycle, then that many in turn, the others reuse their last baseline
+traces = np.array([spectra_base]*5)
+fast = arPLSBaseline(lam=1e5, ratio=1e-2, max_iter=2)
+solved = []
+for i in range(4):
+    fast.remove(traces.copy(), ch_per_cycle=2)
+    solved.append(np.flatnonzero(fast.num_iter).tolist())
+assert solved == [[0, 1, 2, 3, 4], [0, 1], [2, 3], [0, 4]], f"channels solved in turn {solved}"
+print(f"channels solved per cycle with ch_per_cycle=2: {solved}")
+
 plt.plot(spectra_sim, label="sim")
 plt.plot(spectra_base, label="base")
 plt.plot(spectra_arPLS, label="arPLS")
+plt.plot(spectra_fast, label="arPLS (banded, warm start)")
 plt.legend()
 plt.show()
\ No newline at end of file
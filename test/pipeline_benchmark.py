@@ -0,0 +1,160 @@
+# Benchmark the processing stages of one feedback loop cycle (averaging, baseline removal, peak finding, PID and ao waveform)
+# on synthetic transmission traces from the simulated DAQ, across sampling rates, scan times, numbers of lasers,
+# averaging and baseline removal methods. No DAQ is needed, traces are synthesized before timing starts.
+# Results (percentiles of every stage in ms) are written into a json file, so numbers of different commits can be compared.
+# Usage:
+#   python pipeline_benchmark.py [--quick] [--cycles N] [--arpls-channels 0] [--output results.json]
+#   python pipeline_benchmark.py --compare old.json new.json
+
+import sys
+import os
+import json
+import time
+import argparse
+import platform
+import subprocess
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from core import lockParams, lockEngine, latencyRecorder
+from core.daqbackend import simDevice
+
+stages = ["convert", "baseline", "peaks", "pid", "ao write", "cycle"]
+hene_wavenumber = 15798.0
+scan_amp = 4.35 # in V
+scan_ignore_ratio = 0.304 # same as 0.76 ms in a 2.5 ms scan
+
+# config dictionaries that lockParams takes, with peak criteria that work for simulated traces
+def make_configs(samp_rate, scan_time, laser_num, average, baseline_method, arpls_channels=0):
+    config = {
+        "sampling rate": samp_rate,
+        "scan time": scan_time,
+        "scan ignore": scan_time*scan_ignore_ratio,
+        "cavity FSR": 750.0,
+        "average": average,
+        "baseline remove": True,
+        "baseline method": baseline_method,
+        "arPLS lambda": 1e5,
+        "arPLS max iter": 2,
+        "arPLS channels": arpls_channels,
+        "lock criteria": 5.0,
+        "logging interval": 120.0,
+        }
+    # simulated peaks are about finesse/fsr = 1/100 of 2 V wide, in a scan of scan_amp
+    peak_width = max(1, int(0.3*2.0/100/scan_amp*scan_time/1000*samp_rate))
+    pid = {"kp": 0.01, "kp on": True, "ki": 1.0, "ki on": True, "kd": 0.0, "kd on": False, "offset": 0.0, "limit": 0.1}
+    cavity_config = dict(pid, **{"peak height": 0.25, "peak width": peak_width, "set point": 0.89, "wavenumber": hene_wavenumber})
+    laser_configs = [dict(pid, **{"peak height": 0.15, "peak width": peak_width, "wavenumber": wavenumber(i),
+                                  "local freq": 400.0, "global freq": 0.0, "freq source": "local"}) for i in range(laser_num)]
+    return config, cavity_config, laser_configs
+
+def wavenumber(i):
+    return 14000.0 + 117.0*i
+
+def benchmark(samp_rate, scan_time, laser_num, average, baseline_method, cycles, arpls_channels=0, trace_num=20):
+    params = lockParams(*make_configs(samp_rate, scan_time, laser_num, average, baseline_method, arpls_channels))
+    samp_num = round(scan_time/1000*samp_rate)
+
+    # synthesize distinct traces with slightly different cavity/laser voltages, so peaks move a little between cycles
+    device = simDevice([hene_wavenumber] + [wavenumber(i) for i in range(laser_num)], samp_rate, samp_num, realtime=False, seed=0)
+    cavity_scan = np.linspace(scan_amp, 0, samp_num, dtype=np.float64)
+    rng = np.random.default_rng(0)
+    traces = [device.synthesize(cavity_scan + 0.01*rng.standard_normal(), 0.01*rng.standard_normal(laser_num), 0.0) for i in range(trace_num)]
+
+    latency = latencyRecorder(length=cycles)
+    engine = lockEngine(laser_num, params, latency)
+    pd_buffer = np.empty((laser_num+1, samp_num), dtype=np.float64)
+    cavity_waveform = np.empty(samp_num, dtype=np.float64)
+
+    found = 0
+    latency.start()
+    for i in range(cycles):
+        # averaging, as daqThread.acquire() does
+        np.copyto(pd_buffer, traces[i % trace_num])
+        for j in range(1, average):
+            pd_buffer += traces[(i+j) % trace_num]
+        if average > 1:
+            pd_buffer /= average
+        latency.mark("convert") # averaging, together with chopping in lockEngine
+
+        engine.process(pd_buffer)
+        found += engine.cavity_peak_found
+
+        np.add(cavity_scan, engine.cavity_output, out=cavity_waveform)
+        latency.mark("ao write")
+        latency.end_cycle()
+
+    history = latency.history()[:, 1:] # drop timestamps
+    result = {"sampling rate": samp_rate, "scan time": scan_time, "lasers": laser_num, "average": average,
+              "baseline method": baseline_method, "samples": samp_num, "cycles": cycles,
+              "cavity peak found ratio": found/cycles, "stages": {}}
+    for stage in stages:
+        t = history[:, latency.index[stage]]
+        result["stages"][stage] = {"mean": float(np.mean(t)), "p50": float(np.percentile(t, 50)), "p99": float(np.percentile(t, 99)), "max": float(np.max(t))}
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+# print p50 of every stage of two result files side by side, for configurations found in both
+def compare(old_file, new_file):
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    key = lambda r: (r["sampling rate"], r["scan time"], r["lasers"], r["average"], r["baseline method"])
+    old_results = {key(r): r for r in old["results"]}
+    print(f"p50 in us, {old['meta']['commit']} -> {new['meta']['commit']}")
+    print(f"{'rate/S/s':>9} {'scan/ms':>7} {'lasers':>6} {'ave':>3} {'baseline':>8} " + " ".join(f"{stage:>20}" for stage in stages))
+    for r in new["results"]:
+        if key(r) not in old_results:
+            continue
+        o = old_results[key(r)]
+        cells = []
+        for stage in stages:
+            a, b = o["stages"][stage]["p50"]*1000, r["stages"][stage]["p50"]*1000
+            cells.append(f"{a:7.1f}->{b:7.1f} {b/a if a > 0 else np.nan:4.2f}x")
+        print(f"{r['sampling rate']:>9} {r['scan time']:>7} {r['lasers']:>6} {r['average']:>3} {r['baseline method']:>8} " + " ".join(f"{c:>20}" for c in cells))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark feedback loop processing stages on synthetic traces.")
+    parser.add_argument("--quick", action="store_true", help="a small grid for a quick check")
+    parser.add_argument("--cycles", type=int, default=300, help="number of cycles per configuration")
+    parser.add_argument("--arpls-channels", type=int, default=0, help="channels arPLS solves per cycle, 0 for all")
+    parser.add_argument("--output", help="json file to write, default pipeline_benchmark_<commit>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit()
+
+    if args.quick:
+        grid = {"samp_rate": [100000, 1250000], "scan_time": [2.5], "laser_num": [1, 16], "average": [1], "baseline_method": ["mean", "arPLS"]}
+    else:
+        grid = {"samp_rate": [100000, 250000, 384000, 500000, 1000000, 1250000], "scan_time": [2.5, 5.0, 10.0],
+                "laser_num": [1, 2, 4, 8, 16], "average": [1, 4], "baseline_method": ["mean", "arPLS"]}
+
+    commit = git_commit()
+    meta = {"commit": commit, "time": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+            "numpy": np.__version__, "platform": platform.platform(), "processor": platform.processor(), "cycles": args.cycles,
+            "arPLS channels": args.arpls_channels}
+    results = []
+    for samp_rate in grid["samp_rate"]:
+        for scan_time in grid["scan_time"]:
+            for laser_num in grid["laser_num"]:
+                for average in grid["average"]:
+                    for baseline_method in grid["baseline_method"]:
+                        r = benchmark(samp_rate, scan_time, laser_num, average, baseline_method, args.cycles, args.arpls_channels)
+                        results.append(r)
+                        s = r["stages"]
+                        print(f"{samp_rate:>8} S/s {scan_time:>5} ms {laser_num:>2} lasers ave {average} {baseline_method:>5}: "
+                              + ", ".join(f"{stage} {s[stage]['p50']*1000:.1f}" for stage in stages) + " us (p50)")
+
+    file_name = args.output or f"pipeline_benchmark_{commit}.json"
+    with open(file_name, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=1)
+    print(f"results saved to {file_name}")
@@ -0,0 +1,90 @@
+# Setpoint sequence client of a running lock (GUI, headless.py or supervisor.py), see core/tcpserver.py for the protocol.
+# It uploads a linear ramp for one laser (the laser has to use global frequency), subscribes to telemetry of every cycle,
+# and checks from the setpoints in telemetry records that every point was held for its dwell, i.e. the scan is cycle accurate.
+# With --trigger, points advance at external trigger edges instead (the simulated DAQ has a trigger edge every 0.1 s).
+# Usage: python sequence_client.py [--port 65532] [--laser 0] [--start 100] [--stop 200] [--steps 11] [--dwell 20] [--trigger]
+
+import sys
+import os
+import time
+import socket
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from core import tcpServer, telemetry_dtype, telemetry_ch_num
+from telemetry_client import read_at_least
+
+
+# the header and the two points of a ramp, see tcpServer
+def ramp_message(laser, start, stop, steps, dwell, trigger=False, repeat=False):
+    flags = 2 | (1 if trigger else 0) | (4 if repeat else 0)
+    return tcpServer.sequence_header.pack(tcpServer.sequence_index, laser, flags, 2) + \
+           tcpServer.msg_format.pack(dwell, start) + tcpServer.msg_format.pack(steps, stop)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a setpoint ramp on a running lock and check its timing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=65532)
+    parser.add_argument("--laser", type=int, default=0)
+    parser.add_argument("--start", type=float, default=100.0, help="MHz")
+    parser.add_argument("--stop", type=float, default=200.0, help="MHz")
+    parser.add_argument("--steps", type=int, default=11)
+    parser.add_argument("--dwell", type=int, default=20, help="cycles per point")
+    parser.add_argument("--trigger", action="store_true", help="advance at external trigger edges")
+    args = parser.parse_args()
+
+    sock = socket.create_connection((args.host, args.port))
+    sock.settimeout(5)
+    sock.sendall(tcpServer.msg_format.pack(tcpServer.subscribe_index, np.inf))
+    message = ramp_message(args.laser, args.start, args.stop, args.steps, args.dwell, args.trigger)
+    sock.sendall(message)
+    freqs = np.linspace(args.start, args.stop, args.steps)
+
+    # setpoint of the laser in every cycle, until the sequence ends
+    buffer = bytearray()
+    acked = False
+    setpoints = []
+    cycles = []
+    t0 = time.time()
+    timeout = 5 + args.steps*(0.2 if args.trigger else args.dwell*0.02)
+    while time.time() - t0 < timeout:
+        read_at_least(sock, buffer, 2)
+        index = int.from_bytes(buffer[:2], "big")
+        if index == tcpServer.sequence_index:
+            # the echo of the whole sequence
+            read_at_least(sock, buffer, len(message))
+            acked = bytes(buffer[:len(message)]) == message
+            print(f"sequence {'accepted' if acked else 'echo corrupted'} after {(time.time()-t0)*1000:.1f} ms")
+            del buffer[:len(message)]
+            continue
+        if index != tcpServer.record_index:
+            read_at_least(sock, buffer, tcpServer.msg_size)
+            del buffer[:tcpServer.msg_size]
+            continue
+        read_at_least(sock, buffer, tcpServer.record_header.size)
+        size = tcpServer.record_header.unpack(buffer[:tcpServer.record_header.size])[1]
+        n = tcpServer.record_header.size + size
+        read_at_least(sock, buffer, n)
+        record = np.frombuffer(bytes(buffer[tcpServer.record_header.size:n]), dtype=telemetry_dtype(telemetry_ch_num(size)))[0]
+        del buffer[:n]
+        if acked:
+            setpoints.append(record["setpoint"][args.laser+1])
+            cycles.append(int(record["cycle"]))
+            # the laser stays at the last point when the sequence ends
+            if np.isclose(setpoints[-1], freqs[-1], atol=1e-3) and len(setpoints) > 1 and setpoints.count(setpoints[-1]) > (1 if args.trigger else args.dwell):
+                break
+    sock.close()
+
+    # cycles each point was held for
+    setpoints = np.array(setpoints)
+    print(f"{len(setpoints)} cycles received, cycles {cycles[0] if cycles else '-'} to {cycles[-1] if cycles else '-'}, "
+          f"{(np.diff(cycles) != 1).sum() if cycles else 0} gap(s)")
+    for i, freq in enumerate(freqs):
+        held = np.flatnonzero(np.isclose(setpoints, freq, atol=1e-3))
+        if len(held) == 0:
+            print(f"point {i} ({freq:.3f} MHz): never set")
+        elif i < len(freqs) - 1:
+            print(f"point {i} ({freq:.3f} MHz): cycles {cycles[held[0]]} to {cycles[held[-1]]}, held {len(held)} cycles")
+        else:
+            print(f"point {i} ({freq:.3f} MHz): from cycle {cycles[held[0]]} on")
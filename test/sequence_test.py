@@ -0,0 +1,49 @@
+# Check that a laser goes back to the setpoint of the parameter snapshot when its setpoint sequence is cancelled mid-way,
+# or when a sequence finishes, with the feedback loop running in a thread on the simulated DAQ, as the GUI runs it.
+# Usage: python sequence_test.py [--settings ../saved_settings/config_latest.ini]
+
+import sys
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from core import daq_backend, lockParams, loopThread, load_settings
+
+# wait for a few cycles, then check the setpoint the loop actually uses for laser 0
+def check(worker, expected, what):
+    time.sleep(0.5)
+    setpoint = worker.loop.engine.laser_setpoint[0]
+    assert setpoint == expected, f"{what}: setpoint {setpoint} MHz, expected {expected} MHz"
+    print(f"{what}: setpoint {setpoint} MHz, ok")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check setpoints after setpoint sequences are cancelled or finished.")
+    parser.add_argument("--settings", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "saved_settings", "config_latest.ini"))
+    args = parser.parse_args()
+
+    config, cavity_config, laser_configs = load_settings(args.settings)
+    laser_configs[0]["freq source"] = "global"
+    laser_configs[0]["global freq"] = 100.0
+    with tempfile.TemporaryDirectory() as log_dir:
+        config["hdf_filename"] = os.path.join(log_dir, "logging")
+        config["recorder length"] = 0.0
+        worker = loopThread(lockParams(config, cavity_config, laser_configs), daq_backend("simulated"))
+        worker.start()
+        try:
+            check(worker, 100.0, "snapshot")
+
+            # a sequence that lasts much longer than this test, cancelled at its first point
+            worker.send("sequence", 0, np.array([120.0, 140.0]), np.array([10**6, 10**6]), False, False)
+            check(worker, 120.0, "sequence running")
+            worker.send("sequence", 0, None)
+            check(worker, 100.0, "sequence cancelled")
+
+            # a sequence that finishes within a few cycles
+            worker.send("sequence", 0, np.array([130.0]), np.array([3]), False, False)
+            check(worker, 100.0, "sequence finished")
+        finally:
+            worker.send("stop")
+            worker.wait()
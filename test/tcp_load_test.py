@@ -0,0 +1,171 @@
+# Load test of the TCP setpoint server (core/tcpserver.py).
+# Many scan clients send setpoints at a given rate over their own connections, some of them in randomly split pieces,
+# while a probe client sends one setpoint every 10 ms and measures how long it takes to be echoed back, i.e. to be handed to the lock.
+# Every echo is checked against the message sent, so messages of different clients mixing up would show up as corrupted.
+# By default a server is started in a separate process, and it compiles a parameter snapshot (lockParams) for every batch of setpoints
+# as the GUI does. With --port, a running lock (GUI or headless.py) is tested instead, note that it will change its global setpoints.
+# Usage: python tcp_load_test.py [--clients 50] [--rate 1000] [--duration 10] [--lasers 8] [--host 127.0.0.1 --port 65532]
+
+import sys
+import os
+import time
+import random
+import threading
+import asyncio
+import argparse
+import multiprocessing
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from core import tcpServer, lockParams
+from pipeline_benchmark import make_configs
+
+msg_format = tcpServer.msg_format
+msg_size = tcpServer.msg_size
+
+# a server as the GUI runs it, setpoints go into laser configs, and a new lockParams is compiled for every batch
+def run_server(host, port, laser_num, ready, stop, result):
+    config, cavity_config, laser_configs = make_configs(384000, 2.5, laser_num, 1, "mean")
+    counts = {"set_freq": 0, "publish": 0}
+    def set_freq(laser, freq):
+        laser_configs[laser]["global freq"] = freq
+        counts["set_freq"] += 1
+    def publish():
+        lockParams(config, cavity_config, laser_configs)
+        counts["publish"] += 1
+
+    server = tcpServer(host, port, set_freq, publish=publish)
+    ready.set()
+    threading.Thread(target=lambda: (stop.wait(), server.stop()), daemon=True).start()
+    server.serve()
+    result.put(counts)
+
+class client:
+    def __init__(self, index, laser_num, fragment):
+        self.index = index
+        self.laser = index % laser_num
+        self.fragment = fragment
+        self.sent_time = {} # sequence number: send time
+        self.seq = 0
+        self.echoed = 0
+        self.corrupted = 0
+        self.rtt = []
+        self.sending = True
+        self.last_echo = 0
+
+    # messages carry the client index and a sequence number in the frequency, so every echo can be checked
+    def message(self):
+        self.seq += 1
+        self.sent_time[self.seq] = time.perf_counter()
+        return msg_format.pack(self.laser, self.index*1e7 + self.seq)
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+
+    async def send(self, rate, duration, tick=0.001):
+        t0 = time.perf_counter()
+        sent = 0
+        while True:
+            t = time.perf_counter() - t0
+            if t >= duration:
+                break
+            n = int(t*rate) + 1 - sent
+            if n > 0:
+                data = b"".join(self.message() for i in range(n))
+                if self.fragment:
+                    # split messages at random boundaries, to check that partial messages are kept per connection
+                    i = 0
+                    while i < len(data):
+                        j = i + random.randint(1, 2*msg_size)
+                        self.writer.write(data[i:j])
+                        i = j
+                else:
+                    self.writer.write(data)
+                await self.writer.drain()
+                sent += n
+            await asyncio.sleep(tick)
+        self.sending = False
+
+    # read echoes until all messages are echoed, or none comes in timeout seconds
+    async def receive(self, timeout=5.0):
+        buffer = b""
+        while self.sending or self.echoed < self.seq:
+            try:
+                data = await asyncio.wait_for(self.reader.read(65536), timeout)
+            except asyncio.TimeoutError:
+                return
+            if not data:
+                return
+            t = time.perf_counter()
+            self.last_echo = t
+            buffer += data
+            n = len(buffer) - len(buffer) % msg_size
+            for laser, freq in msg_format.iter_unpack(buffer[:n]):
+                index, seq = divmod(round(freq), 10**7)
+                self.echoed += 1
+                if laser != self.laser or index != self.index or seq not in self.sent_time:
+                    self.corrupted += 1
+                    continue
+                self.rtt.append(t - self.sent_time.pop(seq))
+            buffer = buffer[n:]
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+def percentiles(rtt):
+    if len(rtt) == 0:
+        return "no echo"
+    p50, p99 = np.percentile(rtt, [50, 99])*1000
+    return f"p50 {p50:.2f} ms, p99 {p99:.2f} ms, max {np.max(rtt)*1000:.2f} ms"
+
+async def load_test(host, port, client_num, rate, duration, laser_num):
+    clients = [client(i+1, laser_num, fragment=(i%2 == 1)) for i in range(client_num)]
+    probe = client(0, laser_num, fragment=False)
+    for c in clients + [probe]:
+        await c.connect(host, port)
+
+    t0 = time.perf_counter()
+    receivers = [asyncio.create_task(c.receive()) for c in clients + [probe]]
+    await asyncio.gather(*[c.send(rate, duration) for c in clients], probe.send(100, duration))
+    await asyncio.gather(*receivers)
+    elapsed = max(c.last_echo for c in clients) - t0
+    for c in clients + [probe]:
+        await c.close()
+
+    sent = sum(c.seq for c in clients)
+    echoed = sum(c.echoed for c in clients)
+    print(f"{client_num} scan clients at {rate} messages/s each, for {duration} s")
+    print(f"scan clients: {sent} sent, {echoed} echoed ({echoed/elapsed:.0f} messages/s), {sum(c.corrupted for c in clients)} corrupted, "
+          f"{sum(len(c.sent_time) for c in clients)} not echoed")
+    print(f"scan clients round trip: {percentiles(np.concatenate([c.rtt for c in clients]))}")
+    print(f"probe round trip: {percentiles(probe.rtt)}, {probe.corrupted} corrupted, {len(probe.sent_time)} not echoed")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of the TCP setpoint server.")
+    parser.add_argument("--clients", type=int, default=50, help="number of scan clients")
+    parser.add_argument("--rate", type=float, default=1000, help="messages per second of every scan client")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to send messages")
+    parser.add_argument("--lasers", type=int, default=8, help="number of lasers of the test server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="port of a running lock to test, a test server is started if not given")
+    args = parser.parse_args()
+
+    server = None
+    if args.port is None:
+        ctx = multiprocessing.get_context("spawn")
+        ready, stop, result = ctx.Event(), ctx.Event(), ctx.Queue()
+        port = 65400
+        server = ctx.Process(target=run_server, args=(args.host, port, args.lasers, ready, stop, result))
+        server.start()
+        ready.wait()
+    else:
+        port = args.port
+
+    asyncio.run(load_test(args.host, port, args.clients, args.rate, args.duration, args.lasers))
+
+    if server is not None:
+        stop.set()
+        counts = result.get()
+        server.join()
+        print(f"server: {counts['set_freq']} setpoints applied in {counts['publish']} parameter snapshots")
@@ -0,0 +1,87 @@
+# Telemetry client of a running lock (GUI, headless.py or supervisor.py), see core/tcpserver.py for the protocol.
+# It subscribes at the given rate, prints every record received (or a summary per second with --quiet),
+# and reports how many records came in, and how many cycles were skipped between them.
+# Usage: python telemetry_client.py [--host 127.0.0.1] [--port 65532] [--rate 10] [--duration 10] [--quiet]
+
+import sys
+import os
+import time
+import socket
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from core import tcpServer, telemetry_dtype, telemetry_ch_num
+
+
+# read from sock until the buffer holds at least n bytes
+def read_at_least(sock, buffer, n):
+    while len(buffer) < n:
+        data = sock.recv(65536)
+        if not data:
+            raise ConnectionError("server closed the connection.")
+        buffer += data
+
+def print_record(record):
+    flags = record["flags"]
+    line = f"lock {record['lock']} cycle {record['cycle']} {time.strftime('%H:%M:%S', time.localtime(record['time']))} " \
+           f"first peak {record['cavity first peak']:.4f} ms sep {record['cavity pk sep']:.4f} ms |"
+    for ch in range(len(flags)):
+        state = "L" if flags[ch] & 2 else ("f" if flags[ch] & 1 else "-")
+        line += f" {state} {record['setpoint'][ch]:8.2f} {record['error'][ch]:+8.3f} MHz {record['output'][ch]:+7.4f} V |"
+    print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Subscribe to telemetry of a running lock.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=65532)
+    parser.add_argument("--rate", type=float, default=10, help="records per second, inf for every cycle")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to listen")
+    parser.add_argument("--quiet", action="store_true", help="only print a summary every second")
+    args = parser.parse_args()
+
+    sock = socket.create_connection((args.host, args.port))
+    sock.settimeout(5)
+    sock.sendall(tcpServer.msg_format.pack(tcpServer.subscribe_index, args.rate))
+
+    buffer = bytearray()
+    received = 0
+    skipped = 0
+    last_cycle = {} # lock index: cycle of the last record
+    t0 = time.time()
+    last_summary = t0
+    while time.time() - t0 < args.duration:
+        read_at_least(sock, buffer, 2)
+        index = int.from_bytes(buffer[:2], "big")
+        if index != tcpServer.record_index:
+            # echo of a setpoint or of the subscription
+            read_at_least(sock, buffer, tcpServer.msg_size)
+            index, value = tcpServer.msg_format.unpack(buffer[:tcpServer.msg_size])
+            if index == tcpServer.subscribe_index:
+                print(f"subscribed at {value} records/s")
+            del buffer[:tcpServer.msg_size]
+            continue
+
+        read_at_least(sock, buffer, tcpServer.record_header.size)
+        _, size = tcpServer.record_header.unpack(buffer[:tcpServer.record_header.size])
+        n = tcpServer.record_header.size + size
+        read_at_least(sock, buffer, n)
+        record = np.frombuffer(bytes(buffer[tcpServer.record_header.size:n]), dtype=telemetry_dtype(telemetry_ch_num(size)))[0]
+        del buffer[:n]
+
+        received += 1
+        lock = int(record["lock"])
+        if lock in last_cycle:
+            skipped += int(record["cycle"]) - last_cycle[lock] - 1
+        last_cycle[lock] = int(record["cycle"])
+        if not args.quiet:
+            print_record(record)
+        elif time.time() - last_summary >= 1:
+            last_summary = time.time()
+            print(f"{received} records, {received/(last_summary-t0):.1f} records/s")
+
+    # unsubscribe, then close
+    sock.sendall(tcpServer.msg_format.pack(tcpServer.subscribe_index, 0))
+    sock.close()
+    elapsed = time.time() - t0
+    print(f"{received} records in {elapsed:.1f} s ({received/elapsed:.1f} records/s), {skipped} cycles between them not sent")
@@ -0,0 +1,90 @@
+# Benchmark of loop rate and cycle jitter of the feedback loop in its trigger modes (see "trigger mode" in README):
+# "software" (a do pulse retriggers the counter for every scan), "software" pipelined, and "free running" (the counter starts scans by itself).
+# The loop runs as the GUI runs it, in a thread with the settings file given, for a while in every mode, then cycle periods are
+# taken from the timestamps of latencyRecorder. The simulated DAQ is used by default, --backend nidaqmx runs it on real hardware.
+# With --stall, another thread of this process holds the GIL for up to that long at a time, as a busy GUI does in thread mode,
+# a free running loop stops with an ao underflow if it stalls for longer than its ao lead, which is then reported.
+# Usage: python trigger_benchmark.py [--settings ../saved_settings/config_latest.ini] [--backend simulated] [--duration 10] [--cycle-period 0]
+#                                    [--ao-lead 20] [--stall 0]
+
+import sys
+import os
+import time
+import argparse
+import threading
+import tempfile
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from core import daq_backend, lockParams, loopThread, load_settings
+
+modes = [("software", False), ("software", True), ("free running", False)]
+
+# run the loop in one mode for duration seconds, returns its latencyRecorder, config, and whether it ran until stopped
+def run(settings, backend_name, trigger_mode, pipeline, cycle_period, ao_lead, duration, log_dir):
+    config, cavity_config, laser_configs = load_settings(settings)
+    config["trigger mode"] = trigger_mode
+    config["pipeline"] = pipeline
+    config["cycle period"] = cycle_period
+    config["ao lead"] = ao_lead
+    config["hdf_filename"] = os.path.join(log_dir, "logging")
+    config["recorder length"] = 0.0
+    worker = loopThread(lockParams(config, cavity_config, laser_configs), daq_backend(backend_name))
+    worker.start()
+    time.sleep(duration)
+    worker.send("stop")
+    return worker.latency, config, worker.wait() is not None
+
+# hold the GIL for stall seconds every 0.1 s, the switch interval is raised so it isn't handed over in between
+def stall_thread(stall):
+    sys.setswitchinterval(stall)
+    while True:
+        t_end = time.perf_counter() + stall
+        while time.perf_counter() < t_end:
+            pass
+        time.sleep(0.1)
+
+# loop rate and cycle period statistics, None if the loop didn't run long enough
+def summary(latency):
+    history = latency.history()
+    if len(history) < 3:
+        return None
+    periods = np.diff(history[1:, 0])*1000 # the first cycle includes start-up, in ms
+    stage = lambda name, q: np.percentile(history[:, 1+latency.index[name]], q)
+    return {"cycles": len(history), "rate": 1000/np.mean(periods), "mean": np.mean(periods), "std": np.std(periods),
+            "p1": np.percentile(periods, 1), "p50": np.percentile(periods, 50), "p99": np.percentile(periods, 99), "max": np.max(periods),
+            "trigger p50": stage("trigger", 50), "trigger p99": stage("trigger", 99), "read p50": stage("read", 50)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare loop rate and jitter of the trigger modes of the feedback loop.")
+    parser.add_argument("--settings", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "saved_settings", "config_latest.ini"))
+    parser.add_argument("--backend", default="simulated", help="simulated or nidaqmx")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per mode")
+    parser.add_argument("--cycle-period", type=float, default=0.0, help="cycle period in ms of free running mode, 0 for back-to-back scans")
+    parser.add_argument("--ao-lead", type=float, default=20.0, help="ao lead in ms of free running mode")
+    parser.add_argument("--stall", type=float, default=0.0, help="ms the loop thread is stalled at a time by another thread, 0 for none")
+    args = parser.parse_args()
+
+    if args.stall > 0:
+        threading.Thread(target=stall_thread, args=(args.stall/1000,), name="stall", daemon=True).start()
+
+    results = []
+    with tempfile.TemporaryDirectory() as log_dir:
+        for trigger_mode, pipeline in modes:
+            latency, config, completed = run(args.settings, args.backend, trigger_mode, pipeline, args.cycle_period, args.ao_lead, args.duration, log_dir)
+            name = trigger_mode + (" pipelined" if pipeline else "")
+            if not completed:
+                print(f"{name}: the loop stopped after {latency.cycle} cycles with a DAQ error, see above")
+            results.append((name, summary(latency)))
+
+    print(f"{args.backend} DAQ, scan time {config['scan time']} ms, sampling rate {config['sampling rate']} S/s, "
+          f"{config['num of lasers']} lasers, average {config['average']}, cycle period {args.cycle_period} ms, "
+          f"ao lead {args.ao_lead} ms, stall {args.stall} ms")
+    print(f"{'mode':>20} {'cycles':>7} {'rate/Hz':>8} | cycle period/ms: {'mean':>7} {'std':>7} {'p1':>7} {'p50':>7} {'p99':>7} {'max':>7} "
+          f"| trigger/ms: {'p50':>6} {'p99':>6} | read/ms: {'p50':>6}")
+    for name, r in results:
+        if r is None:
+            print(f"{name:>20} {'-':>7}")
+            continue
+        print(f"{name:>20} {r['cycles']:>7} {r['rate']:>8.1f} | {'':>16} {r['mean']:>7.3f} {r['std']:>7.3f} {r['p1']:>7.3f} {r['p50']:>7.3f} "
+              f"{r['p99']:>7.3f} {r['max']:>7.3f} | {'':>11} {r['trigger p50']:>6.3f} {r['trigger p99']:>6.3f} | {'':>8} {r['read p50']:>6.3f}")